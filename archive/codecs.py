@@ -0,0 +1,149 @@
+# Compression codecs of the backup archives
+# Zip based codecs keep the compression method of every member in the archive itself, so any zip reader
+# (and so restore) can unpack them. zstd and lz4 are not supported by zip, they compress a tar stream instead,
+# and the codec is recorded as the suffix of the remote file name (e.g. <date>.tar.zst)
+import os
+import tarfile
+import zipfile
+import zlib
+
+from typing import BinaryIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+DEFAULT_CODEC = 'deflate'
+
+# Files that are compressed already, compressing them again only burns CPU
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.7z', '.bz2', '.gz', '.lz4', '.rar', '.tgz', '.xz', '.zip', '.zst',
+    '.avi', '.flac', '.heic', '.jpeg', '.jpg', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.png', '.webm',
+    '.webp',
+}
+SAMPLE_SIZE = 64 * 1024
+# If the sample shrinks by less than 5%, the file is stored as is
+INCOMPRESSIBLE_RATIO = 0.95
+
+
+def is_incompressible(path: str) -> bool:
+    """
+    Guesses whether compressing the file is worth it: by its extension, or by compressing a sample of it
+    """
+    if os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return True
+    try:
+        with open(path, 'rb') as f:
+            sample = f.read(SAMPLE_SIZE)
+    except OSError:
+        return False
+    # Small files are cheap to compress whatever they are
+    if len(sample) < SAMPLE_SIZE:
+        return False
+    return len(zlib.compress(sample, 1)) > len(sample) * INCOMPRESSIBLE_RATIO
+
+
+class ZipCodec:
+    """A codec that writes zip archives, compressing every member with compress_type"""
+
+    suffix = ''
+
+    def __init__(self, name: str, compress_type: int, level: int or None = None):
+        self.name = name
+        self.compress_type = compress_type
+        self.level = level
+
+    def member_options(self, path: str) -> dict:
+        """
+        Returns the options for ZipFile.write for the file, incompressible files are stored
+        """
+        if self.compress_type == zipfile.ZIP_STORED or os.path.isdir(path) or is_incompressible(path):
+            return {'compress_type': zipfile.ZIP_STORED}
+        return {'compress_type': self.compress_type, 'compresslevel': self.level}
+
+    def extract(self, archive_path: str, target: str) -> None:
+        with zipfile.ZipFile(archive_path) as zf:
+            zf.extractall(target)
+
+
+class TarCodec:
+    """A codec that writes a tar stream compressed as a whole"""
+
+    def __init__(self, name: str, suffix: str, level: int or None = None):
+        self.name = name
+        self.suffix = suffix
+        self.level = level
+
+    def compressor(self, fileobj: BinaryIO) -> BinaryIO:
+        """
+        Wraps fileobj, everything written to the result is compressed to fileobj
+        """
+        if self.name == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=self.level or 3, threads=-1)
+            return compressor.stream_writer(fileobj, closefd=False)
+        return lz4_frame.LZ4FrameFile(fileobj, 'wb', compression_level=self.level or 0)
+
+    def decompressor(self, fileobj: BinaryIO) -> BinaryIO:
+        """
+        Wraps fileobj, reading from the result gives decompressed data
+        """
+        if self.name == 'zstd':
+            return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+        return lz4_frame.LZ4FrameFile(fileobj, 'rb')
+
+    def extract(self, archive_path: str, target: str) -> None:
+        with open(archive_path, 'rb') as f:
+            self.extract_stream(f, target)
+
+    def extract_stream(self, fileobj: BinaryIO, target: str) -> None:
+        """
+        Unpacks the archive while reading it from fileobj, fileobj doesn't have to be seekable
+        """
+        with self.decompressor(fileobj) as stream, tarfile.open(fileobj=stream, mode='r|') as tar:
+            if hasattr(tarfile, 'data_filter'):
+                tar.extractall(target, filter='data')
+            else:
+                tar.extractall(target)
+
+
+def get_codec(name: str = DEFAULT_CODEC, level: int or None = None) -> ZipCodec or TarCodec:
+    """
+    Returns the codec by name: store, deflate, bzip2, lzma, zstd or lz4
+    :param level: a compression level, the default of the codec if not given
+    :raises: ValueError if there is no such codec or its package is not installed
+    """
+    name = name.lower()
+    if name == 'store':
+        return ZipCodec(name, zipfile.ZIP_STORED)
+    if name == 'deflate':
+        return ZipCodec(name, zipfile.ZIP_DEFLATED, level)
+    if name == 'bzip2':
+        return ZipCodec(name, zipfile.ZIP_BZIP2, level)
+    if name == 'lzma':
+        return ZipCodec(name, zipfile.ZIP_LZMA)
+    if name == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd codec needs the zstandard package: pip install zstandard')
+        return TarCodec(name, '.tar.zst', level)
+    if name == 'lz4':
+        if lz4_frame is None:
+            raise ValueError('lz4 codec needs the lz4 package: pip install lz4')
+        return TarCodec(name, '.tar.lz4', level)
+    raise ValueError(f'There is no codec named {name}. Use one of: store, deflate, bzip2, lzma, zstd, lz4')
+
+
+def get_codec_by_remote_path(remote_path: str) -> ZipCodec or TarCodec:
+    """
+    Returns the codec that the backup on remote_path was made with
+    """
+    if remote_path.endswith('.tar.zst'):
+        return get_codec('zstd')
+    if remote_path.endswith('.tar.lz4'):
+        return get_codec('lz4')
+    return get_codec(DEFAULT_CODEC)
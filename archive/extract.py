@@ -0,0 +1,138 @@
+# Pipelined zip extraction
+# Members are extracted from a stream of the archive body while it is being downloaded, so the archive is never
+# written to the disk. The member list comes from the central directory, which has to be read beforehand
+# (e.g. with a Range request). Small members are handed to a pool of threads to decompress and write,
+# large ones are decompressed in place block by block, so only a bounded amount of the archive is in memory
+import io
+import os
+import shutil
+import struct
+import zipfile
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from typing import BinaryIO, Iterable, List
+
+EXTRACT_WORKERS = 4
+# Members up to this size are read into memory and written by the pool
+SMALL_MEMBER_SIZE = 1024 * 1024
+# How many small members can wait for the pool
+QUEUED_MEMBERS_PER_WORKER = 4
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+def member_path(target: str, name: str) -> str:
+    """
+    Returns where the member goes in target, dropping '..' and absolute parts of the name the way zipfile does
+    """
+    name = os.path.splitdrive(name.replace('/', os.path.sep))[1]
+    parts = [part for part in name.split(os.path.sep) if part not in ('', os.path.curdir, os.path.pardir)]
+    return os.path.join(target, *parts)
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        block = stream.read(min(size - len(data), COPY_BLOCK_SIZE))
+        if not block:
+            raise zipfile.BadZipFile('The archive ended unexpectedly')
+        data += block
+    return bytes(data)
+
+
+def _skip(stream: BinaryIO, size: int) -> None:
+    while size > 0:
+        block = stream.read(min(size, COPY_BLOCK_SIZE))
+        if not block:
+            raise zipfile.BadZipFile('The archive ended unexpectedly')
+        size -= len(block)
+
+
+class _CountingReader:
+    """Counts the bytes read from the stream"""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+def _write_member(info: zipfile.ZipInfo, compressed: BinaryIO, path: str) -> None:
+    """
+    Decompresses the member to path, the crc is checked by ZipExtFile
+    """
+    with zipfile.ZipExtFile(compressed, 'r', info) as source, open(path, 'wb') as f:
+        shutil.copyfileobj(source, f, COPY_BLOCK_SIZE)
+
+
+def extract_stream(stream: BinaryIO, infos: List[zipfile.ZipInfo], target: str, start: int = 0,
+                   names: Iterable[str] or None = None, workers: int = EXTRACT_WORKERS) -> List[str]:
+    """
+    Extracts the members of a zip archive from the stream of its body
+    :param stream: A stream of the archive starting at offset start, read only forward
+    :param infos: Members of the archive as read from its central directory
+    :param target: A directory to extract to
+    :param start: The offset of the archive the stream starts at, the offset of a local header
+    :param names: Names of the members to extract, all of them if not given. Others are read through
+    :param workers: How many threads write small members
+    :return: extracted names
+    """
+    wanted = set(names) if names is not None else None
+    infos = sorted((info for info in infos if info.header_offset >= start), key=lambda info: info.header_offset)
+    if wanted is not None:
+        last = max((info.header_offset for info in infos if info.filename in wanted), default=-1)
+        infos = [info for info in infos if info.header_offset <= last]
+
+    position = start
+    extracted = []
+    queued = BoundedSemaphore(workers * QUEUED_MEMBERS_PER_WORKER)
+    futures = deque()
+
+    def _write_queued(info: zipfile.ZipInfo, data: bytes, path: str) -> None:
+        try:
+            _write_member(info, io.BytesIO(data), path)
+        finally:
+            queued.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for info in infos:
+            _skip(stream, info.header_offset - position)
+            header = _read_exactly(stream, zipfile.sizeFileHeader)
+            signature, *_, name_length, extra_length = struct.unpack(zipfile.structFileHeader, header)
+            if signature != zipfile.stringFileHeader:
+                raise zipfile.BadZipFile(f'Bad local header of {info.filename}')
+            _skip(stream, name_length + extra_length)
+            position = info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+
+            if wanted is not None and info.filename not in wanted:
+                continue
+
+            path = member_path(target, info.filename)
+            extracted.append(info.filename)
+            if info.is_dir():
+                os.makedirs(path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            if info.compress_size <= SMALL_MEMBER_SIZE:
+                data = _read_exactly(stream, info.compress_size)
+                queued.acquire()
+                futures.append(executor.submit(_write_queued, info, data, path))
+            else:
+                member = _CountingReader(stream)
+                _write_member(info, member, path)
+                _skip(stream, info.compress_size - member.count)
+            position += info.compress_size
+
+            # Failures are reported as soon as they are seen, not after the whole archive is read
+            while futures and futures[0].done():
+                futures.popleft().result()
+
+        for future in futures:
+            future.result()
+    return extracted
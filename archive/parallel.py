@@ -0,0 +1,306 @@
+# Parallel zip archiver
+# Files are split into blocks that are deflated on a pool of processes, and the blocks are written in order,
+# so the result is an ordinary zip archive. Every block is compressed with the last 32 KiB of the previous block
+# as a dictionary and ends with a sync flush, so the blocks of a file concatenate into one deflate stream
+# that any zip reader unpacks. Only a few blocks per worker are in flight, whatever the size of the files
+import multiprocessing
+import os
+import struct
+import time
+import zipfile
+import zlib
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import BinaryIO, Dict, List, Tuple
+
+from archive.codecs import ZipCodec, get_codec
+
+BLOCK_SIZE = 1024 * 1024
+# How many blocks per worker can be compressed ahead of the writer
+BLOCKS_IN_FLIGHT_PER_WORKER = 2
+DICTIONARY_SIZE = 32 * 1024
+DATA_DESCRIPTOR_FLAG = 0x08
+UTF8_FLAG = 0x800
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+CRC32_POLYNOMIAL = 0xEDB88320
+
+
+def _gf2_matrix_times(matrix: List[int], vector: int) -> int:
+    result = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return result
+
+
+def _gf2_matrix_square(matrix: List[int]) -> List[int]:
+    return [_gf2_matrix_times(matrix, row) for row in matrix]
+
+
+def process_context() -> multiprocessing.context.BaseContext:
+    """
+    The start method of the process pools. A pool can be started from a thread while other threads hold locks,
+    e.g. of urllib3 during an upload, and a process forked at that moment inherits the held locks and can hang.
+    The workers are forked by the forkserver instead, a process with one thread, or spawned where there is none
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+@lru_cache(maxsize=64)
+def _zeros_operator(length: int) -> Tuple[int, ...]:
+    """
+    Returns the matrix that turns the crc of some data to the crc of the data followed by length zero bytes
+    """
+    # One zero bit, then one zero byte
+    operator = [CRC32_POLYNOMIAL] + [1 << n for n in range(31)]
+    for _ in range(3):
+        operator = _gf2_matrix_square(operator)
+
+    result = None
+    while length:
+        if length & 1:
+            result = operator if result is None else [_gf2_matrix_times(operator, row) for row in result]
+        length >>= 1
+        if length:
+            operator = _gf2_matrix_square(operator)
+    return tuple(result)
+
+
+def crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    """
+    Returns the crc32 of two pieces of data from their crc32s, like zlib's crc32_combine
+    :param crc1: crc32 of the first piece
+    :param crc2: crc32 of the second piece
+    :param length2: length of the second piece
+    """
+    if length2 <= 0:
+        return crc1
+    return _gf2_matrix_times(_zeros_operator(length2), crc1) ^ crc2
+
+
+def _deflate(data: bytes, dictionary: bytes, level: int, last: bool) -> bytes:
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+                                      zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _compress_block(path: str, offset: int, length: int, level: int, last: bool) -> Tuple[bytes, int, int]:
+    """
+    Deflates a block of the file, runs on the pool
+    :return: compressed block, crc32 and length of the block
+    """
+    start = max(0, offset - DICTIONARY_SIZE)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        dictionary = f.read(offset - start)
+        data = f.read(length)
+    return _deflate(data, dictionary, level, last), zlib.crc32(data), len(data)
+
+
+def _store_block(path: str, offset: int, length: int) -> Tuple[bytes, int, int]:
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    return data, zlib.crc32(data), len(data)
+
+
+def _done(result) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class _Entry:
+    """A member of the archive that is being written"""
+
+    def __init__(self, zinfo: zipfile.ZipInfo, zip64: bool):
+        self.zinfo = zinfo
+        self.zip64 = zip64
+
+
+class _ZipWriter:
+    """
+    Writes the zip container: local headers, data, data descriptors and the central directory.
+    Doesn't seek, so fileobj can be a pipe
+    """
+
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.position = 0
+        self.entries: List[_Entry] = []
+
+    def _write(self, data: bytes) -> None:
+        self.fileobj.write(data)
+        self.position += len(data)
+
+    def start(self, entry: _Entry) -> None:
+        zinfo = entry.zinfo
+        zinfo.header_offset = self.position
+        zinfo.flag_bits |= _name_flags(zinfo.filename)
+        # Sizes and crc are counted while the blocks are written
+        zinfo.CRC = zinfo.compress_size = zinfo.file_size = 0
+        self._write(zinfo.FileHeader(entry.zip64))
+
+    def write_block(self, entry: _Entry, data: bytes, crc: int, length: int) -> None:
+        zinfo = entry.zinfo
+        self._write(data)
+        zinfo.CRC = crc32_combine(zinfo.CRC, crc, length) if zinfo.file_size else crc
+        zinfo.compress_size += len(data)
+        zinfo.file_size += length
+
+    def finish(self, entry: _Entry) -> None:
+        zinfo = entry.zinfo
+        if zinfo.flag_bits & DATA_DESCRIPTOR_FLAG:
+            self._write(struct.pack('<LLQQ' if entry.zip64 else '<LLLL', DATA_DESCRIPTOR_SIGNATURE,
+                                    zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+        self.entries.append(entry)
+
+    def close(self) -> None:
+        """
+        Writes the central directory, the same way zipfile does
+        """
+        start_dir = self.position
+        for entry in self.entries:
+            zinfo = entry.zinfo
+            dt = zinfo.date_time
+            dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
+            dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+
+            zip64_fields = []
+            file_size, compress_size, header_offset = zinfo.file_size, zinfo.compress_size, zinfo.header_offset
+            if file_size > zipfile.ZIP64_LIMIT or compress_size > zipfile.ZIP64_LIMIT:
+                zip64_fields += [file_size, compress_size]
+                file_size = compress_size = 0xffffffff
+            if header_offset > zipfile.ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = 0xffffffff
+            extra = b''
+            version = zinfo.extract_version
+            if zip64_fields:
+                extra = struct.pack('<HH' + 'Q' * len(zip64_fields), 1, 8 * len(zip64_fields), *zip64_fields)
+                version = max(version, zipfile.ZIP64_VERSION)
+
+            filename = _encode_name(zinfo.filename)
+            self._write(struct.pack(zipfile.structCentralDir, zipfile.stringCentralDir,
+                                    max(version, zinfo.create_version), zinfo.create_system, version,
+                                    zinfo.reserved, zinfo.flag_bits, zinfo.compress_type, dostime, dosdate,
+                                    zinfo.CRC, compress_size, file_size, len(filename), len(extra), 0, 0,
+                                    zinfo.internal_attr, zinfo.external_attr, header_offset))
+            self._write(filename)
+            self._write(extra)
+
+        end_dir = self.position
+        count, size, offset = len(self.entries), end_dir - start_dir, start_dir
+        if count > zipfile.ZIP_FILECOUNT_LIMIT or offset > zipfile.ZIP64_LIMIT or size > zipfile.ZIP64_LIMIT:
+            self._write(struct.pack(zipfile.structEndArchive64, zipfile.stringEndArchive64,
+                                    44, 45, 45, 0, 0, count, count, size, offset))
+            self._write(struct.pack(zipfile.structEndArchive64Locator, zipfile.stringEndArchive64Locator,
+                                    0, end_dir, 1))
+            count, size, offset = min(count, 0xFFFF), min(size, 0xFFFFFFFF), min(offset, 0xFFFFFFFF)
+        self._write(struct.pack(zipfile.structEndArchive, zipfile.stringEndArchive,
+                                0, 0, count, count, size, offset, 0))
+        self.fileobj.flush()
+
+
+def _encode_name(name: str) -> bytes:
+    try:
+        return name.encode('ascii')
+    except UnicodeEncodeError:
+        return name.encode('utf-8')
+
+
+def _name_flags(name: str) -> int:
+    try:
+        name.encode('ascii')
+        return 0
+    except UnicodeEncodeError:
+        return UTF8_FLAG
+
+
+def can_write_parallel(codec: ZipCodec or None) -> bool:
+    """
+    Tells whether the archive can be made by write_members_parallel. Deflate streams are the only ones
+    that can be compressed by blocks and joined, other codecs are written by one process
+    """
+    codec = codec or get_codec()
+    return isinstance(codec, ZipCodec) and codec.compress_type == zipfile.ZIP_DEFLATED
+
+
+def write_members_parallel(members: List[Tuple[str, str]], fileobj: BinaryIO, extra: Dict[str, bytes] or None = None,
+                           codec: ZipCodec or None = None, workers: int or None = None,
+                           block_size: int = BLOCK_SIZE) -> None:
+    """
+    Writes a zip archive of the chosen files to fileobj, deflating them on a pool of processes
+    :param members: A list of (local path, name in the archive) pairs
+    :param fileobj: A binary file-like object to write to, does not have to be seekable
+    :param extra: Additional members given as {name in the archive: content}
+    :param codec: A deflate codec from archive.codecs, see can_write_parallel
+    :param workers: How many processes to compress with, defaults to the number of CPUs
+    :param block_size: Size of the blocks that files are compressed by
+    """
+    codec = codec or get_codec()
+    if not can_write_parallel(codec):
+        raise ValueError(f'{codec.name} archives can\'t be written in parallel')
+    level = codec.level if codec.level is not None else zlib.Z_DEFAULT_COMPRESSION
+    workers = workers or os.cpu_count() or 1
+
+    writer = _ZipWriter(fileobj)
+    # (entry, index of the block, count of the blocks, future of the block or None)
+    pending = deque()
+
+    def _write_next() -> None:
+        entry, index, count, future = pending.popleft()
+        if index == 0:
+            writer.start(entry)
+        if future is not None:
+            writer.write_block(entry, *future.result())
+        if index >= count - 1:
+            writer.finish(entry)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_context()) as executor:
+        for local_path, name in members:
+            zinfo = zipfile.ZipInfo.from_file(local_path, name)
+            if zinfo.is_dir():
+                pending.append((_Entry(zinfo, False), 0, 0, None))
+                continue
+
+            options = codec.member_options(local_path)
+            zinfo.compress_type = options['compress_type']
+            zinfo.flag_bits |= DATA_DESCRIPTOR_FLAG
+            # The same guess zipfile makes when the compressed size is not known yet
+            entry = _Entry(zinfo, zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT)
+
+            count = max(1, -(-zinfo.file_size // block_size))
+            for index in range(count):
+                offset, last = index * block_size, index == count - 1
+                # The last block reads the rest of the file, in case it has grown
+                length = -1 if last else block_size
+                if zinfo.compress_type == zipfile.ZIP_STORED:
+                    future = _done(_store_block(local_path, offset, length))
+                else:
+                    future = executor.submit(_compress_block, local_path, offset, length, level, last)
+                pending.append((entry, index, count, future))
+                while len(pending) > workers * BLOCKS_IN_FLIGHT_PER_WORKER:
+                    _write_next()
+
+        for name, content in (extra or {}).items():
+            zinfo = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+            zinfo.external_attr = 0o600 << 16
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            zinfo.flag_bits |= DATA_DESCRIPTOR_FLAG
+            block = (_deflate(content, b'', level, True), zlib.crc32(content), len(content))
+            pending.append((_Entry(zinfo, False), 0, 1, _done(block)))
+
+        while pending:
+            _write_next()
+
+    writer.close()
@@ -0,0 +1,187 @@
+# Streaming archiver
+# Produces the same archive layout as shutil.make_archive, also as a stream of chunks, so the archive can be sent
+# to the storage while it is being compressed and nothing is staged on the local disk
+import io
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+
+from typing import BinaryIO, Callable, Dict, Iterator, List, Tuple
+
+from archive.codecs import ZipCodec, TarCodec, get_codec
+from archive.parallel import can_write_parallel, write_members_parallel
+from database.stat_cache import StatCache
+from scanner.walk import walk
+
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+STREAM_MAX_BUFFERED_CHUNKS = 4
+
+_END_OF_STREAM = None
+
+
+class StreamAborted(Exception):
+    """Raised in the archiving thread when the consumer of the stream went away"""
+
+
+class _BoundedPipe:
+    """
+    A write-only file-like object that hands the written bytes to the reader in chunks of chunk_size.
+    The queue between the writer and the reader is bounded, so the writer blocks when the reader is slow
+    """
+
+    def __init__(self, chunk_size: int, max_buffered_chunks: int):
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=max_buffered_chunks)
+        self.aborted = threading.Event()
+        self._buffer = bytearray()
+
+    def _put(self, item) -> None:
+        # We don't block forever, otherwise the writer would hang if the reader stopped reading
+        while True:
+            if self.aborted.is_set():
+                raise StreamAborted()
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._put(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._put(_END_OF_STREAM)
+
+
+def list_members(resource_path: str, cache: StatCache or None = None) -> List[Tuple[str, str]]:
+    """
+    Lists what goes to the archive of the resource as (local path, name in the archive) pairs.
+    The layout is the same that shutil.make_archive produces:
+    a file is stored under its own name, a directory is stored relative to its root
+    :param cache: Where to take the listings of unchanged directories from, see scanner.walk
+    """
+    if os.path.isfile(resource_path):
+        return [(resource_path, os.path.basename(os.path.abspath(resource_path)))]
+
+    members = []
+    for dirpath, dirnames, filenames in walk(resource_path, cache=cache):
+        relative_dirpath = os.path.relpath(dirpath, resource_path)
+        for name in sorted(dirnames):
+            members.append((os.path.join(dirpath, name), os.path.normpath(os.path.join(relative_dirpath, name))))
+        for name in filenames:
+            members.append((os.path.join(dirpath, name), os.path.normpath(os.path.join(relative_dirpath, name))))
+    return members
+
+
+def write_archive(resource_path: str, fileobj: BinaryIO, codec: ZipCodec or TarCodec or None = None,
+                  workers: int or None = 1, cache: StatCache or None = None) -> None:
+    """
+    Writes an archive of the resource to fileobj, see list_members for the layout
+    :param resource_path: A path to the file or directory to archive
+    :param fileobj: A binary file-like object to write to, does not have to be seekable
+    :param codec: A codec from archive.codecs, deflate by default
+    :param workers: How many processes to compress with, None for the number of CPUs
+    :param cache: Where to take the listings of unchanged directories from, see scanner.walk
+    """
+    write_members(list_members(resource_path, cache), fileobj, codec=codec, workers=workers)
+
+
+def write_members(members: List[Tuple[str, str]], fileobj: BinaryIO, extra: Dict[str, bytes] or None = None,
+                  codec: ZipCodec or TarCodec or None = None, workers: int or None = 1) -> None:
+    """
+    Writes an archive of the chosen files to fileobj
+    :param members: A list of (local path, name in the archive) pairs
+    :param fileobj: A binary file-like object to write to, does not have to be seekable
+    :param extra: Additional members given as {name in the archive: content}
+    :param codec: A codec from archive.codecs, deflate by default
+    :param workers: How many processes to compress with, None for the number of CPUs.
+                    Only deflate archives are compressed in parallel, see archive.parallel
+    """
+    codec = codec or get_codec()
+    if workers != 1 and can_write_parallel(codec):
+        write_members_parallel(members, fileobj, extra, codec, workers)
+        return
+
+    if isinstance(codec, TarCodec):
+        with codec.compressor(fileobj) as compressed, tarfile.open(fileobj=compressed, mode='w|') as tar:
+            for local_path, name in members:
+                tar.add(local_path, name, recursive=False)
+            for name, content in (extra or {}).items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        return
+
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for local_path, name in members:
+            zf.write(local_path, name, **codec.member_options(local_path))
+        for name, content in (extra or {}).items():
+            zf.writestr(name, content)
+
+
+def stream_archive(resource_path: str, chunk_size: int = STREAM_CHUNK_SIZE,
+                   max_buffered_chunks: int = STREAM_MAX_BUFFERED_CHUNKS,
+                   codec: ZipCodec or TarCodec or None = None, workers: int or None = 1,
+                   cache: StatCache or None = None) -> Iterator[bytes]:
+    """
+    Archives the resource in a background thread and yields the archive in chunks as soon as they are ready.
+    At most max_buffered_chunks chunks are kept in memory, then the archiving waits for the consumer
+    :param resource_path: A path to the file or directory to archive
+    :param chunk_size: A size of the yielded chunks in bytes, the last chunk may be smaller
+    :param max_buffered_chunks: How many chunks can be produced ahead of the consumer
+    :param codec: A codec from archive.codecs, deflate by default
+    :param workers: How many processes to compress with, None for the number of CPUs
+    :param cache: Where to take the listings of unchanged directories from, see scanner.walk
+    :return: generator of bytes
+    """
+    return stream_writer(lambda f: write_archive(resource_path, f, codec, workers, cache), chunk_size,
+                         max_buffered_chunks)
+
+
+def stream_writer(write: Callable[[BinaryIO], None], chunk_size: int = STREAM_CHUNK_SIZE,
+                  max_buffered_chunks: int = STREAM_MAX_BUFFERED_CHUNKS) -> Iterator[bytes]:
+    """
+    Runs write(fileobj) in a background thread and yields whatever it writes in chunks, see stream_archive
+    """
+    pipe = _BoundedPipe(chunk_size, max_buffered_chunks)
+    errors = []
+
+    def _archive():
+        try:
+            write(pipe)
+            pipe.close()
+        except StreamAborted:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            try:
+                pipe._put(_END_OF_STREAM)
+            except StreamAborted:
+                pass
+
+    worker = threading.Thread(target=_archive, name=f'{__name__}.archiver', daemon=True)
+    worker.start()
+    try:
+        while True:
+            chunk = pipe.queue.get()
+            if chunk is _END_OF_STREAM:
+                break
+            yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        # Consumer is done or went away (e.g. the upload failed) - let the archiving thread finish
+        pipe.aborted.set()
+        worker.join()
@@ -0,0 +1,49 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from archive.codecs import get_codec, get_codec_by_remote_path, is_incompressible
+from archive.stream import write_archive
+
+
+class CodecsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, 'resource')
+        os.makedirs(self.root)
+        with open(os.path.join(self.root, 'text.txt'), 'wb') as f:
+            f.write(b'savezone ' * 20000)
+        with open(os.path.join(self.root, 'random.bin'), 'wb') as f:
+            f.write(os.urandom(200000))
+        with open(os.path.join(self.root, 'photo.jpg'), 'wb') as f:
+            f.write(b'not really a jpeg')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_incompressible_files_are_detected(self):
+        self.assertFalse(is_incompressible(os.path.join(self.root, 'text.txt')))
+        self.assertTrue(is_incompressible(os.path.join(self.root, 'random.bin')))
+        self.assertTrue(is_incompressible(os.path.join(self.root, 'photo.jpg')))
+
+    def test_incompressible_files_are_stored(self):
+        archive = io.BytesIO()
+        write_archive(self.root, archive, get_codec('deflate', 9))
+        with zipfile.ZipFile(archive) as zf:
+            methods = {info.filename: info.compress_type for info in zf.infolist()}
+            self.assertEqual(zipfile.ZIP_DEFLATED, methods['text.txt'])
+            self.assertEqual(zipfile.ZIP_STORED, methods['random.bin'])
+            self.assertEqual(zipfile.ZIP_STORED, methods['photo.jpg'])
+            self.assertEqual(b'savezone ' * 20000, zf.read('text.txt'))
+
+    def test_codec_is_recorded_in_the_remote_path(self):
+        self.assertEqual('deflate', get_codec_by_remote_path('savezone/id/01012021000000').name)
+        with self.assertRaises(ValueError):
+            get_codec('rar')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from archive import extract
+from archive.extract import extract_stream, member_path
+
+
+class ExtractStreamTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.files = {
+            'a.txt': b'a' * 1000,
+            'sub/b.bin': os.urandom(300000),
+            'sub/deeper/c.txt': b'savezone ' * 100000,
+        }
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('sub/', b'')
+            for name, content in self.files.items():
+                zf.writestr(name, content)
+        self.archive = archive.getvalue()
+        self.infos = zipfile.ZipFile(archive).infolist()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _read(self, name: str) -> bytes:
+        with open(member_path(self.tmp, name), 'rb') as f:
+            return f.read()
+
+    def test_all_members_are_extracted(self):
+        # Members bigger than this are decompressed in place, smaller ones on the pool
+        extract.SMALL_MEMBER_SIZE, small_member_size = 100000, extract.SMALL_MEMBER_SIZE
+        try:
+            extract_stream(io.BytesIO(self.archive), self.infos, self.tmp, workers=2)
+        finally:
+            extract.SMALL_MEMBER_SIZE = small_member_size
+        for name, content in self.files.items():
+            self.assertEqual(content, self._read(name))
+
+    def test_chosen_members_are_extracted_from_the_middle(self):
+        start = min(info.header_offset for info in self.infos if info.filename == 'sub/b.bin')
+        extracted = extract_stream(io.BytesIO(self.archive[start:]), self.infos, self.tmp, start,
+                                   names=['sub/deeper/c.txt'])
+        self.assertEqual(['sub/deeper/c.txt'], extracted)
+        self.assertEqual(self.files['sub/deeper/c.txt'], self._read('sub/deeper/c.txt'))
+        self.assertFalse(os.path.exists(member_path(self.tmp, 'sub/b.bin')))
+
+    def test_names_cannot_escape_target(self):
+        self.assertEqual(os.path.join(self.tmp, 'etc', 'passwd'), member_path(self.tmp, '../../etc/passwd'))
+
+
+if __name__ == '__main__':
+    unittest.main()
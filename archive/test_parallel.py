@@ -0,0 +1,55 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+import zlib
+
+from archive.parallel import crc32_combine, process_context, write_members_parallel
+from archive.stream import list_members, stream_archive
+
+
+class ParallelArchiveTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, 'resource')
+        os.makedirs(os.path.join(self.root, 'sub', 'empty'))
+        with open(os.path.join(self.root, 'text.txt'), 'wb') as f:
+            f.write(b''.join(b'line %d of the text\n' % i for i in range(20000)))
+        with open(os.path.join(self.root, 'sub', 'random.bin'), 'wb') as f:
+            f.write(os.urandom(100000))
+        open(os.path.join(self.root, 'sub', 'nothing'), 'wb').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_crc32_combine(self):
+        first, second = os.urandom(1000), os.urandom(70000)
+        self.assertEqual(zlib.crc32(first + second),
+                         crc32_combine(zlib.crc32(first), zlib.crc32(second), len(second)))
+
+    def test_blocks_make_one_archive(self):
+        archive = io.BytesIO()
+        write_members_parallel(list_members(self.root), archive, {'extra.json': b'{}'}, workers=2,
+                               block_size=32 * 1024)
+
+        with zipfile.ZipFile(archive) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(['sub/', 'sub/empty/'], sorted(n for n in zf.namelist() if n.endswith('/')))
+            for local_path, name in list_members(self.root):
+                if os.path.isfile(local_path):
+                    with open(local_path, 'rb') as f:
+                        self.assertEqual(f.read(), zf.read(name))
+            self.assertEqual(b'{}', zf.read('extra.json'))
+
+    def test_pool_of_the_stream_thread_is_not_forked(self):
+        # The stream archives on a thread, a fork of a process with threads can inherit a held lock
+        self.assertNotEqual('fork', process_context().get_start_method())
+        archive = io.BytesIO(b''.join(stream_archive(self.root, workers=2)))
+        with zipfile.ZipFile(archive) as zf:
+            self.assertIsNone(zf.testzip())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from archive.stream import stream_archive
+
+
+class StreamArchiveTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, 'resource')
+        os.makedirs(os.path.join(self.root, 'sub', 'empty'))
+        with open(os.path.join(self.root, 'a.txt'), 'wb') as f:
+            f.write(b'a' * 1000)
+        with open(os.path.join(self.root, 'sub', 'b.bin'), 'wb') as f:
+            f.write(os.urandom(300000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_directory_has_the_same_layout_as_make_archive(self):
+        streamed = zipfile.ZipFile(io.BytesIO(b''.join(stream_archive(self.root, chunk_size=4096))))
+        expected = zipfile.ZipFile(shutil.make_archive(os.path.join(self.tmp, 'expected'), 'zip', self.root))
+
+        self.assertEqual(sorted(expected.namelist()), sorted(streamed.namelist()))
+        for name in expected.namelist():
+            self.assertEqual(expected.read(name), streamed.read(name))
+
+    def test_file_is_stored_under_its_name(self):
+        path = os.path.join(self.root, 'a.txt')
+        streamed = zipfile.ZipFile(io.BytesIO(b''.join(stream_archive(path))))
+        self.assertEqual(['a.txt'], streamed.namelist())
+
+    def test_chunks_are_bounded(self):
+        chunks = list(stream_archive(self.root, chunk_size=4096))
+        self.assertTrue(all(len(c) == 4096 for c in chunks[:-1]))
+
+    def test_consumer_can_stop_early(self):
+        stream = stream_archive(self.root, chunk_size=1024, max_buffered_chunks=1)
+        next(stream)
+        stream.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
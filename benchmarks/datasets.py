@@ -0,0 +1,110 @@
+# Data shapes of the benchmarks
+# Every shape is generated once into the data directory and reused by the next runs with the same parameters.
+# The content is made by a seeded generator, so every run backs up the same bytes: a half of every file
+# is random and the other half repeats, so compression has something to do but doesn't get everything for free
+import json
+import os
+import random
+import shutil
+
+from typing import Dict
+
+from scanner.walk import walk
+
+# Files of the tiny shape are spread over directories of this many files
+FILES_PER_DIRECTORY = 1000
+WRITE_BLOCK_SIZE = 1024 * 1024
+PARAMS_FILE = '.params.json'
+
+SHAPES = ('huge', 'tiny', 'deep')
+
+
+def _content(rng: random.Random, size: int) -> bytes:
+    random_part = rng.randbytes(size // 2)
+    pattern = b'savezone benchmark data '
+    repeated = (pattern * (size // len(pattern) + 1))[:size - len(random_part)]
+    return random_part + repeated
+
+
+def _make_huge(path: str, rng: random.Random, size_mb: float) -> None:
+    size = int(size_mb * 1024 * 1024)
+    with open(os.path.join(path, 'huge.bin'), 'wb') as f:
+        while size > 0:
+            block = _content(rng, min(size, WRITE_BLOCK_SIZE))
+            f.write(block)
+            size -= len(block)
+
+
+def _make_tiny(path: str, rng: random.Random, count: int) -> None:
+    for i in range(count):
+        directory = os.path.join(path, f'{i // FILES_PER_DIRECTORY:05d}')
+        if i % FILES_PER_DIRECTORY == 0:
+            os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'{i:08d}.txt'), 'wb') as f:
+            f.write(_content(rng, rng.randint(16, 1024)))
+
+
+def _make_deep(path: str, rng: random.Random, depth: int, breadth: int) -> None:
+    for branch in range(breadth):
+        directory = os.path.join(path, f'branch{branch:03d}')
+        for level in range(depth):
+            directory = os.path.join(directory, f'level{level:03d}')
+            os.makedirs(directory, exist_ok=True)
+            for i in range(2):
+                with open(os.path.join(directory, f'file{i}.dat'), 'wb') as f:
+                    f.write(_content(rng, rng.randint(1024, 16 * 1024)))
+
+
+def make_shape(data_directory: str, shape: str, seed: int = 0, huge_size_mb: float = 256, tiny_count: int = 10000,
+               deep_depth: int = 64, deep_breadth: int = 16) -> str:
+    """
+    Generates the data of the shape, unless it is already there
+    :param data_directory: Where the shapes are kept
+    :param shape: huge - one large file, tiny - many small files, deep - long chains of nested directories
+    :param seed: A seed of the content
+    :param huge_size_mb: Size of the file of the huge shape
+    :param tiny_count: How many files the tiny shape has
+    :param deep_depth: How deep the directories of the deep shape are nested
+    :param deep_breadth: How many chains of nested directories the deep shape has
+    :return: the path to the data
+    """
+    if shape not in SHAPES:
+        raise ValueError(f'Unknown shape {shape}, choose one of {", ".join(SHAPES)}')
+    params = {
+        'huge': {'size_mb': huge_size_mb},
+        'tiny': {'count': tiny_count},
+        'deep': {'depth': deep_depth, 'breadth': deep_breadth},
+    }[shape]
+    params['seed'] = seed
+
+    path = os.path.join(data_directory, shape)
+    params_path = os.path.join(data_directory, f'{shape}{PARAMS_FILE}')
+    if os.path.isdir(path) and os.path.exists(params_path):
+        with open(params_path) as f:
+            if json.load(f) == params:
+                return path
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    rng = random.Random(seed)
+    if shape == 'huge':
+        _make_huge(path, rng, huge_size_mb)
+    elif shape == 'tiny':
+        _make_tiny(path, rng, tiny_count)
+    else:
+        _make_deep(path, rng, deep_depth, deep_breadth)
+    with open(params_path, 'w') as f:
+        json.dump(params, f)
+    return path
+
+
+def describe(path: str) -> Dict[str, int]:
+    """
+    :return: how many files and directories there are under path, and how many bytes the files take
+    """
+    files = directories = size = 0
+    for directory in walk(path, stat=True):
+        directories += len(directory.dirnames)
+        files += len(directory.filenames)
+        size += sum(stat.st_size for stat in directory.stats.values())
+    return {'files': files, 'directories': directories, 'bytes': size}
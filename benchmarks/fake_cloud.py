@@ -0,0 +1,610 @@
+# Fake cloud
+# A local HTTP server that answers the Yandex Disk and Google Drive requests the storages make, so backups can be
+# measured without the network. Files are kept in a local directory. The network can be made worse on purpose:
+# every request waits for the latency, bodies go no faster than the bandwidth, and a share of requests fails with 503
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, quote, urlsplit
+
+COPY_BLOCK_SIZE = 64 * 1024
+GDRIVE_FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+GDRIVE_ROOT_ID = 'root-folder-id'
+TOTAL_SPACE = 1024 ** 4
+# Deleting a directory on Yandex Disk is an operation that is in progress for this long
+YADISK_OPERATION_SECONDS = 0.2
+
+
+class NetworkProfile:
+    """How bad the network is"""
+
+    def __init__(self, latency: float = 0.0, bandwidth: float or None = None, error_rate: float = 0.0,
+                 seed: int or None = None):
+        """
+        :param latency: Seconds every request waits before it is answered
+        :param bandwidth: Bytes per second that all request and response bodies share, unlimited if not given
+        :param error_rate: A share of requests that fail with 503, from 0 to 1
+        :param seed: A seed of the errors, so runs fail the same requests
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._link_free_at = 0.0
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def transfer(self, size: int) -> None:
+        """
+        Waits as long as size bytes take on the link. The link is shared, so parallel transfers split it
+        """
+        if not self.bandwidth or size <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._link_free_at = max(self._link_free_at, now) + size / self.bandwidth
+            wait = self._link_free_at - now
+        time.sleep(wait)
+
+
+def _file_md5(path: str) -> str:
+    # The chunks of a resumable upload come in separate requests, the file is hashed when it is complete
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class _Yadisk:
+    """Resources of the fake Yandex Disk: paths without the disk:/ prefix"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.md5: Dict[str, str] = {}
+        # Upload link ID: path
+        self.uploads: Dict[str, str] = {}
+        self.operations: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        if path.startswith('disk:'):
+            path = path[len('disk:'):]
+        return '/'.join(part for part in path.split('/') if part)
+
+    def local(self, path: str) -> str:
+        return os.path.join(self.root, *path.split('/')) if path else self.root
+
+
+class _GDriveFile:
+    def __init__(self, file_id: str, name: str or None, mime_type: str, parents: list):
+        self.id = file_id
+        self.name = name
+        self.mime_type = mime_type
+        self.parents = parents
+        self.size = 0
+        self.md5 = None
+
+    def to_json(self) -> dict:
+        data = {'id': self.id, 'name': self.name, 'mimeType': self.mime_type, 'parents': self.parents,
+                'kind': 'drive#file'}
+        if self.mime_type != GDRIVE_FOLDER_MIME_TYPE:
+            data['size'] = str(self.size)
+        if self.md5 is not None:
+            data['md5Checksum'] = self.md5
+        return data
+
+
+class _GDrive:
+    """Files of the fake Google Drive, found by ID. Contents are kept in files named by the ID"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.files: Dict[str, _GDriveFile] = {}
+        # Upload session ID: (parents, name, path of the received part)
+        self.uploads: Dict[str, Tuple[list, str or None, str]] = {}
+        self.lock = threading.Lock()
+
+    def local(self, file_id: str) -> str:
+        return os.path.join(self.root, file_id)
+
+    def children(self, folder_id: str) -> list:
+        return [f for f in self.files.values() if folder_id in f.parents]
+
+    def delete(self, file_id: str) -> None:
+        for child in self.children(file_id):
+            self.delete(child.id)
+        self.files.pop(file_id, None)
+        if os.path.exists(self.local(file_id)):
+            os.unlink(self.local(file_id))
+
+
+class FakeCloud:
+    """
+    The server. Point the storages at it with the SAVEZONE_YADISK_API_URL and SAVEZONE_GDRIVE_API_URL
+    environment variables set to url, before savezone is imported
+    """
+
+    def __init__(self, network: NetworkProfile or None = None, directory: str or None = None,
+                 host: str = '127.0.0.1', port: int = 0):
+        """
+        :param network: How bad the network is, a perfect one if not given
+        :param directory: Where to keep the files, a temporary directory if not given
+        :param port: A port to listen on, any free one if 0
+        """
+        self.network = network or NetworkProfile()
+        self._own_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix='fake-cloud-')
+        os.makedirs(os.path.join(self.directory, 'yadisk'), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, 'gdrive'), exist_ok=True)
+        self.yadisk = _Yadisk(os.path.join(self.directory, 'yadisk'))
+        self.gdrive = _GDrive(os.path.join(self.directory, 'gdrive'))
+
+        self._lock = threading.Lock()
+        self.requests_count = 0
+        self.failed_count = 0
+        self.received_bytes = 0
+        self.sent_bytes = 0
+
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.cloud = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'requests': self.requests_count,
+                'failed': self.failed_count,
+                'received_bytes': self.received_bytes,
+                'sent_bytes': self.sent_bytes,
+            }
+
+    def count(self, received: int = 0, sent: int = 0, failed: bool = False, request: bool = False) -> None:
+        with self._lock:
+            self.requests_count += int(request)
+            self.failed_count += int(failed)
+            self.received_bytes += received
+            self.sent_bytes += sent
+
+    def start(self) -> 'FakeCloud':
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._own_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self) -> 'FakeCloud':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def _parse_range(header: str or None, size: int) -> Tuple[int, int] or None:
+    """
+    :return: the first byte and the byte after the last one, or None if there is no range
+    :raises: ValueError if the range can't be satisfied
+    """
+    if not header:
+        return None
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(0, size - int(last)), size
+    else:
+        start, end = int(first), min(size, int(last) + 1) if last else size
+    if start >= size or start >= end:
+        raise ValueError(header)
+    return start, end
+
+
+def _gdrive_query(q: str) -> dict:
+    """
+    Understands the queries the storage makes: names, parents and the mime type
+    """
+    return {
+        'names': {re.sub(r'\\(.)', r'\1', name) for name in re.findall(r"name = '((?:[^'\\]|\\.)*)'", q)},
+        'parents': re.findall(r"'([^']*)' in parents", q),
+        'mime_type': next(iter(re.findall(r"mimeType = '([^']*)'", q)), None),
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    @property
+    def cloud(self) -> FakeCloud:
+        return self.server.cloud
+
+    # Request and response bodies
+
+    def _read_body_blocks(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                remaining = size
+                while remaining:
+                    block = self.rfile.read(min(remaining, COPY_BLOCK_SIZE))
+                    if not block:
+                        return
+                    remaining -= len(block)
+                    yield block
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length') or 0)
+            while remaining:
+                block = self.rfile.read(min(remaining, COPY_BLOCK_SIZE))
+                if not block:
+                    return
+                remaining -= len(block)
+                yield block
+
+    def _receive_to(self, f, md5=None) -> int:
+        received = 0
+        for block in self._read_body_blocks():
+            self.cloud.network.transfer(len(block))
+            f.write(block)
+            if md5 is not None:
+                md5.update(block)
+            received += len(block)
+        self.cloud.count(received=received)
+        return received
+
+    def _read_json(self) -> dict:
+        data = b''.join(self._read_body_blocks())
+        self.cloud.count(received=len(data))
+        return json.loads(data) if data else {}
+
+    def _send(self, status: int, body: bytes = b'', headers: dict or None = None,
+              content_type: str = 'application/json') -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body or status not in (204, 304):
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD' and body:
+            self.cloud.network.transfer(len(body))
+            self.wfile.write(body)
+            self.cloud.count(sent=len(body))
+
+    def _send_json(self, status: int, data: dict, headers: dict or None = None) -> None:
+        self._send(status, json.dumps(data).encode('utf-8'), headers)
+
+    def _send_file(self, path: str) -> None:
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        # A range of another version of the file is not sent, the whole file is
+        if_range = self.headers.get('If-Range')
+        range_header = self.headers.get('Range') if if_range in (None, etag) else None
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            self._send(416, headers={'Content-Range': f'bytes */{size}'})
+            return
+        start, end = byte_range or (0, size)
+        self.send_response(206 if byte_range else 200)
+        if byte_range:
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{size}')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining:
+                block = f.read(min(remaining, COPY_BLOCK_SIZE))
+                if not block:
+                    break
+                self.cloud.network.transfer(len(block))
+                self.wfile.write(block)
+                self.cloud.count(sent=len(block))
+                remaining -= len(block)
+
+    # Dispatching
+
+    def _handle(self) -> None:
+        self.cloud.count(request=True)
+        network = self.cloud.network
+        if network.latency:
+            time.sleep(network.latency)
+        if network.should_fail():
+            self.cloud.count(failed=True)
+            # The body is not read, so the connection can't be used again
+            self.close_connection = True
+            self._send_json(503, {'message': 'Injected error', 'error': 'ServiceUnavailable'},
+                            headers={'Connection': 'close'})
+            return
+
+        url = urlsplit(self.path)
+        self.query = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        route = url.path.rstrip('/') or '/'
+        for prefix, handler in (
+                ('/v1/disk', self._yadisk_api),
+                ('/_yadisk', self._yadisk_transfer),
+                ('/upload/drive/v3', self._gdrive_upload),
+                ('/drive/v3', self._gdrive_api),
+                ('/_gdrive', self._gdrive_transfer),
+        ):
+            if route == prefix or route.startswith(prefix + '/'):
+                handler(route[len(prefix):])
+                return
+        self._send_json(404, {'message': f'Unknown endpoint {route}'})
+
+    do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = do_HEAD = _handle
+
+    # Yandex Disk
+
+    def _yadisk_resource(self, path: str) -> dict:
+        disk = self.cloud.yadisk
+        local = disk.local(path)
+        modified = datetime.fromtimestamp(os.path.getmtime(local), timezone.utc).isoformat()
+        resource = {'path': 'disk:/' + path, 'name': path.split('/')[-1] if path else 'disk', 'modified': modified}
+        if os.path.isdir(local):
+            resource['type'] = 'dir'
+        else:
+            resource.update({
+                'type': 'file',
+                'size': os.path.getsize(local),
+                'md5': disk.md5.get(path),
+                'file': f'{self.cloud.url}/_yadisk/download?path={quote(path)}',
+            })
+        return resource
+
+    def _yadisk_not_found(self) -> None:
+        self._send_json(404, {'message': 'Не удалось найти запрошенный ресурс.', 'error': 'DiskNotFoundError'})
+
+    def _yadisk_api(self, route: str) -> None:
+        disk = self.cloud.yadisk
+        path = disk.normalize(self.query.get('path', ''))
+        local = disk.local(path)
+
+        if route == '' and self.command == 'GET':
+            used = sum(os.path.getsize(os.path.join(root, name))
+                       for root, _, names in os.walk(disk.root) for name in names)
+            self._send_json(200, {'used_space': used, 'total_space': TOTAL_SPACE})
+        elif route == '/resources' and self.command == 'GET':
+            if not os.path.exists(local):
+                self._yadisk_not_found()
+                return
+            resource = self._yadisk_resource(path)
+            if resource['type'] == 'dir':
+                names = sorted(os.listdir(local))
+                offset, limit = int(self.query.get('offset', 0)), int(self.query.get('limit', 20))
+                items = [self._yadisk_resource('/'.join(filter(None, [path, name])))
+                         for name in names[offset:offset + limit]]
+                resource['_embedded'] = {'items': items, 'total': len(names), 'offset': offset, 'limit': limit,
+                                         'path': resource['path']}
+            self._send_json(200, resource)
+        elif route == '/resources' and self.command == 'PUT':
+            with disk.lock:
+                if not os.path.isdir(os.path.dirname(local)):
+                    self._send_json(409, {'message': f'Указанного пути "{path}" не существует.',
+                                          'error': 'DiskPathDoesntExistsError'})
+                elif os.path.exists(local):
+                    self._send_json(409, {'message': f'По указанному пути "{path}" уже существует папка '
+                                                     f'с таким именем.',
+                                          'error': 'DiskPathPointsToExistentDirectoryError'})
+                else:
+                    os.mkdir(local)
+                    self._send_json(201, {'href': f'{self.cloud.url}/v1/disk/resources?path={quote(path)}',
+                                          'method': 'GET'})
+        elif route == '/resources' and self.command == 'DELETE':
+            if not os.path.exists(local) or not path:
+                self._yadisk_not_found()
+            elif os.path.isdir(local):
+                shutil.rmtree(local)
+                operation_id = uuid.uuid4().hex
+                with disk.lock:
+                    disk.operations[operation_id] = time.monotonic() + YADISK_OPERATION_SECONDS
+                self._send_json(202, {'href': f'{self.cloud.url}/v1/disk/operations/{operation_id}',
+                                      'method': 'GET'})
+            else:
+                os.unlink(local)
+                disk.md5.pop(path, None)
+                self._send(204)
+        elif route == '/resources/upload' and self.command == 'GET':
+            overwrite = self.query.get('overwrite', '').lstrip('$').lower() == 'true'
+            if not os.path.isdir(os.path.dirname(local)):
+                self._send_json(409, {'message': f'Указанного пути "{path}" не существует.',
+                                      'error': 'DiskPathDoesntExistsError'})
+            elif os.path.exists(local) and not overwrite:
+                self._send_json(409, {'message': f'Ресурс "{path}" уже существует.',
+                                      'error': 'DiskResourceAlreadyExistsError'})
+            else:
+                upload_id = uuid.uuid4().hex
+                with disk.lock:
+                    disk.uploads[upload_id] = path
+                self._send_json(200, {'href': f'{self.cloud.url}/_yadisk/upload/{upload_id}', 'method': 'PUT',
+                                      'templated': False})
+        elif route == '/resources/download' and self.command == 'GET':
+            if not os.path.isfile(local):
+                self._yadisk_not_found()
+                return
+            self._send_json(200, {'href': f'{self.cloud.url}/_yadisk/download?path={quote(path)}',
+                                  'method': 'GET', 'templated': False})
+        elif route.startswith('/operations/') and self.command == 'GET':
+            finished_at = disk.operations.get(route.split('/')[-1])
+            if finished_at is None:
+                self._yadisk_not_found()
+                return
+            self._send_json(200, {'status': 'success' if time.monotonic() >= finished_at else 'in-progress'})
+        else:
+            self._send_json(405, {'message': f'{self.command} {route} is not supported by the fake cloud'})
+
+    def _yadisk_transfer(self, route: str) -> None:
+        disk = self.cloud.yadisk
+        if route.startswith('/upload/') and self.command == 'PUT':
+            path = disk.uploads.pop(route.split('/')[-1], None)
+            if path is None:
+                self._send_json(404, {'message': 'Upload link has expired'})
+                return
+            temp_path = disk.local(path) + '.uploading'
+            md5 = hashlib.md5()
+            with open(temp_path, 'wb') as f:
+                self._receive_to(f, md5)
+            os.replace(temp_path, disk.local(path))
+            disk.md5[path] = md5.hexdigest()
+            self._send(201)
+        elif route == '/download' and self.command in ('GET', 'HEAD'):
+            local = disk.local(disk.normalize(self.query.get('path', '')))
+            if not os.path.isfile(local):
+                self._send(404)
+                return
+            self._send_file(local)
+        else:
+            self._send(405)
+
+    # Google Drive
+
+    def _gdrive_upload(self, route: str) -> None:
+        drive = self.cloud.gdrive
+        if route != '/files' or self.command != 'POST' or self.query.get('uploadType') != 'resumable':
+            self._send_json(405, {'message': 'Only resumable uploads are supported by the fake cloud'})
+            return
+        metadata = self._read_json()
+        parents = metadata.get('parents') or [GDRIVE_ROOT_ID]
+        if any(parent != GDRIVE_ROOT_ID and parent not in drive.files for parent in parents):
+            self._send_json(404, {'message': 'File not found'})
+            return
+        session_id = uuid.uuid4().hex
+        part_path = drive.local(session_id + '.part')
+        open(part_path, 'wb').close()
+        with drive.lock:
+            drive.uploads[session_id] = (parents, metadata.get('name'), part_path)
+        self._send(200, headers={'Location': f'{self.cloud.url}/_gdrive/upload/{session_id}'})
+
+    def _gdrive_transfer(self, route: str) -> None:
+        drive = self.cloud.gdrive
+        if not route.startswith('/upload/') or self.command != 'PUT':
+            self._send(405)
+            return
+        session_id = route.split('/')[-1]
+        session = drive.uploads.get(session_id)
+        if session is None:
+            self._send_json(404, {'message': 'Upload session has expired'})
+            return
+        parents, name, part_path = session
+
+        match = re.fullmatch(r'bytes (\*|(\d+)-(\d+))/(\*|\d+)', self.headers.get('Content-Range', '').strip())
+        if not match:
+            self._send_json(400, {'message': 'Bad Content-Range'})
+            return
+        received = os.path.getsize(part_path)
+        if match.group(2) is not None:
+            if int(match.group(2)) != received:
+                # Google answers with what it has, the client sends the rest again
+                self._send_upload_status(received)
+                return
+            with open(part_path, 'ab') as f:
+                received += self._receive_to(f)
+        total = match.group(4)
+
+        if total != '*' and received >= int(total):
+            file_id = uuid.uuid4().hex
+            os.replace(part_path, drive.local(file_id))
+            gdrive_file = _GDriveFile(file_id, name or 'Untitled', 'application/octet-stream', parents)
+            gdrive_file.size = received
+            gdrive_file.md5 = _file_md5(drive.local(file_id))
+            with drive.lock:
+                drive.files[file_id] = gdrive_file
+                drive.uploads.pop(session_id, None)
+            self._send_json(200, gdrive_file.to_json())
+        else:
+            self._send_upload_status(received)
+
+    def _send_upload_status(self, received: int) -> None:
+        self._send(308, headers={'Range': f'bytes=0-{received - 1}'} if received else {})
+
+    def _gdrive_api(self, route: str) -> None:
+        drive = self.cloud.gdrive
+        parts = [part for part in route.split('/') if part]
+
+        if parts == ['about'] and self.command == 'GET':
+            used = sum(f.size for f in list(drive.files.values()))
+            self._send_json(200, {'storageQuota': {'usage': str(used), 'limit': str(TOTAL_SPACE)}})
+        elif parts == ['files'] and self.command == 'GET':
+            query = _gdrive_query(self.query.get('q', ''))
+            files = [f for f in list(drive.files.values())
+                     if (not query['names'] or f.name in query['names'])
+                     and all(parent in f.parents for parent in query['parents'])
+                     and (query['mime_type'] is None or f.mime_type == query['mime_type'])]
+            files.sort(key=lambda f: (f.name or '', f.id))
+            offset, page_size = int(self.query.get('pageToken') or 0), int(self.query.get('pageSize', 100))
+            page = {'files': [f.to_json() for f in files[offset:offset + page_size]]}
+            if offset + page_size < len(files):
+                page['nextPageToken'] = str(offset + page_size)
+            self._send_json(200, page)
+        elif parts == ['files'] and self.command == 'POST':
+            metadata = self._read_json()
+            parents = metadata.get('parents') or [GDRIVE_ROOT_ID]
+            gdrive_file = _GDriveFile(uuid.uuid4().hex, metadata.get('name'),
+                                      metadata.get('mimeType', 'application/octet-stream'), parents)
+            with drive.lock:
+                drive.files[gdrive_file.id] = gdrive_file
+            self._send_json(200, gdrive_file.to_json())
+        elif len(parts) == 2 and parts[0] == 'files':
+            file_id = parts[1]
+            if file_id == 'root' and self.command == 'GET':
+                self._send_json(200, {'id': GDRIVE_ROOT_ID, 'name': 'My Drive', 'mimeType': GDRIVE_FOLDER_MIME_TYPE})
+                return
+            gdrive_file = drive.files.get(file_id)
+            if gdrive_file is None:
+                self._send_json(404, {'message': f'File not found: {file_id}.'})
+            elif self.command in ('GET', 'HEAD') and self.query.get('alt') == 'media':
+                self._send_file(drive.local(file_id))
+            elif self.command == 'GET':
+                self._send_json(200, gdrive_file.to_json())
+            elif self.command == 'PATCH':
+                metadata = self._read_json()
+                gdrive_file.name = metadata.get('name', gdrive_file.name)
+                self._send_json(200, gdrive_file.to_json())
+            elif self.command == 'DELETE':
+                with drive.lock:
+                    drive.delete(file_id)
+                self._send(204)
+            else:
+                self._send(405)
+        else:
+            self._send_json(405, {'message': f'{self.command} {route} is not supported by the fake cloud'})
@@ -0,0 +1,250 @@
+# Benchmarks
+# Runs backup, list and restore of the data shapes against the fake cloud and writes the results as JSON.
+# The local storage is measured too, against a directory, as a baseline without the network.
+# Two result files can be compared to see which operations got slower between commits:
+#   python -m benchmarks.run run -s yandex -s google --shape huge --shape tiny -o before.json
+#   python -m benchmarks.run compare before.json after.json
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import typer
+
+from benchmarks import datasets
+from benchmarks.fake_cloud import FakeCloud, NetworkProfile
+
+OPERATIONS = ('backup', 'list', 'restore')
+TOKEN = 'benchmark'
+# Storages that don't go through the fake cloud
+LOCAL_STORAGES = ('local', 'nas', 'fs')
+# An operation is reported as a regression when its throughput drops by more than this share
+REGRESSION_THRESHOLD = 0.1
+
+app = typer.Typer()
+
+
+def _git_commit() -> str or None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _wait_for_next_second() -> None:
+    # Backups are named by the second they are made in, two backups in one second would have the same name
+    time.sleep(1 - time.time() % 1)
+
+
+def _measure(name: str, function, cloud: FakeCloud, metrics, data_bytes: int or None) -> dict:
+    before = cloud.stats()
+    started = time.monotonic()
+    error = None
+    try:
+        function()
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    seconds = time.monotonic() - started
+    metrics.finish()
+    after = cloud.stats()
+    return {
+        'operation': name,
+        'ok': error is None,
+        'error': error,
+        'seconds': seconds,
+        'bytes': data_bytes,
+        'throughput': data_bytes / seconds if data_bytes and seconds > 0 else None,
+        'requests': after['requests'] - before['requests'],
+        'failed_requests': after['failed'] - before['failed'],
+        'sent_bytes': after['sent_bytes'] - before['sent_bytes'],
+        'received_bytes': after['received_bytes'] - before['received_bytes'],
+        'phases': metrics.to_dict()['phases'],
+    }
+
+
+def _token(storage_name: str, work_path: str) -> str:
+    # The token of the local storage is the directory it keeps the backups in
+    if storage_name in LOCAL_STORAGES:
+        directory = os.path.join(work_path, 'storage')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+    return TOKEN
+
+
+def _run_shape(savezone, cloud: FakeCloud, storage_name: str, data_path: str, work_path: str, repeat: int,
+               stream: bool, codec: str, workers: int or None) -> List[dict]:
+    from metrics.recorder import RunMetrics
+
+    token = _token(storage_name, work_path)
+
+    shape = datasets.describe(data_path)
+    results = []
+    for attempt in range(repeat):
+        _wait_for_next_second()
+        saved = {}
+
+        def _backup():
+            saved['backup'] = savezone.backup(data_path, '/', storage_name, token, stream=stream, codec=codec,
+                                              workers=workers, metrics=metrics)
+
+        metrics = RunMetrics('backup', storage_name)
+        results.append(_measure('backup', _backup, cloud, metrics, shape['bytes']))
+
+        metrics = RunMetrics('list', storage_name)
+        results.append(_measure('list', lambda: savezone.get_backups(storage_name, token, use_cache=False,
+                                                                     metrics=metrics),
+                                cloud, metrics, None))
+
+        target = os.path.join(work_path, 'restored', f'{storage_name}-{attempt}')
+
+        def _restore():
+            if 'backup' not in saved:
+                raise ValueError('Nothing to restore, the backup failed')
+            savezone.restore(saved['backup'].versions[0].path, storage_name, target, token, metrics=metrics)
+            restored = datasets.describe(target)
+            if (restored['files'], restored['bytes']) != (shape['files'], shape['bytes']):
+                raise ValueError(f'Restored {restored["files"]} files of {restored["bytes"]} bytes, '
+                                 f'expected {shape["files"]} files of {shape["bytes"]} bytes')
+
+        metrics = RunMetrics('restore', storage_name)
+        results.append(_measure('restore', _restore, cloud, metrics, shape['bytes']))
+        shutil.rmtree(target, ignore_errors=True)
+
+        for result in results[-len(OPERATIONS):]:
+            result.update({'storage': storage_name, 'attempt': attempt, **{f'shape_{k}': v for k, v in shape.items()}})
+            status = f'{result["seconds"]:.2f} s' if result['ok'] else result['error']
+            print(f'[{__name__}] {storage_name} {result["operation"]}: {status}')
+    return results
+
+
+@app.command()
+def run(
+    storages: List[str] = typer.Option(['yandex'], '-s', '--storage'),
+    shapes: List[str] = typer.Option(list(datasets.SHAPES), '--shape'),
+    output: str = typer.Option('benchmark.json', '-o', '--output'),
+    repeat: int = typer.Option(3, '-r', '--repeat'),
+    latency: float = typer.Option(0.0, '--latency'),
+    bandwidth: Optional[float] = typer.Option(None, '--bandwidth'),
+    error_rate: float = typer.Option(0.0, '--error-rate'),
+    seed: int = typer.Option(0, '--seed'),
+    huge_size: float = typer.Option(256, '--huge-size'),
+    tiny_files: int = typer.Option(10000, '--tiny-files'),
+    deep_depth: int = typer.Option(64, '--deep-depth'),
+    deep_breadth: int = typer.Option(16, '--deep-breadth'),
+    stream: bool = typer.Option(False, '--stream'),
+    codec: str = typer.Option('deflate', '-c', '--codec'),
+    workers: Optional[int] = typer.Option(None, '-w', '--workers'),
+    data_directory: Optional[str] = typer.Option(None, '--data'),
+) -> None:
+    """
+    Measures backup, list and restore of the data shapes against the fake cloud \r\n
+    :param storages: Storages to emulate: yandex or google, or local for a directory in the work directory
+    :param shapes: Data shapes: huge (one large file), tiny (many small files), deep (nested directories)
+    :param output: A JSON file to write the results to
+    :param repeat: How many times to run every operation
+    :param latency: Milliseconds every request waits
+    :param bandwidth: Mb per second of the link, unlimited if not given
+    :param error_rate: A share of requests that fail with 503, from 0 to 1
+    :param huge_size: Mb in the file of the huge shape
+    :param tiny_files: Files in the tiny shape, millions are fine but take a while to generate
+    :param data_directory: Where to keep the generated shapes between runs, a temporary directory if not given
+    """
+    network = NetworkProfile(latency / 1000, bandwidth * 1024 * 1024 if bandwidth else None, error_rate, seed)
+    work_path = tempfile.mkdtemp(prefix='savezone-benchmark-')
+    data_path = data_directory or os.path.join(work_path, 'data')
+    output = os.path.abspath(output)
+    cwd = os.getcwd()
+
+    with FakeCloud(network) as cloud:
+        # The storages read the API urls when they are imported
+        os.environ['SAVEZONE_YADISK_API_URL'] = cloud.url
+        os.environ['SAVEZONE_GDRIVE_API_URL'] = cloud.url
+        import savezone
+
+        # The local database, temp files and restored files of savezone go to the work directory
+        os.chdir(work_path)
+        os.makedirs(savezone.BASE_TEMP_DIRECTORY, exist_ok=True)
+        results = []
+        try:
+            for shape in shapes:
+                print(f'[{__name__}] Preparing {shape} data...')
+                path = datasets.make_shape(data_path, shape, seed, huge_size, tiny_files, deep_depth, deep_breadth)
+                for storage_name in storages:
+                    for result in _run_shape(savezone, cloud, storage_name, path, work_path, repeat, stream, codec,
+                                             workers):
+                        results.append({'shape': shape, **result})
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_path, ignore_errors=True)
+
+    report = {
+        'commit': _git_commit(),
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {
+            'latency_ms': latency, 'bandwidth_mb': bandwidth, 'error_rate': error_rate, 'seed': seed,
+            'huge_size_mb': huge_size, 'tiny_files': tiny_files, 'deep_depth': deep_depth,
+            'deep_breadth': deep_breadth, 'stream': stream, 'codec': codec, 'workers': workers, 'repeat': repeat,
+        },
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'[{__name__}] Results are written to {output}')
+    if not all(result['ok'] for result in results):
+        raise typer.Exit(1)
+
+
+def summarize(report: dict) -> Dict[tuple, dict]:
+    """
+    Takes the median of the attempts of every operation
+    :return: {(shape, storage, operation): {'seconds': ..., 'throughput': ...}}
+    """
+    grouped: Dict[tuple, List[dict]] = {}
+    for result in report['results']:
+        if result['ok']:
+            grouped.setdefault((result['shape'], result['storage'], result['operation']), []).append(result)
+    return {
+        key: {
+            'seconds': statistics.median(r['seconds'] for r in results),
+            'throughput': statistics.median(r['throughput'] for r in results) if results[0]['throughput'] else None,
+        }
+        for key, results in grouped.items()
+    }
+
+
+@app.command()
+def compare(before: str, after: str,
+            threshold: float = typer.Option(REGRESSION_THRESHOLD, '-t', '--threshold')) -> None:
+    """
+    Compares two result files, fails if an operation got slower by more than the threshold \r\n
+    :param threshold: A share of time, 0.1 means 10% slower
+    """
+    with open(before) as f:
+        old = summarize(json.load(f))
+    with open(after) as f:
+        new = summarize(json.load(f))
+
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        change = new[key]['seconds'] / old[key]['seconds'] - 1 if old[key]['seconds'] else 0.0
+        regressed = change > threshold
+        regressions += regressed
+        print(f'{"/".join(key):40} {old[key]["seconds"]:9.3f} s -> {new[key]["seconds"]:9.3f} s '
+              f'{change:+7.1%}{"  REGRESSION" if regressed else ""}')
+    if regressions:
+        raise typer.Exit(1)
+
+
+if __name__ == '__main__':
+    app()
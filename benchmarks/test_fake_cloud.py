@@ -0,0 +1,93 @@
+import hashlib
+import json
+import shutil
+import tempfile
+import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmarks import datasets
+from benchmarks.fake_cloud import FakeCloud, NetworkProfile
+
+
+def _request(method: str, url: str, data: bytes or None = None, headers: dict or None = None):
+    request = urllib.request.Request(url, data=data, method=method, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, dict(response.headers), response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read()
+
+
+class FakeCloudTests(unittest.TestCase):
+    def setUp(self):
+        self.cloud = FakeCloud().start()
+        self.url = self.cloud.url
+
+    def tearDown(self):
+        self.cloud.stop()
+
+    def test_yadisk_upload_list_and_range(self):
+        self.assertEqual(201, _request('PUT', f'{self.url}/v1/disk/resources?path=savezone')[0])
+        status, _, body = _request('GET', f'{self.url}/v1/disk/resources/upload?path=savezone/a.zip&overwrite=$False')
+        self.assertEqual(200, status)
+        content = bytes(range(256)) * 100
+        self.assertEqual(201, _request('PUT', json.loads(body)['href'], content)[0])
+
+        status, _, body = _request('GET', f'{self.url}/v1/disk/resources?path=disk:/savezone&limit=10')
+        item, = json.loads(body)['_embedded']['items']
+        self.assertEqual(('disk:/savezone/a.zip', len(content), hashlib.md5(content).hexdigest()),
+                         (item['path'], item['size'], item['md5']))
+
+        status, headers, body = _request('GET', item['file'], headers={'Range': 'bytes=100-199'})
+        self.assertEqual((206, content[100:200], f'bytes 100-199/{len(content)}'),
+                         (status, body, headers['Content-Range']))
+
+        self.assertEqual(202, _request('DELETE', f'{self.url}/v1/disk/resources?path=savezone&permanently=true')[0])
+        self.assertEqual(404, _request('GET', f'{self.url}/v1/disk/resources?path=savezone')[0])
+
+    def test_gdrive_resumable_upload(self):
+        status, _, body = _request('POST', f'{self.url}/drive/v3/files', json.dumps(
+            {'name': 'savezone', 'mimeType': 'application/vnd.google-apps.folder', 'parents': ['root-folder-id']}
+        ).encode(), {'Content-Type': 'application/json'})
+        folder_id = json.loads(body)['id']
+
+        status, headers, _ = _request('POST', f'{self.url}/upload/drive/v3/files?uploadType=resumable',
+                                      json.dumps({'parents': [folder_id]}).encode())
+        session = headers['Location']
+        status, headers, _ = _request('PUT', session, b'a' * 10, {'Content-Range': 'bytes 0-9/*'})
+        self.assertEqual((308, 'bytes=0-9'), (status, headers['Range']))
+        status, _, body = _request('PUT', session, b'b' * 5, {'Content-Range': 'bytes 10-14/15'})
+        file_id = json.loads(body)['id']
+        _request('PATCH', f'{self.url}/drive/v3/files/{file_id}', json.dumps({'name': 'x y'}).encode())
+
+        query = urllib.parse.quote(f"name = 'x y' and '{folder_id}' in parents and trashed = false")
+        _, _, body = _request('GET', f'{self.url}/drive/v3/files?q={query}')
+        self.assertEqual([file_id], [f['id'] for f in json.loads(body)['files']])
+        self.assertEqual(b'a' * 10 + b'b' * 5, _request('GET', f'{self.url}/drive/v3/files/{file_id}?alt=media')[2])
+
+    def test_injected_errors(self):
+        self.cloud.network = NetworkProfile(error_rate=1.0)
+        self.assertEqual(503, _request('GET', f'{self.url}/v1/disk/')[0])
+        self.assertEqual(1, self.cloud.stats()['failed'])
+
+
+class DatasetTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_shapes_are_reused(self):
+        path = datasets.make_shape(self.tmp, 'deep', deep_depth=5, deep_breadth=3)
+        self.assertEqual({'files': 30, 'directories': 18}, {k: v for k, v in datasets.describe(path).items()
+                                                            if k != 'bytes'})
+        size = datasets.describe(path)['bytes']
+        self.assertEqual(path, datasets.make_shape(self.tmp, 'deep', deep_depth=5, deep_breadth=3))
+        self.assertEqual(size, datasets.describe(path)['bytes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
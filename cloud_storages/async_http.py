@@ -0,0 +1,157 @@
+# Shortcuts for asynchronous http requests
+# The async storages send their requests with aiohttp, so one thread keeps hundreds of them in flight.
+# aiohttp is optional: pip install aiohttp
+import asyncio
+import json
+import os
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from cloud_storages.downloads import DOWNLOAD_BLOCK_SIZE, PART_SUFFIX, _discard_part, _resume_headers, _resume_mode
+from cloud_storages.http_shortcuts import BACKOFF, IDEMPOTENT_METHODS, RETRIES, _can_replay, _get_headers
+
+# How many requests are in flight at once, for all hosts together
+CONNECTIONS = 100
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+
+class AsyncResponse:
+    """A response whose body is read, so its connection is back in the pool"""
+
+    def __init__(self, status_code: int, headers, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content or b'{}')
+
+
+class AsyncHttpSession:
+    """
+    A pool of keep-alive connections shared by all the requests of an async storage, the same as HttpSession:
+    idempotent requests that failed with a 5xx response or a connection error are retried with exponential backoff
+    """
+
+    def __init__(self, connections: int = CONNECTIONS, retries: int = RETRIES, backoff: float = BACKOFF):
+        """
+        :param connections: how many requests can be in flight at once
+        :param retries: how many times to retry a failed request
+        :param backoff: a delay before the first retry, it doubles with every next retry
+        :raises: ValueError if aiohttp is not installed
+        """
+        if aiohttp is None:
+            raise ValueError('Async storages need the aiohttp package: pip install aiohttp')
+        self.connections = connections
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self.requests_count = 0
+        self.retries_count = 0
+
+    @property
+    def session(self) -> 'aiohttp.ClientSession':
+        # The session belongs to the event loop it is made in, so it is made by the first request
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests_count,
+            'retries': self.retries_count,
+        }
+
+    @asynccontextmanager
+    async def open(self, method: str, addr: str, token: str or None = None, headers: dict or None = None,
+                   **kwargs) -> AsyncIterator['aiohttp.ClientResponse']:
+        """
+        Sends the request and gives the response before its body is read, e.g. to download it by chunks
+        """
+        if token is not None:
+            headers = _get_headers(token, headers)
+        data = kwargs.get('data')
+        retries = self.retries if method in IDEMPOTENT_METHODS and _can_replay(data) else 0
+        position = data.tell() if retries and hasattr(data, 'tell') else None
+
+        attempt = 0
+        while True:
+            self.requests_count += 1
+            try:
+                response = await self.session.request(method, addr, headers=headers, **kwargs)
+                if response.status < 500 or attempt >= retries:
+                    break
+                response.release()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= retries:
+                    raise
+
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+            self.retries_count += 1
+            if position is not None:
+                data.seek(position)
+
+        try:
+            yield response
+        finally:
+            response.release()
+
+    async def request(self, method: str, addr: str, token: str or None = None, headers: dict or None = None,
+                      **kwargs) -> AsyncResponse:
+        """
+        Sends the request, adding the OAuth header if the token is given, and reads the response
+        """
+        async with self.open(method, addr, token, headers, **kwargs) as response:
+            return AsyncResponse(response.status, response.headers, await response.read())
+
+
+async def download_to_file(session: AsyncHttpSession, url: str, local_path: str, headers: dict or None = None,
+                           block_size: int = DOWNLOAD_BLOCK_SIZE) -> str:
+    """
+    Downloads the file from url to local_path block by block, the same way as downloads.download_to_file:
+    the file is written to <local_path>.part and an interrupted download is continued with a Range request,
+    unless the remote file has changed since
+    :return: local_path
+    """
+    headers = headers or {}
+    part_path = local_path + PART_SUFFIX
+
+    for attempt in range(2):
+        request_headers, offset = _resume_headers(part_path, headers)
+        async with session.open('GET', url, headers=request_headers) as response:
+            try:
+                mode = _resume_mode(part_path, response.status, response.headers, offset)
+            except FileNotFoundError:
+                continue
+            if mode is not None:
+                with open(part_path, mode) as f:
+                    async for block in response.content.iter_chunked(block_size):
+                        f.write(block)
+            break
+    else:
+        raise ValueError(f"[{__name__}] Couldn't download the file: "
+                         f"the server doesn't send the range that was asked for")
+
+    os.replace(part_path, local_path)
+    _discard_part(part_path)
+    return local_path
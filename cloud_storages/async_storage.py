@@ -0,0 +1,115 @@
+import asyncio
+
+from typing import AsyncIterator, Dict, List
+
+from cloud_storages.storage import DELETE_WORKERS, LIST_PAGE_SIZE
+from models.models import Resource, StorageMetaInfo
+
+
+class AsyncStorage:
+    """
+    An asyncio counterpart of Storage: the same operations as coroutines, so many of them run on one thread
+    """
+
+    # A MetadataCache for directory listings, no caching if not set
+    metadata_cache = None
+    # An AsyncHttpSession that the storage sends its requests with
+    http = None
+
+    async def close(self) -> None:
+        """
+        Closes the connections of the storage
+        """
+        if self.http is not None:
+            await self.http.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    async def list_resources_on_path(self, remote_path: str) -> List[Resource]:
+        """
+        List all items in directory
+        :param remote_path: directory
+        """
+        if self.metadata_cache is not None:
+            cached = self.metadata_cache.get(remote_path)
+            if cached is not None:
+                return cached
+        result = [resource async for resource in self.iter_resources_on_path(remote_path)]
+        if self.metadata_cache is not None:
+            self.metadata_cache.set(remote_path, result)
+        return result
+
+    def flush(self) -> None:
+        """
+        Writes the local state kept by the storage (e.g. cached listings) to the local database
+        """
+        if self.metadata_cache is not None:
+            self.metadata_cache.flush()
+
+    def _on_resource_saved(self, remote_path: str) -> None:
+        """
+        Should be called by the storage after a resource is saved, so cached listings of its directories are dropped
+        """
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(remote_path)
+
+    def _on_resource_deleted(self, remote_path: str) -> None:
+        self._on_resource_saved(remote_path)
+
+    async def iter_resources_on_path(self, remote_path: str,
+                                     page_size: int = LIST_PAGE_SIZE) -> AsyncIterator[Resource]:
+        """
+        Yields all items in directory, fetching them page by page
+        :param remote_path: directory
+        :param page_size: how many items to fetch with one request
+        :raises: FileNotFoundError if the directory doesn't exist, ValueError if the storage failed
+        """
+        return
+        yield
+
+    async def get_meta_info(self) -> StorageMetaInfo:
+        """
+        Gets meta info of storage
+        """
+        pass
+
+    async def save_resource_to_path(self, resource: Resource, remote_path: str, overwrite: bool) -> Resource or None:
+        """
+        Put a resource to the directory
+        """
+        pass
+
+    async def download_resource(self, remote_path: str, local_path: str) -> str:
+        """
+        Download a resource from path to folder to local_path and return path to the download
+        """
+        pass
+
+    async def delete_resource(self, remote_path: str) -> None:
+        """
+        Deletes the resource permanently, bypassing the trash
+        """
+        pass
+
+    async def delete_resources(self, remote_paths: List[str], workers: int = DELETE_WORKERS) -> Dict[str, str]:
+        """
+        Deletes the resources concurrently
+        :param workers: how many resources to delete at once
+        :return: errors by the remote paths that couldn't be deleted
+        """
+        errors = {}
+        limit = asyncio.Semaphore(workers)
+
+        async def _delete(remote_path: str) -> None:
+            async with limit:
+                try:
+                    await self.delete_resource(remote_path)
+                except (ValueError, OSError) as e:
+                    errors[remote_path] = str(e)
+
+        await asyncio.gather(*(_delete(remote_path) for remote_path in remote_paths))
+        return errors
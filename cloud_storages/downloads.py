@@ -0,0 +1,266 @@
+# Downloads that don't hold the file in memory
+# The file is written to <local_path>.part block by block and renamed when it is complete.
+# If the .part file is left by an interrupted download, the download is continued with an HTTP Range request.
+# The size and the ETag of the file that the .part was started from are kept next to it: the range is asked for
+# with If-Range, and the .part is thrown away if the server answers with another file or another range
+import json
+import os
+import re
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import BinaryIO, List, Tuple
+
+from cloud_storages.http_shortcuts import HttpSession
+
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+PART_SUFFIX = '.part'
+SEGMENTS_SUFFIX = '.segments'
+RESUME_SUFFIX = '.resume'
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+# How often the progress of a segmented download is saved
+SAVE_STATE_EVERY_BLOCKS = 64
+
+
+def _content_range(headers) -> Tuple[int or None, int or None]:
+    """
+    Parses Content-Range: bytes <start>-<end>/<size> or bytes */<size>
+    :return: the first byte and the size of the file, None for what the header doesn't tell
+    """
+    match = re.fullmatch(r'bytes (?:(\d+)-\d+|\*)/(\d+|\*)', headers.get('Content-Range', '').strip())
+    if not match:
+        return None, None
+    start, size = match.groups()
+    return int(start) if start is not None else None, int(size) if size != '*' else None
+
+
+def _content_length(headers) -> int or None:
+    length = headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+def _validator(headers) -> str or None:
+    """
+    Returns what tells this version of the file from the others: a strong ETag, or the time of the last change
+    """
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def _probe(session: HttpSession, url: str, headers: dict) -> Tuple[int or None, str or None]:
+    """
+    :return: the size of the remote file if the server supports range requests, None otherwise, and its validator
+    """
+    response = session.request('GET', url, headers={**headers, 'Range': 'bytes=0-0'}, stream=True)
+    response.close()
+    if response.status_code != 206:
+        return None, None
+    return _content_range(response.headers)[1], _validator(response.headers)
+
+
+def get_remote_size(session: HttpSession, url: str, headers: dict) -> int or None:
+    """
+    Returns the size of the remote file if the server supports range requests, None otherwise
+    """
+    return _probe(session, url, headers)[0]
+
+
+def _check_response(response) -> None:
+    if response.status_code not in (200, 206):
+        raise ValueError(f"[{__name__}] Couldn't download the file: Response: {str(response.status_code)}")
+
+
+def _load_json(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_json(path: str, data) -> None:
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def _discard_part(part_path: str) -> None:
+    """
+    Deletes the .part file and the state of its download
+    """
+    for path in (part_path, part_path + RESUME_SUFFIX, part_path + SEGMENTS_SUFFIX):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _resume_headers(part_path: str, headers: dict) -> Tuple[dict, int]:
+    """
+    Returns the headers of a request that continues the .part file, and the offset it is continued from.
+    A .part of a segmented download has holes, it can't be continued from its end and is thrown away
+    """
+    if os.path.exists(part_path + SEGMENTS_SUFFIX):
+        _discard_part(part_path)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if not offset:
+        return headers, 0
+    headers = {**headers, 'Range': f'bytes={offset}-'}
+    validator = (_load_json(part_path + RESUME_SUFFIX) or {}).get('validator')
+    if validator:
+        # The server sends the whole file instead of the range if the file has changed
+        headers['If-Range'] = validator
+    return headers, offset
+
+
+def _resume_mode(part_path: str, status_code: int, response_headers, offset: int) -> str or None:
+    """
+    Tells what to do with the response to the request of _resume_headers
+    :return: 'ab' to append the body to the .part file, 'wb' to write it from the start,
+             None if the .part file is complete already
+    :raises: ValueError if the server failed, FileNotFoundError if the .part file doesn't belong
+             to the remote file any more: it is thrown away and the download should be started over
+    """
+    if status_code == 200:
+        # The whole file, because the server ignores ranges or the file has changed
+        _save_json(part_path + RESUME_SUFFIX, {'size': _content_length(response_headers),
+                                               'validator': _validator(response_headers)})
+        return 'wb'
+    if status_code not in (206, 416):
+        raise ValueError(f"[{__name__}] Couldn't download the file: Response: {str(status_code)}")
+
+    start, size = _content_range(response_headers)
+    expected_size = (_load_json(part_path + RESUME_SUFFIX) or {}).get('size')
+    if status_code == 416 and size == offset and expected_size in (None, size):
+        return None
+    if status_code == 206 and start == offset and expected_size in (None, size):
+        return 'ab'
+    print(f'[{__name__}] {part_path} doesn\'t match the remote file any more, the download is started over')
+    _discard_part(part_path)
+    raise FileNotFoundError(part_path)
+
+
+def _download_sequential(session: HttpSession, url: str, part_path: str, headers: dict, block_size: int) -> None:
+    for attempt in range(2):
+        request_headers, offset = _resume_headers(part_path, headers)
+        with session.request('GET', url, headers=request_headers, stream=True) as response:
+            try:
+                mode = _resume_mode(part_path, response.status_code, response.headers, offset)
+            except FileNotFoundError:
+                continue
+            if mode is None:
+                return
+            with open(part_path, mode) as f:
+                for block in response.iter_content(block_size):
+                    f.write(block)
+            return
+    raise ValueError(f"[{__name__}] Couldn't download the file: the server doesn't send the range that was asked for")
+
+
+def _plan_segments(size: int, segments: int) -> List[list]:
+    segment_size = max(MIN_SEGMENT_SIZE, -(-size // segments))
+    return [[start, min(start + segment_size, size), start] for start in range(0, size, segment_size)]
+
+
+def _download_segmented(session: HttpSession, url: str, part_path: str, headers: dict, block_size: int, size: int,
+                        segments: int, validator: str or None = None) -> None:
+    """
+    Downloads byte ranges of the file in parallel. The progress of every range is kept in <part>.segments
+    with the size and the validator of the file, so an interrupted download of the same file is continued
+    range by range, and a download of a file that has changed since is started over
+    """
+    state_path = part_path + SEGMENTS_SUFFIX
+    state = _load_json(state_path) if os.path.exists(part_path) else None
+    if isinstance(state, dict) and state.get('size') == size and state.get('validator') == validator:
+        plan = state['segments']
+    else:
+        if state is not None:
+            print(f'[{__name__}] The remote file has changed since {part_path} was started, it is started over')
+        _discard_part(part_path)
+        plan = _plan_segments(size, segments)
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+    if validator:
+        # A range of a file that has changed since would be a 200 with the whole file
+        headers = {**headers, 'If-Range': validator}
+
+    state_lock = Lock()
+
+    def _save_state():
+        with state_lock:
+            _save_json(state_path, {'size': size, 'validator': validator, 'segments': plan})
+
+    def _download_segment(segment: list) -> None:
+        start, end, offset = segment
+        if offset >= end:
+            return
+        request_headers = {**headers, 'Range': f'bytes={offset}-{end - 1}'}
+        with session.request('GET', url, headers=request_headers, stream=True) as response:
+            if response.status_code != 206 or _content_range(response.headers) != (offset, size):
+                raise ValueError(f"[{__name__}] Couldn't download bytes {offset}-{end - 1}: "
+                                 f"Response: {str(response.status_code)} {response.headers.get('Content-Range')}")
+            with open(part_path, 'r+b') as f:
+                f.seek(offset)
+                for i, block in enumerate(response.iter_content(block_size), 1):
+                    f.write(block)
+                    segment[2] += len(block)
+                    if i % SAVE_STATE_EVERY_BLOCKS == 0:
+                        f.flush()
+                        _save_state()
+
+    try:
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            for future in [executor.submit(_download_segment, segment) for segment in plan]:
+                future.result()
+    finally:
+        _save_state()
+
+    if any(offset < end for _, end, offset in plan):
+        raise ValueError(f"[{__name__}] Download is incomplete, run it again to continue")
+    os.unlink(state_path)
+
+
+def open_stream(url: str, headers: dict or None = None, session: HttpSession or None = None, start: int = 0,
+                end: int or None = None) -> BinaryIO:
+    """
+    Opens the content of the file as a stream that is read while it is being downloaded
+    :param start: the first byte to read
+    :param end: the byte to stop before, the end of the file if not given
+    :return: a file-like object, close it to stop the download
+    """
+    session = session or HttpSession()
+    headers = headers or {}
+    if start or end is not None:
+        headers = {**headers, 'Range': f'bytes={start}-{"" if end is None else end - 1}'}
+    response = session.request('GET', url, headers=headers, stream=True)
+    if response.status_code != (206 if 'Range' in headers else 200):
+        response.close()
+        raise ValueError(f"[{__name__}] Couldn't download the file: Response: {str(response.status_code)}")
+    response.raw.decode_content = True
+    return response.raw
+
+
+def download_to_file(url: str, local_path: str, headers: dict or None = None, block_size: int = DOWNLOAD_BLOCK_SIZE,
+                     segments: int = 1, session: HttpSession or None = None) -> str:
+    """
+    Downloads the file from url to local_path in blocks of block_size
+    :param url: url of the file
+    :param local_path: where to save the file
+    :param headers: additional headers, e.g. authorization
+    :param block_size: size of the blocks that are written to the disk
+    :param segments: how many byte ranges to download in parallel. Falls back to 1 if the server doesn't support ranges
+    :param session: HttpSession to send the requests with
+    :return: local_path
+    """
+    session = session or HttpSession()
+    headers = headers or {}
+    part_path = local_path + PART_SUFFIX
+
+    size, validator = _probe(session, url, headers) if segments > 1 else (None, None)
+    if size:
+        _download_segmented(session, url, part_path, headers, block_size, size, segments, validator)
+    else:
+        _download_sequential(session, url, part_path, headers, block_size)
+
+    os.replace(part_path, local_path)
+    _discard_part(part_path)
+    return local_path
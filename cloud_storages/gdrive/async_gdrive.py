@@ -0,0 +1,193 @@
+from typing import AsyncIterator, List
+
+from cloud_storages.async_http import AsyncHttpSession, download_to_file
+from cloud_storages.async_storage import AsyncStorage
+from cloud_storages.gdrive.gdrive import GDriveStorage, FILE_FIELDS, GOOGLE_DRIVE_DB_KEY, UPLOAD_CHUNK_SIZE, \
+    _file_params, _listing_params
+from cloud_storages.gdrive.path_resolver import AsyncGDrivePathResolver
+from cloud_storages.http_shortcuts import get_token_header
+from cloud_storages.storage import LIST_PAGE_SIZE
+from cloud_storages.upload_sessions import UploadSessionStore
+from database.database import Database
+from models.models import StorageMetaInfo, Resource
+from settings import GDRIVE_API_URL
+
+
+def _error(response) -> ValueError:
+    return ValueError(f"Something went wrong with GD: Response: {str(response.status_code)} — {response.text}")
+
+
+class AsyncGDriveStorage(AsyncStorage):
+    """
+    The asyncio counterpart of GDriveStorage. Resolved paths and interrupted uploads are shared with it
+    through the local database
+    """
+
+    def __init__(self, token, database: Database or None = None, http: AsyncHttpSession or None = None):
+        self.token = token
+        self.http = http or AsyncHttpSession()
+        self._database = database
+        self._upload_sessions = None
+        self._paths = None
+
+    @property
+    def upload_sessions(self) -> UploadSessionStore:
+        if self._upload_sessions is None:
+            self._upload_sessions = UploadSessionStore(self._database or Database(), GOOGLE_DRIVE_DB_KEY)
+        return self._upload_sessions
+
+    @property
+    def paths(self) -> AsyncGDrivePathResolver:
+        if self._paths is None:
+            self._paths = AsyncGDrivePathResolver(self.http, self.token, self._database or Database(),
+                                                  GOOGLE_DRIVE_DB_KEY)
+        return self._paths
+
+    async def _get_file_id(self, remote_path: str, use_cache: bool = True) -> str:
+        """
+        Resolves the ID of the file on the remote path, see GDriveStorage._get_file_id
+        """
+        segments = [segment for segment in remote_path.split('/') if segment]
+        file_id = self.paths.file_id(segments) if use_cache else None
+        if file_id is not None:
+            return file_id
+        try:
+            return await self._find_file(segments)
+        except FileNotFoundError:
+            self.paths.forget(segments[:-1])
+            return await self._find_file(segments)
+
+    async def _find_file(self, segments: List[str]) -> str:
+        folder_id = await self.paths.resolve(segments[:-1])
+        response = await self.http.request('GET', f'{GDRIVE_API_URL}/drive/v3/files',
+                                           params=_file_params(segments[-1], folder_id), token=self.token)
+        if response.status_code != 200:
+            raise _error(response)
+        files = response.json().get('files', [])
+        if not files:
+            raise FileNotFoundError(f"Directory or file not found: {'/'.join(segments)}")
+        self.paths.remember_file(segments, files[0]['id'])
+        return files[0]['id']
+
+    async def iter_resources_on_path(self, remote_path: str,
+                                     page_size: int = LIST_PAGE_SIZE) -> AsyncIterator[Resource]:
+        """
+        Yields all items in directory, page by page
+        :param remote_path: path to the resource
+        :param page_size: how many items to fetch with one request, google allows at most 1000
+        """
+        folder_id = await self.paths.resolve(remote_path)
+
+        page_token = None
+        while True:
+            response = await self.http.request('GET', f'{GDRIVE_API_URL}/drive/v3/files',
+                                               params=_listing_params(folder_id, page_size, page_token),
+                                               token=self.token)
+            if response.status_code != 200:
+                raise _error(response)
+
+            response_as_json = response.json()
+            for resource in response_as_json['files']:
+                res: Resource or None = GDriveStorage._deserialize_resource(resource, remote_path)
+                if res is not None:
+                    self.paths.remember_listed(res, resource['id'])
+                    yield res
+
+            page_token = response_as_json.get('nextPageToken')
+            if not page_token:
+                return
+
+    async def get_meta_info(self) -> StorageMetaInfo:
+        response = await self.http.request('GET', f'{GDRIVE_API_URL}/drive/v3/about', params={'fields': '*'},
+                                           token=self.token)
+        if response.status_code != 200:
+            raise _error(response)
+        quota = response.json().get('storageQuota', {})
+        return StorageMetaInfo(int(quota.get('usage')), int(quota.get('limit')))
+
+    async def _create_upload_session(self, remote_path: str, _rec_call: bool = False) -> str:
+        """
+        Starts a resumable upload in the folder of remote_path and returns the session URI to put the content to
+        """
+        folder = remote_path.split('/')[:-1]
+        parent = await self.paths.resolve(folder, create=True)
+        response = await self.http.request('POST', f'{GDRIVE_API_URL}/upload/drive/v3/files',
+                                           params={'uploadType': 'resumable'}, json={'parents': [parent]},
+                                           token=self.token)
+        if response.status_code == 200:
+            return response.headers.get('Location')
+        # The folder was deleted since we have resolved it
+        if response.status_code == 404 and not _rec_call:
+            self.paths.forget(folder)
+            return await self._create_upload_session(remote_path, _rec_call=True)
+        raise _error(response)
+
+    async def save_resource_to_path(self, resource: Resource, remote_path: str, overwrite: bool) -> Resource or None:
+        """
+        Put an Item to the directory in chunks of a resumable upload session, the same as
+        GDriveStorage.save_resource_to_path: an interrupted upload of the same file is continued
+        """
+        sessions = self.upload_sessions
+        session = sessions.get(resource.path)
+        result = None
+        if session:
+            try:
+                response = await self.http.request('PUT', session['url'],
+                                                   headers={'Content-Range': f'bytes */{session["size"]}'})
+                result = GDriveStorage._parse_upload_response(response)
+                remote_path = session.get('remote_path', remote_path)
+            except FileNotFoundError:
+                session = None
+        if not session:
+            session = sessions.start(resource.path, await self._create_upload_session(remote_path), remote_path)
+            result = 0
+
+        size = session['size']
+        with open(resource.path, 'rb') as f:
+            while not isinstance(result, dict):
+                offset = result
+                f.seek(offset)
+                chunk = f.read(UPLOAD_CHUNK_SIZE)
+                content_range = f'bytes {offset}-{offset + len(chunk) - 1}/{size}' if chunk else f'bytes */{size}'
+                response = await self.http.request('PUT', session['url'], data=chunk,
+                                                   headers={'Content-Range': content_range})
+                result = GDriveStorage._parse_upload_response(response)
+                if not isinstance(result, dict):
+                    if result <= offset:
+                        raise ValueError(f"Something went wrong with GD: the upload stopped at {offset} bytes")
+                    sessions.update(resource.path, session, result)
+
+        response = await self.http.request('PATCH', f'{GDRIVE_API_URL}/drive/v3/files/{result.get("id")}',
+                                           json={'name': remote_path.split('/')[-1]},
+                                           params={'fields': FILE_FIELDS}, token=self.token)
+        if not 199 < response.status_code < 300:
+            raise _error(response)
+        self.paths.remember_file(remote_path, result.get('id'))
+
+        sessions.finish(resource.path)
+        self._on_resource_saved(remote_path)
+        return GDriveStorage._deserialize_resource(response.json(), '/'.join(remote_path.split('/')[:-1])) or \
+            resource
+
+    async def download_resource(self, remote_path: str, local_path: str) -> str:
+        # Looked up anew, as in GDriveStorage.get_download_link
+        file_id = await self._get_file_id(remote_path, use_cache=False)
+        url = f'{GDRIVE_API_URL}/drive/v3/files/{file_id}?alt=media'
+        return await download_to_file(self.http, url, local_path, get_token_header(self.token))
+
+    async def _delete_file(self, file_id: str):
+        return await self.http.request('DELETE', f'{GDRIVE_API_URL}/drive/v3/files/{file_id}', token=self.token)
+
+    async def delete_resource(self, remote_path: str) -> None:
+        try:
+            response = await self._delete_file(await self._get_file_id(remote_path))
+            if response.status_code == 404:
+                # The remembered ID is stale, see GDriveStorage.delete_resource
+                self.paths.forget(remote_path)
+                response = await self._delete_file(await self._get_file_id(remote_path, use_cache=False))
+        except FileNotFoundError:
+            return
+        if response.status_code not in (204, 404):
+            raise _error(response)
+        self.paths.forget(remote_path)
+        self._on_resource_deleted(remote_path)
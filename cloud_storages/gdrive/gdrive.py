@@ -3,84 +3,120 @@ from __future__ import print_function
 import datetime
 import json
 from json import JSONDecodeError
-from typing import List
-from functools import lru_cache
+from typing import List, Iterable, Iterator, Tuple
 
+from cloud_storages.downloads import download_to_file
 from cloud_storages.http_shortcuts import *
 from database.database import Database
 from models.models import StorageMetaInfo, Resource, Size
-from cloud_storages.storage import Storage
+from cloud_storages.storage import Storage, LIST_PAGE_SIZE
+from cloud_storages.upload_sessions import UploadSessionStore
+from cloud_storages.gdrive.path_resolver import GDrivePathResolver, quote
 from cloud_storages.gdrive.client_config import GOOGLE_DRIVE_CONFIG, SCOPES
+from settings import GDRIVE_API_URL
 
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 
 GOOGLE_DRIVE_DB_KEY = 'google'
+# Only the fields that _deserialize_resource reads
+FILE_FIELDS = 'id, name, mimeType, size, md5Checksum'
+LIST_FIELDS = f'nextPageToken, files({FILE_FIELDS})'
+# Chunks of a resumable upload must be multiples of 256 KiB, except the last one
+UPLOAD_CHUNK_SIZE = 32 * 256 * 1024
+
+
+def _rechunk(stream: Iterable[bytes], chunk_size: int) -> Iterator[Tuple[bytes, bool]]:
+    """
+    Regroups the stream into chunks of exactly chunk_size bytes (the last one may be smaller)
+    and tells whether the chunk is the last one
+    """
+    buffer = bytearray()
+    previous = None
+    for data in stream:
+        buffer += data
+        while len(buffer) >= chunk_size:
+            if previous is not None:
+                yield previous, False
+            previous = bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        if previous is not None:
+            yield previous, False
+        yield bytes(buffer), True
+    else:
+        yield previous or b'', True
+
+
+def _file_params(name: str, folder_id: str) -> dict:
+    # The parameters of a lookup of the file by name in the folder
+    return {'fields': 'files(id)', 'q': f"name = {quote(name)} and '{folder_id}' in parents and trashed = false"}
+
+
+def _listing_params(folder_id: str, page_size: int, page_token: str or None) -> dict:
+    # The parameters of a page of the listing of the folder
+    params = {'fields': LIST_FIELDS, 'q': f"'{folder_id}' in parents and trashed = false", 'pageSize': str(page_size)}
+    if page_token:
+        params['pageToken'] = page_token
+    return params
 
 
 class GDriveStorage(Storage):
 
-    def __init__(self, token):
+    def __init__(self, token, database: Database or None = None, http: HttpSession or None = None):
         self.token = token
-
-    @lru_cache(maxsize=None)
-    def _get_folder_id_by_name(self, name: str) -> str:
+        self.http = http or HttpSession()
+        self._database = database
+        self._upload_sessions = None
+        self._paths = None
+
+    @property
+    def upload_sessions(self) -> UploadSessionStore:
+        # The database is opened only when it is needed, most of the commands don't upload anything
+        if self._upload_sessions is None:
+            self._upload_sessions = UploadSessionStore(self._database or Database(), GOOGLE_DRIVE_DB_KEY)
+        return self._upload_sessions
+
+    @property
+    def paths(self) -> GDrivePathResolver:
+        if self._paths is None:
+            self._paths = GDrivePathResolver(self.http, self.token, self._database or Database(),
+                                             GOOGLE_DRIVE_DB_KEY)
+        return self._paths
+
+    def _get_file_id(self, remote_path: str, use_cache: bool = True) -> str:
         """
-        Google drive has a quirk - you can't really use normal os-like paths - first you need to get an ID of the folder
-        This function searches for folders with specified name
+        Resolves the ID of the file on the remote path: the folder is resolved by the path resolver,
+        then the file is looked up by name in it
+        :param use_cache: whether an ID remembered when the file was listed or uploaded can be returned
         """
-
-        response = get_with_OAuth(
-            f"https://www.googleapis.com/drive/v3/files",
-            params={
-                'fields': '*',
-                'q': f"name = '{name}' and mimeType = 'application/vnd.google-apps.folder'"
-            },
+        segments = [segment for segment in remote_path.split('/') if segment]
+        file_id = self.paths.file_id(segments) if use_cache else None
+        if file_id is not None:
+            return file_id
+        try:
+            return self._find_file(segments)
+        except FileNotFoundError:
+            # The ID of the folder may be stale, e.g. the folder was deleted and made again
+            self.paths.forget(segments[:-1])
+            return self._find_file(segments)
+
+    def _find_file(self, segments: List[str]) -> str:
+        folder_id = self.paths.resolve(segments[:-1])
+        response = self.http.get_with_OAuth(
+            f"{GDRIVE_API_URL}/drive/v3/files",
+            params=_file_params(segments[-1], folder_id),
             token=self.token
         )
-
-        if response.status_code == 200:
-            response_as_json = response.json()
-            try:
-                if len(response_as_json['files']) == 0:
-                    raise FileNotFoundError(f"Directory or file not found")
-                result = response_as_json['files'][0]['id']
-                return result
-            except IndexError as e:
-                raise ValueError(f"Something went wrong with GD: Error: {e}")
-        elif response.status_code == 404:
-            raise FileNotFoundError(f"Directory or file not found")
-        else:
+        if response.status_code != 200:
             raise ValueError(f"Something went wrong with GD: Response: "
                              f"{str(response.status_code)} — {response.json()}")
-
-    def _get_parent_folder_id(self, path: List[str]) -> str:
-        """
-        Resolves and creates necessary directories and returns the last created / fetched directory
-        """
-        ids = []
-        for folder in path:
-            try:
-                id = self._get_folder_id_by_name(folder)
-                ids.append(id)
-                continue
-            except FileNotFoundError:
-                # Getting value error means that there are not Path and we need to create it
-                data = {
-                    'name': folder,
-                    'mimeType': 'application/vnd.google-apps.folder'
-                }
-                if len(ids) > 0:
-                    data['parents'] = [ids[-1]]
-                response = post_with_OAuth('https://www.googleapis.com/drive/v3/files', token=self.token, json=data)
-                if response.status_code == 200:
-                    response_read = response.json()
-                    ids.append(response_read.get('id'))
-                else:
-                    raise ValueError(f"Something went wrong with GD: Response: "
-                                     f"{str(response.status_code)} — {response.json()['message']}")
-        return ids[-1]
+        files = response.json().get('files', [])
+        if not files:
+            raise FileNotFoundError(f"Directory or file not found: {'/'.join(segments)}")
+        self.paths.remember_file(segments, files[0]['id'])
+        return files[0]['id']
 
     @classmethod
     # todo (toplenboren) remove database argument dependency :(
@@ -102,62 +138,65 @@ class GDriveStorage(Storage):
             db.set(GOOGLE_DRIVE_DB_KEY, creds.token)
 
     @classmethod
-    def _deserialize_resource(cls, json: dict) -> Resource or None:
+    def _deserialize_resource(cls, json: dict, parent_path: str or None = None) -> Resource or None:
         """
         Tries to parse Resource from YD to Resource object
         :param json:
+        :param parent_path: a path of the folder that has the resource
         :return:
         """
         try:
             is_file = True
             if 'folder' in json['mimeType']:
                 is_file = False
-            # You don't have pathes in google drive, instead -- you have an id
-            path = json['id']
+            # You don't have pathes in google drive, instead -- you have an id. If we know the path of the parent,
+            # the path of the resource is known too
+            path = '/'.join([parent_path.strip('/'), json['name']]) if parent_path is not None else json['id']
         except KeyError:
             return None
         res = Resource(is_file, path)
-        res.size = None
+        res.size = Size(int(json['size']), 'b') if json.get('size') else None
         res.name = json.get('name')
         res.url = None
         res.updated = datetime.datetime.now()
-        res.md5 = None
+        res.md5 = json.get('md5Checksum')
         return res
 
-    def list_resources_on_path(self, remote_path: str) -> List[Resource]:
+    def iter_resources_on_path(self, remote_path: str, page_size: int = LIST_PAGE_SIZE) -> Iterator[Resource]:
         """
-        List all items in directory
+        Yields all items in directory, page by page
         :param path: path to the resource
+        :param page_size: how many items to fetch with one request, google allows at most 1000
         """
 
-        folder_id = self._get_folder_id_by_name(remote_path)
+        folder_id = self.paths.resolve(remote_path)
 
-        response = get_with_OAuth(
-            f"https://www.googleapis.com/drive/v3/files",
-            params={
-                'fields': '*',
-                'q': f"'{folder_id}' in parents"
-            },
-            token=self.token
-        )
+        page_token = None
+        while True:
+            response = self.http.get_with_OAuth(
+                f"{GDRIVE_API_URL}/drive/v3/files",
+                params=_listing_params(folder_id, page_size, page_token),
+                token=self.token
+            )
 
-        if response.status_code == 200:
-            result = []
-            response_as_json = response.json()
-            files = response_as_json['files']
+            if response.status_code != 200:
+                raise ValueError(f"Something went wrong with GD: Response: "
+                                 f"{str(response.status_code)} — {response.json()['message']}")
 
-            for resource in files:
-                res: Resource or None = self._deserialize_resource(resource)
+            response_as_json = response.json()
+            for resource in response_as_json['files']:
+                res: Resource or None = self._deserialize_resource(resource, remote_path)
                 if res is not None:
-                    result.append(res)
+                    # Listing tells the IDs of all the items, so resolving their paths later is free
+                    self.paths.remember_listed(res, resource['id'])
+                    yield res
 
-            return result
-        else:
-            raise ValueError(f"Something went wrong with YD: Response: "
-                             f"{str(response.status_code)} — {response.json()['message']}")
+            page_token = response_as_json.get('nextPageToken')
+            if not page_token:
+                return
 
     def get_meta_info(self) -> StorageMetaInfo:
-        response = get_with_OAuth('https://www.googleapis.com/drive/v3/about?fields=*', token=self.token)
+        response = self.http.get_with_OAuth(f'{GDRIVE_API_URL}/drive/v3/about?fields=*', token=self.token)
         if response.status_code == 200:
             response_read = response.json()
             used_space = response_read.get('storageQuota', {}).get('usage')
@@ -167,79 +206,177 @@ class GDriveStorage(Storage):
             raise ValueError(f"Something went wrong with GD: Response: "
                              f"{str(response.status_code)} — {response.json()['message']}")
 
-    def save_resource_to_path(self, resource: Resource, remote_path: str, overwrite: bool,
-                              _rec_call: bool = False) -> Resource or None:
+    def _create_upload_session(self, remote_path: str, _rec_call: bool = False) -> str:
         """
-        Put an Item to the directory
-        :param resource: resource on the local fs
-        :param remote_path: string, path to resource on remote fs
+        Starts a resumable upload in the folder of remote_path and returns the session URI to put the content to
         :param _rec_call: bool, a system parameter, whether or not this function was called as a recursive call
-        :return: saved resource or raises exception
         """
+        folder = remote_path.split('/')[:-1]
+        parent = self.paths.resolve(folder, create=True)
 
-        upload_successful_flag = False
-
-        parent = self._get_parent_folder_id(remote_path.split('/'))
-
-        response = post_with_OAuth(
-            f'https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable',
+        response = self.http.post_with_OAuth(
+            f'{GDRIVE_API_URL}/upload/drive/v3/files?uploadType=resumable',
             json={
                 "parents": [parent]
             },
             token=self.token
         )
         if response.status_code == 200:
-            response_headers = response.headers
-            upload_link = response_headers.get('Location')
-
-            with open(resource.path, 'rb') as f:
-                files = f
-
-                response = put_with_OAuth(upload_link, data=files)
-                if 199 < response.status_code < 401:
-                    uploaded_file_id = response.json().get('id')
-
-                    metadata = {"name": files.name}
-
-                    metadata_response = patch_with_OAuth(
-                        f'https://www.googleapis.com/drive/v3/files/{uploaded_file_id}',
-                        json=metadata,
-                        token=self.token
-                    )
-                    if 199 < metadata_response.status_code < 401:
-                        upload_successful_flag = True # We cant use file without metadata! even if it is uploaded
-                        file_metadata = metadata_response.json()
-
-            if not upload_successful_flag:
-                raise ValueError("Something went wrong! Could not upload file. Please try again later or contact the developer")
-
-            resource_metainfo = self._deserialize_resource(file_metadata)
-            if 199 < response.status_code < 401:
-                return resource_metainfo
-            elif upload_successful_flag:
-                return resource
+            return response.headers.get('Location')
+        # The folder was deleted since we have resolved it
+        if response.status_code == 404 and not _rec_call:
+            self.paths.forget(folder)
+            return self._create_upload_session(remote_path, _rec_call=True)
 
         raise ValueError(f"Something went wrong with GD: Response: "
                          f"{str(response.status_code)} — {response.json().get('message', '')}")
 
-    def download_resource(self, remote_path, local_path) -> str:
-
-        response = get_with_OAuth(
-            f'https://cloud-api.yandex.net/v1/disk/resources/download?path={remote_path}',
+    def _set_file_name(self, file_id: str, name: str) -> dict:
+        """
+        Sets the name of the uploaded file and returns its metadata
+        """
+        metadata_response = self.http.patch_with_OAuth(
+            f'{GDRIVE_API_URL}/drive/v3/files/{file_id}',
+            json={"name": name},
+            params={'fields': FILE_FIELDS},
             token=self.token
         )
-        if response.status_code == 200:
-            response_read = response.json()
-            dl_url = response_read.get('href')
-        else:
-            raise ValueError(f"[{__name__}] Something went wrong with YD: Response: "
-                             f"{str(response.status_code)} — {response.json()['message']}")
+        # We cant use file without metadata! even if it is uploaded
+        if 199 < metadata_response.status_code < 401:
+            return metadata_response.json()
+        raise ValueError("Something went wrong! Could not upload file. Please try again later or contact the developer")
 
-        file = requests.get(dl_url)
-        open(local_path, 'wb').write(file.content)
+    def _get_upload_offset(self, upload_link: str, size: int) -> int or dict:
+        """
+        Asks google how much of the resumable upload it has received
+        :return: the offset to continue from, or metadata of the file if the upload is already complete
+        :raises: FileNotFoundError if the session has expired
+        """
+        response = self.http.put_with_OAuth(upload_link, headers={'Content-Range': f'bytes */{size}'})
+        return self._parse_upload_response(response)
 
-        return local_path
+    @classmethod
+    def _parse_upload_response(cls, response) -> int or dict:
+        """
+        Parses the response to a chunk of a resumable upload
+        :return: the confirmed offset, or metadata of the file if the upload is complete
+        """
+        # 308 means "Resume Incomplete" - google is waiting for the next chunk
+        if response.status_code == 308:
+            # Range looks like bytes=0-1048575, there is no header if nothing was received
+            received = response.headers.get('Range')
+            return int(received.split('-')[-1]) + 1 if received else 0
+        if 199 < response.status_code < 300:
+            return response.json()
+        if response.status_code in (404, 410):
+            raise FileNotFoundError('Upload session has expired')
+        raise ValueError(f"Something went wrong with GD: Response: "
+                         f"{str(response.status_code)} — {response.text}")
 
+    def has_pending_upload(self, resource: Resource) -> str or None:
+        session = self.upload_sessions.get(resource.path)
+        return session['remote_path'] if session else None
+
+    def save_resource_to_path(self, resource: Resource, remote_path: str, overwrite: bool) -> Resource or None:
+        """
+        Put an Item to the directory
+        The file is sent in chunks and the confirmed offset is saved in the local database after every chunk.
+        If the upload of the same file was interrupted before, it is continued from the confirmed offset
+        :param resource: resource on the local fs
+        :param remote_path: string, path to resource on remote fs
+        :return: saved resource or raises exception
+        """
+        sessions = self.upload_sessions
+        session = sessions.get(resource.path)
+        result = None
+        if session:
+            try:
+                result = self._get_upload_offset(session['url'], session['size'])
+                # The file goes where the interrupted upload was sending it
+                remote_path = session.get('remote_path', remote_path)
+                if not isinstance(result, dict):
+                    print(f'[{__name__}] Resuming upload to {remote_path} from byte {result}')
+            except FileNotFoundError:
+                session = None
+        if not session:
+            session = sessions.start(resource.path, self._create_upload_session(remote_path), remote_path)
+            result = 0
+
+        size = session['size']
+        with open(resource.path, 'rb') as f:
+            while not isinstance(result, dict):
+                offset = result
+                f.seek(offset)
+                chunk = f.read(UPLOAD_CHUNK_SIZE)
+                content_range = f'bytes {offset}-{offset + len(chunk) - 1}/{size}' if chunk else f'bytes */{size}'
+                response = self.http.put_with_OAuth(session['url'], data=chunk, headers={'Content-Range': content_range})
+                result = self._parse_upload_response(response)
+                if not isinstance(result, dict):
+                    if result <= offset:
+                        raise ValueError(f"Something went wrong with GD: the upload stopped at {offset} bytes")
+                    sessions.update(resource.path, session, result)
+
+        file_metadata = self._set_file_name(result.get('id'), remote_path.split('/')[-1])
+        self.paths.remember_file(remote_path, result.get('id'))
+
+        sessions.finish(resource.path)
+        self._on_resource_saved(remote_path)
+        return self._deserialize_resource(file_metadata, '/'.join(remote_path.split('/')[:-1])) or resource
+
+    def save_stream_to_path(self, stream: Iterable[bytes], remote_path: str, overwrite: bool) -> Resource or None:
+        """
+        Put an Item to the directory, reading it from the stream. The size is not known in advance,
+        so the content is sent in chunks of the resumable upload session and the total is given with the last one
+        :param stream: iterable of bytes, the content of the resource
+        :param remote_path: string, path to resource on remote fs
+        :return: saved resource or raises exception
+        """
+        upload_link = self._create_upload_session(remote_path)
+
+        offset = 0
+        result = None
+        for chunk, is_last in _rechunk(stream, UPLOAD_CHUNK_SIZE):
+            end = offset + len(chunk) - 1
+            total = str(offset + len(chunk)) if is_last else '*'
+            content_range = f'bytes {offset}-{end}/{total}' if chunk else f'bytes */{total}'
+            response = self.http.put_with_OAuth(upload_link, data=chunk, headers={'Content-Range': content_range})
+            result = self._parse_upload_response(response)
+            offset += len(chunk)
+            if isinstance(result, dict) != is_last or (not is_last and result != offset):
+                raise ValueError(f"Something went wrong with GD: the upload stopped at {offset} bytes")
+
+        file_metadata = self._set_file_name(result.get('id'), remote_path.split('/')[-1])
+        self.paths.remember_file(remote_path, result.get('id'))
+        self._on_resource_saved(remote_path)
+        return self._deserialize_resource(file_metadata, '/'.join(remote_path.split('/')[:-1])) or \
+            Resource(True, remote_path)
+
+    def get_download_link(self, remote_path: str) -> Tuple[str, dict]:
+        # The link is requested by someone else, a 404 of a stale ID couldn't be retried, so the file is looked up
+        return (f'{GDRIVE_API_URL}/drive/v3/files/{self._get_file_id(remote_path, use_cache=False)}?alt=media',
+                get_token_header(self.token))
+
+    def download_resource(self, remote_path, local_path, segments: int = 1) -> str:
+        url, headers = self.get_download_link(remote_path)
+        return download_to_file(url, local_path, headers=headers, segments=segments, session=self.http)
+
+    def _delete_file(self, file_id: str):
+        return self.http.request('DELETE', f'{GDRIVE_API_URL}/drive/v3/files/{file_id}', token=self.token)
+
+    def delete_resource(self, remote_path: str) -> None:
+        try:
+            response = self._delete_file(self._get_file_id(remote_path))
+            if response.status_code == 404:
+                # The remembered ID is stale, the file may have been replaced since it was listed
+                self.paths.forget(remote_path)
+                response = self._delete_file(self._get_file_id(remote_path, use_cache=False))
+        except FileNotFoundError:
+            return
+        if response.status_code not in (204, 404):
+            raise ValueError(f"Something went wrong with GD: Response: "
+                             f"{str(response.status_code)} — {response.text}")
+        self.paths.forget(remote_path)
+        self._on_resource_deleted(remote_path)
 
 def main():
     storage = GDriveStorage(None)
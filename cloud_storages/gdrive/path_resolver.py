@@ -0,0 +1,257 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Generator, List, Tuple
+
+from cloud_storages.http_shortcuts import HttpSession
+from database.database import SUBTREE_CONDITION, Database, subtree_range
+from models.models import Resource
+from settings import GDRIVE_API_URL
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+ROOT_ALIAS = 'root'
+MAX_FOLDERS = 10000
+MAX_FILES = 10000
+
+# Resolving is written once for the sync and the async resolver: the steps are a generator that yields
+# the requests to send as (method, url, keyword arguments of the request) and is sent back their responses.
+# Each resolver only sends them with its own session, see _run
+Steps = Generator[Tuple[str, str, dict], object, object]
+
+
+def _split(path: str or List[str]) -> List[str]:
+    if isinstance(path, str):
+        path = path.split('/')
+    return [segment for segment in path if segment]
+
+
+def quote(name: str) -> str:
+    return "'" + name.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def _checked(response) -> dict:
+    if response.status_code != 200:
+        raise ValueError(f"Something went wrong with GD: Response: {str(response.status_code)} — {response.text}")
+    return response.json()
+
+
+class GDrivePathResolver:
+    """
+    Google drive has a quirk - you can't really use normal os-like paths - first you need to get an ID of the folder
+    This class resolves os-like paths to IDs, walking from the root folder by parent ID.
+    IDs of folders are kept in the folder_ids table of the local database, a row for every folder, so a known path
+    costs no requests and an unknown one costs a single request for all of its unknown folders. At most
+    max_folders of them are kept, the ones resolved the longest ago are dropped
+    IDs of files are kept in memory only, for the files listed or uploaded by this process
+    """
+
+    def __init__(self, http: HttpSession, token: str, database: Database, storage_key: str,
+                 max_folders: int = MAX_FOLDERS, max_files: int = MAX_FILES):
+        """
+        :param http: HttpSession to send requests with
+        :param token: access token
+        :param database: a local database to keep the IDs of folders in
+        :param storage_key: a name of the storage in the database
+        :param max_folders: how many IDs of folders to keep in the database
+        :param max_files: how many IDs of files to keep in memory
+        """
+        self.http = http
+        self.token = token
+        self.database = database
+        self.storage_key = storage_key
+        self.max_folders = max_folders
+        self.max_files = max_files
+        self._lock = Lock()
+        # Two uploads to the same new folder mustn't create it twice
+        self._resolve_lock = Lock()
+        self._file_ids: 'OrderedDict[str, str]' = OrderedDict()
+        with database.transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS folder_ids (storage TEXT NOT NULL, path TEXT NOT NULL, '
+                'id TEXT NOT NULL, time REAL NOT NULL, PRIMARY KEY (storage, path)) WITHOUT ROWID'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS folder_ids_time ON folder_ids (storage, time)')
+            # Older versions kept the IDs of folders and files as one JSON value, they are resolved again
+            database.delete(f'paths:{storage_key}')
+
+    def _known_prefix(self, segments: List[str]) -> Tuple[int, str or None]:
+        """
+        Returns the count of segments of the longest prefix of the path that has a known ID, and its ID
+        """
+        prefixes = ['/'.join(segments[:i]) for i in range(len(segments) + 1)]
+        rows = self.database.connection.execute(
+            f'SELECT path, id FROM folder_ids WHERE storage = ? AND path IN ({", ".join("?" * len(prefixes))})',
+            (self.storage_key, *prefixes)
+        )
+        known = dict(rows)
+        for i in range(len(segments), -1, -1):
+            if prefixes[i] in known:
+                return i, known[prefixes[i]]
+        return 0, None
+
+    def remember_folder(self, path: str or List[str], folder_id: str) -> None:
+        """
+        Remembers the ID of the folder, e.g. when it was just created or listed
+        """
+        with self.database.transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO folder_ids (storage, path, id, time) VALUES (?, ?, ?, ?)',
+                               (self.storage_key, '/'.join(_split(path)), folder_id, time.time()))
+            connection.execute(
+                'DELETE FROM folder_ids WHERE storage = ? AND path NOT IN '
+                '(SELECT path FROM folder_ids WHERE storage = ? ORDER BY time DESC LIMIT ?)',
+                (self.storage_key, self.storage_key, self.max_folders)
+            )
+
+    def remember_file(self, path: str or List[str], file_id: str) -> None:
+        """
+        Remembers the ID of the file in memory, e.g. when it was just uploaded or listed
+        """
+        key = '/'.join(_split(path))
+        with self._lock:
+            self._file_ids[key] = file_id
+            self._file_ids.move_to_end(key)
+            while len(self._file_ids) > self.max_files:
+                self._file_ids.popitem(last=False)
+
+    def remember_listed(self, resource: Resource, resource_id: str) -> None:
+        """
+        Remembers the ID of a listed file or folder
+        """
+        if resource.is_file:
+            self.remember_file(resource.path, resource_id)
+        else:
+            self.remember_folder(resource.path, resource_id)
+
+    def file_id(self, path: str or List[str]) -> str or None:
+        """
+        Returns the remembered ID of the file, or None
+        """
+        with self._lock:
+            return self._file_ids.get('/'.join(_split(path)))
+
+    def forget(self, path: str or List[str]) -> None:
+        """
+        Forgets the path and everything under it, e.g. when the ID turned out to be stale
+        """
+        key = '/'.join(_split(path))
+        with self._lock:
+            for known in [k for k in self._file_ids if k == key or k.startswith(key + '/')]:
+                del self._file_ids[known]
+        if not key:
+            self.database.connection.execute('DELETE FROM folder_ids WHERE storage = ?', (self.storage_key,))
+            return
+        self.database.connection.execute(
+            f'DELETE FROM folder_ids WHERE storage = ? AND {SUBTREE_CONDITION}', (self.storage_key, *subtree_range(key))
+        )
+
+    def _find_folders(self, names: List[str]) -> Steps:
+        """
+        Finds all folders having any of the names with one (paginated) request
+        """
+        query = ' or '.join(f'name = {quote(name)}' for name in sorted(set(names)))
+        params = {
+            'fields': 'nextPageToken, files(id, name, parents)',
+            'q': f"mimeType = '{FOLDER_MIME_TYPE}' and trashed = false and ({query})",
+            'pageSize': '1000',
+        }
+        folders = []
+        while True:
+            page = _checked((yield 'GET', f'{GDRIVE_API_URL}/drive/v3/files', {'params': dict(params)}))
+            folders += page.get('files', [])
+            if not page.get('nextPageToken'):
+                return folders
+            params['pageToken'] = page['nextPageToken']
+
+    def _get_root_id(self) -> Steps:
+        """
+        'root' is only an alias, the parents of a folder contain the real ID of the root folder
+        """
+        _, root_id = self._known_prefix([])
+        if root_id is None:
+            response = yield 'GET', f'{GDRIVE_API_URL}/drive/v3/files/{ROOT_ALIAS}', {'params': {'fields': 'id'}}
+            root_id = _checked(response)['id']
+            self.remember_folder('', root_id)
+        return root_id
+
+    def _resolve(self, segments: List[str], create: bool) -> Steps:
+        """
+        Walks the path down from its longest known prefix. Doesn't send the requests itself, see Steps
+        """
+        known, parent_id = self._known_prefix(segments)
+        if known == len(segments) and known:
+            return parent_id
+        if not known:
+            parent_id = yield from self._get_root_id()
+
+        unknown = segments[known:]
+        folders = (yield from self._find_folders(unknown)) if unknown else []
+        for i, name in enumerate(unknown, known + 1):
+            candidates = [f for f in folders if f['name'] == name and parent_id in f.get('parents', [])]
+            if candidates:
+                parent_id = candidates[0]['id']
+            elif create:
+                response = yield 'POST', f'{GDRIVE_API_URL}/drive/v3/files', {
+                    'json': {'name': name, 'mimeType': FOLDER_MIME_TYPE, 'parents': [parent_id]}
+                }
+                parent_id = _checked(response)['id']
+            else:
+                raise FileNotFoundError(f"Directory or file not found: {'/'.join(segments[:i])}")
+            self.remember_folder(segments[:i], parent_id)
+        return parent_id
+
+    def _run(self, steps: Steps):
+        """
+        Sends the requests of the steps and returns what they return
+        """
+        response = None
+        while True:
+            try:
+                method, url, kwargs = steps.send(response)
+            except StopIteration as stop:
+                return stop.value
+            response = self.http.request(method, url, token=self.token, **kwargs)
+
+    def resolve(self, path: str or List[str], create: bool = False) -> str:
+        """
+        Returns the ID of the folder on the path
+        :param path: a path like 'a/b/c' or a list of its segments
+        :param create: whether to create the folders that don't exist
+        :raises: FileNotFoundError if a folder doesn't exist and create is False
+        """
+        with self._resolve_lock:
+            return self._run(self._resolve(_split(path), create))
+
+
+class AsyncGDrivePathResolver(GDrivePathResolver):
+    """
+    The same resolver for the async storage: the steps of resolving are the same,
+    only the requests are sent with an AsyncHttpSession
+    """
+
+    def __init__(self, http, token: str, database: Database, storage_key: str):
+        """
+        :param http: AsyncHttpSession to send requests with
+        """
+        super().__init__(http, token, database, storage_key)
+        self._resolve_lock = None
+
+    async def _run(self, steps: Steps):
+        response = None
+        while True:
+            try:
+                method, url, kwargs = steps.send(response)
+            except StopIteration as stop:
+                return stop.value
+            response = await self.http.request(method, url, token=self.token, **kwargs)
+
+    async def resolve(self, path: str or List[str], create: bool = False) -> str:
+        """
+        Returns the ID of the folder on the path, see GDrivePathResolver.resolve
+        """
+        # The lock belongs to the event loop it is made in
+        if self._resolve_lock is None:
+            self._resolve_lock = asyncio.Lock()
+        async with self._resolve_lock:
+            return await self._run(self._resolve(_split(path), create))
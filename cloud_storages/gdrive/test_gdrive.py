@@ -0,0 +1,223 @@
+import asyncio
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+import requests
+
+from benchmarks.fake_cloud import FakeCloud
+from cloud_storages.gdrive import async_gdrive, gdrive, path_resolver
+from cloud_storages.gdrive.async_gdrive import AsyncGDriveStorage
+from cloud_storages.gdrive.gdrive import GDriveStorage
+from database.database import Database
+from models.models import Resource
+
+
+def _interrupt_upload_at(storage: GDriveStorage, chunk: int) -> list:
+    """
+    Makes the chunk with this number fail with a connection error, as if the network went down
+    :param chunk: the number of the chunk, from 1. With 0 no chunk fails, the chunks are only recorded
+    :return: Content-Range headers of the chunks that are sent, the list grows with every chunk
+    """
+    sent = []
+    request = storage.http.request
+
+    def _request(method, addr, *args, **kwargs):
+        if method == 'PUT' and '/_gdrive/upload/' in addr and kwargs.get('data'):
+            sent.append(kwargs['headers']['Content-Range'])
+            if len(sent) == chunk:
+                raise requests.ConnectionError('The network is down')
+        return request(method, addr, *args, **kwargs)
+
+    storage.http.request = _request
+    return sent
+
+
+class GDriveStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cloud = FakeCloud().start()
+        for module in (gdrive, async_gdrive, path_resolver):
+            patcher = mock.patch.object(module, 'GDRIVE_API_URL', self.cloud.url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+
+    def tearDown(self):
+        self.database.close()
+        self.cloud.stop()
+        shutil.rmtree(self.tmp)
+
+    def _storage(self) -> GDriveStorage:
+        return GDriveStorage('token', self.database)
+
+    def _folder_paths(self):
+        rows = self.database.connection.execute('SELECT path FROM folder_ids ORDER BY path')
+        return [path for path, in rows]
+
+    def test_only_folder_ids_are_kept(self):
+        self._storage().save_stream_to_path([b'content'], 'savezone/a/file.bin', True)
+        self.assertEqual(['', 'savezone', 'savezone/a'], self._folder_paths())
+
+        storage = self._storage()
+        with storage.stream_resource('savezone/a/file.bin') as f:
+            self.assertEqual(b'content', f.read())
+        self.assertEqual(['file.bin'], [r.name for r in storage.list_resources_on_path('savezone/a')])
+        self.assertEqual(['', 'savezone', 'savezone/a'], self._folder_paths())
+
+    def test_folder_ids_are_bounded(self):
+        storage = self._storage()
+        storage.paths.max_folders = 3
+        storage.save_stream_to_path([b'content'], 'a/b/c/d/file.bin', True)
+        self.assertEqual(['a/b', 'a/b/c', 'a/b/c/d'], self._folder_paths())
+        # The dropped folders are found again
+        with storage.stream_resource('a/b/c/d/file.bin') as f:
+            self.assertEqual(b'content', f.read())
+
+    def test_stale_file_id_is_looked_up_again(self):
+        storage = self._storage()
+        storage.save_stream_to_path([b'old'], 'savezone/file.bin', True)
+        storage.list_resources_on_path('savezone')
+        # Another process replaces the file, the remembered ID is stale now
+        other = self._storage()
+        other.delete_resource('savezone/file.bin')
+        other.save_stream_to_path([b'new'], 'savezone/file.bin', True)
+
+        with storage.stream_resource('savezone/file.bin') as f:
+            self.assertEqual(b'new', f.read())
+        storage.delete_resource('savezone/file.bin')
+        self.assertEqual([], list(self._storage().iter_resources_on_path('savezone')))
+
+    def test_async_storage_resolves_the_same_folders(self):
+        path = os.path.join(self.tmp, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(b'content')
+
+        async def _save_and_list():
+            async with AsyncGDriveStorage('token', self.database) as storage:
+                await storage.save_resource_to_path(Resource(True, path), 'savezone/a/file.bin', True)
+                return [r.name async for r in storage.iter_resources_on_path('savezone/a')]
+
+        self.assertEqual(['file.bin'], asyncio.run(_save_and_list()))
+        self.assertEqual(['', 'savezone', 'savezone/a'], self._folder_paths())
+        with self._storage().stream_resource('savezone/a/file.bin') as f:
+            self.assertEqual(b'content', f.read())
+
+
+    def _listed_pages(self, storage: GDriveStorage, remote_path: str, page_size: int,
+                      count: int or None = None) -> tuple:
+        """
+        :return: names of the first count items of the listing, all of them if count is None,
+                 and the page tokens of the pages that were fetched for them, None for the first page
+        """
+        with mock.patch.object(storage.http, 'request', wraps=storage.http.request) as request:
+            names = [r.name for r in itertools.islice(storage.iter_resources_on_path(remote_path, page_size), count)]
+        pages = [call.kwargs['params'].get('pageToken') for call in request.call_args_list
+                 if 'pageSize' in call.kwargs.get('params', {})]
+        return names, pages
+
+    def test_listing_spans_pages(self):
+        storage = self._storage()
+        names = [f'{i:02}.bin' for i in range(12)]
+        for name in names:
+            storage.save_stream_to_path([b'content'], f'savezone/{name}', True)
+
+        listed, pages = self._listed_pages(storage, 'savezone', 5)
+        self.assertEqual(names, listed)
+        self.assertEqual(3, len(pages))
+        self.assertIsNone(pages[0])
+        # Only the first page can be fetched with no token
+        self.assertTrue(all(pages[1:]))
+        # The listing doesn't depend on the page size
+        self.assertEqual(names, self._listed_pages(storage, 'savezone', 4)[0])
+
+    def test_listing_fetches_only_the_pages_that_are_read(self):
+        storage = self._storage()
+        for i in range(12):
+            storage.save_stream_to_path([b'content'], f'savezone/{i:02}.bin', True)
+        self.assertEqual(1, len(self._listed_pages(storage, 'savezone', 5, 3)[1]))
+        self.assertEqual(2, len(self._listed_pages(storage, 'savezone', 5, 6)[1]))
+
+    def test_async_listing_spans_pages(self):
+        storage = self._storage()
+        names = [f'{i:02}.bin' for i in range(12)]
+        for name in names:
+            storage.save_stream_to_path([b'content'], f'savezone/{name}', True)
+
+        async def _list():
+            async with AsyncGDriveStorage('token', self.database) as async_storage:
+                with mock.patch.object(async_storage.http, 'request', wraps=async_storage.http.request) as request:
+                    listed = [r.name async for r in async_storage.iter_resources_on_path('savezone', 5)]
+                return listed, [call for call in request.call_args_list
+                                if 'pageSize' in call.kwargs.get('params', {})]
+
+        listed, pages = asyncio.run(_list())
+        self.assertEqual(names, listed)
+        self.assertEqual(3, len(pages))
+
+    def _local_file(self, size: int) -> Resource:
+        path = os.path.join(self.tmp, 'archive.zip')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        return Resource(True, path)
+
+    def _remote_content(self, remote_path: str) -> bytes:
+        with self._storage().stream_resource(remote_path) as f:
+            return f.read()
+
+    def _local_content(self, resource: Resource) -> bytes:
+        with open(resource.path, 'rb') as f:
+            return f.read()
+
+    @mock.patch.object(gdrive, 'UPLOAD_CHUNK_SIZE', 256 * 1024)
+    def test_interrupted_upload_is_resumed_from_the_confirmed_offset(self):
+        resource = self._local_file(1024 * 1024)
+        storage = self._storage()
+        _interrupt_upload_at(storage, 3)
+        with self.assertRaises(requests.ConnectionError):
+            storage.save_resource_to_path(resource, 'savezone/a/01012024120000.zip', True)
+        self.assertEqual('savezone/a/01012024120000.zip', storage.has_pending_upload(resource))
+        self.assertEqual(512 * 1024, storage.upload_sessions.get(resource.path)['offset'])
+
+        # The next run continues the upload to where the interrupted one was sending it
+        storage = self._storage()
+        sent = _interrupt_upload_at(storage, 0)
+        saved = storage.save_resource_to_path(resource, 'savezone/a/02012024120000.zip', True)
+        self.assertEqual('savezone/a/01012024120000.zip', saved.path)
+        self.assertEqual(f'bytes {512 * 1024}-{768 * 1024 - 1}/{1024 * 1024}', sent[0])
+        self.assertEqual(2, len(sent))
+        self.assertEqual(self._local_content(resource), self._remote_content('savezone/a/01012024120000.zip'))
+        self.assertEqual(['01012024120000.zip'], [r.name for r in storage.list_resources_on_path('savezone/a')])
+
+    @mock.patch.object(gdrive, 'UPLOAD_CHUNK_SIZE', 256 * 1024)
+    def test_expired_upload_session_is_started_over(self):
+        resource = self._local_file(1024 * 1024)
+        storage = self._storage()
+        _interrupt_upload_at(storage, 2)
+        with self.assertRaises(requests.ConnectionError):
+            storage.save_resource_to_path(resource, 'savezone/a/01012024120000.zip', True)
+        # Google forgets the session after a week
+        self.cloud.gdrive.uploads.clear()
+
+        storage = self._storage()
+        sent = _interrupt_upload_at(storage, 0)
+        storage.save_resource_to_path(resource, 'savezone/a/01012024120000.zip', True)
+        self.assertEqual(f'bytes 0-{256 * 1024 - 1}/{1024 * 1024}', sent[0])
+        self.assertEqual(4, len(sent))
+        self.assertEqual(self._local_content(resource), self._remote_content('savezone/a/01012024120000.zip'))
+
+    def test_upload_session_is_removed_after_the_upload(self):
+        resource = self._local_file(1000)
+        storage = self._storage()
+        storage.save_resource_to_path(resource, 'savezone/a/01012024120000.zip', True)
+        self.assertIsNone(storage.has_pending_upload(resource))
+        self.assertIsNone(self._storage().upload_sessions.get(resource.path))
+        self.assertEqual({}, self.cloud.gdrive.uploads)
+
+
+if __name__ == '__main__':
+    unittest.main()
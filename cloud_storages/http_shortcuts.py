@@ -1,22 +1,125 @@
 # Shortcuts for http requests
+import time
+from threading import Lock
+
 import requests
+from requests.adapters import HTTPAdapter
+
+POOL_SIZE = 10
+TIMEOUT = (10, 60)
+RETRIES = 3
+BACKOFF = 0.5
+# Only these requests are safe to send again if it is not known whether the server has processed them
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
 
 
-def _get_token_header(t: str) -> dict:
+def get_token_header(t: str) -> dict:
     return {'Authorization': 'OAuth ' + t}
 
 
-def get_with_OAuth(addr: str, params: dict = {}, token: str = '', **kwargs):
-    return requests.get(addr, params=params, headers=_get_token_header(token), **kwargs)
+def _get_headers(token: str, headers: dict or None) -> dict:
+    return {**get_token_header(token), **(headers or {})}
+
+
+def _can_replay(data) -> bool:
+    """
+    Tells whether the body can be sent again. Streams can't be, files can be if they are seekable
+    """
+    if data is None or isinstance(data, (bytes, bytearray, str, dict, list, tuple)):
+        return True
+    return callable(getattr(data, 'seek', None)) and callable(getattr(data, 'tell', None))
+
+
+class HttpSession:
+    """
+    A pool of keep-alive connections shared by all the requests of a storage
+    Idempotent requests that failed with a 5xx response or a connection error are retried with exponential backoff
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE, timeout: float or tuple = TIMEOUT, retries: int = RETRIES,
+                 backoff: float = BACKOFF, keep_alive: bool = True):
+        """
+        :param pool_size: how many connections to keep open per host
+        :param timeout: a timeout of a request in seconds, or a (connect, read) tuple
+        :param retries: how many times to retry a failed request
+        :param backoff: a delay before the first retry, it doubles with every next retry
+        :param keep_alive: whether to keep connections open between requests
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        self._lock = Lock()
+        self.requests_count = 0
+        self.retries_count = 0
+
+    @property
+    def reused_connections_count(self) -> int:
+        """
+        How many requests were sent over a connection that was already open
+        """
+        reused = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                reused += max(0, pool.num_requests - pool.num_connections)
+        return reused
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests_count,
+            'reused_connections': self.reused_connections_count,
+            'retries': self.retries_count,
+        }
+
+    def request(self, method: str, addr: str, token: str or None = None, headers: dict or None = None, **kwargs):
+        """
+        Sends the request, adding the OAuth header if the token is given
+        """
+        if token is not None:
+            headers = _get_headers(token, headers)
+        kwargs.setdefault('timeout', self.timeout)
+
+        data = kwargs.get('data')
+        retries = self.retries if method in IDEMPOTENT_METHODS and _can_replay(data) else 0
+        position = data.tell() if retries and hasattr(data, 'tell') else None
+
+        attempt = 0
+        while True:
+            with self._lock:
+                self.requests_count += 1
+            try:
+                response = self.session.request(method, addr, headers=headers, **kwargs)
+                if response.status_code < 500 or attempt >= retries:
+                    return response
+                response.close()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= retries:
+                    raise
 
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+            with self._lock:
+                self.retries_count += 1
+            if position is not None:
+                data.seek(position)
 
-def post_with_OAuth(addr: str, data: dict = {}, token: str = '', **kwargs):
-    return requests.post(addr, data=data, headers=_get_token_header(token), **kwargs)
+    def get_with_OAuth(self, addr: str, params: dict = {}, token: str = '', **kwargs):
+        return self.request('GET', addr, params=params, token=token, **kwargs)
 
+    def post_with_OAuth(self, addr: str, data: dict = {}, token: str = '', **kwargs):
+        return self.request('POST', addr, data=data, token=token, **kwargs)
 
-def put_with_OAuth(addr: str, token: str = '', **kwargs):
-    return requests.put(addr, headers=_get_token_header(token), **kwargs)
+    def put_with_OAuth(self, addr: str, token: str = '', **kwargs):
+        return self.request('PUT', addr, token=token, **kwargs)
 
+    def patch_with_OAuth(self, addr: str, token: str = '', **kwargs):
+        return self.request('PATCH', addr, token=token, **kwargs)
 
-def patch_with_OAuth(addr: str, token: str = '', **kwargs):
-    return requests.patch(addr, headers=_get_token_header(token), **kwargs)
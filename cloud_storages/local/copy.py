@@ -0,0 +1,172 @@
+# Zero-copy file transfers
+# Files are copied by the kernel with copy_file_range, which also lets a filesystem share the blocks (reflinks)
+# or an NFS server copy them on its side, or with sendfile where copy_file_range is not available.
+# The bytes never pass through Python. Files are written to a temporary file next to the target
+# and renamed over it, so the target is either the old file or the whole new one.
+# A file that must not be overwritten is hard linked to the target instead, which fails if the target exists
+import errno
+import os
+import shutil
+import uuid
+
+from typing import Iterable
+
+TEMP_SUFFIX = '.savezone-tmp'
+# copy_file_range and sendfile move at most this many bytes per call
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+# Where the kernel can't copy, the file is read by blocks of this size
+READ_BLOCK_SIZE = 1024 * 1024
+# Errors that mean the call is not supported for these files, not that the copy failed
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF,
+                errno.ENOTSOCK}
+# Errors of link on a filesystem that can't make hard links, e.g. FAT or some network shares
+_NO_LINKS = {errno.EPERM, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EMLINK}
+
+
+def _copy_with(function, source_fd: int, target_fd: int, size: int) -> int:
+    """
+    Copies with copy_file_range or sendfile until size bytes are copied or the source ends
+    :return: how many bytes were copied
+    """
+    copied = 0
+    while copied < size:
+        count = function(source_fd, target_fd, min(COPY_CHUNK_SIZE, size - copied))
+        if count == 0:
+            break
+        copied += count
+    return copied
+
+
+def copy_fd(source_fd: int, target_fd: int) -> str:
+    """
+    Copies the source file to the empty target file, both descriptors are at their start
+    :return: the way it was copied: copy_file_range, sendfile or read
+    """
+    size = os.fstat(source_fd).st_size
+    ways = []
+    if hasattr(os, 'copy_file_range'):
+        ways.append(('copy_file_range', lambda src, dst, count: os.copy_file_range(src, dst, count)))
+    if hasattr(os, 'sendfile'):
+        ways.append(('sendfile', lambda src, dst, count: os.sendfile(dst, src, None, count)))
+
+    for name, function in ways:
+        try:
+            copied = _copy_with(function, source_fd, target_fd, size)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            # The next way starts over
+            os.lseek(source_fd, 0, os.SEEK_SET)
+            os.lseek(target_fd, 0, os.SEEK_SET)
+            os.ftruncate(target_fd, 0)
+            continue
+        if copied == size:
+            return name
+        # The source has grown since its size was taken, the rest is copied the usual way
+        break
+
+    while True:
+        block = os.read(source_fd, READ_BLOCK_SIZE)
+        if not block:
+            return 'read'
+        view = memoryview(block)
+        while view:
+            view = view[os.write(target_fd, view):]
+
+
+def _temp_path(path: str) -> str:
+    return f'{path}.{uuid.uuid4().hex}{TEMP_SUFFIX}'
+
+
+def _sync_directory(path: str) -> None:
+    # The rename is durable only when the directory is flushed too. Not every system can open a directory
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _commit(temp_path: str, path: str, overwrite: bool) -> None:
+    """
+    Puts the temporary file on path. Without overwrite the file appears only if there is nothing on path,
+    checked in the same call that makes it, so a file that another writer has just made there is kept
+    :raises: FileExistsError if the target exists and overwrite is False, the temporary file is left to the caller
+    """
+    if overwrite:
+        os.replace(temp_path, path)
+    else:
+        try:
+            # Unlike rename, link fails if the target exists
+            os.link(temp_path, path)
+        except FileExistsError:
+            raise FileExistsError(f'{path} already exists')
+        except OSError as e:
+            if e.errno not in _NO_LINKS:
+                raise
+            # The filesystem has no hard links: the name is taken by an empty file first, then replaced
+            try:
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            except FileExistsError:
+                raise FileExistsError(f'{path} already exists')
+            os.replace(temp_path, path)
+        else:
+            os.unlink(temp_path)
+    _sync_directory(os.path.dirname(path) or '.')
+
+
+def copy_file_atomic(source_path: str, path: str, overwrite: bool = True) -> str:
+    """
+    Copies the file to path without reading it into Python, the target appears at once and complete
+    :raises: FileExistsError if the target exists and overwrite is False
+    :return: the way the data was copied, see copy_fd
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = _temp_path(path)
+    try:
+        source_fd = os.open(source_path, os.O_RDONLY)
+        try:
+            target_fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            try:
+                way = copy_fd(source_fd, target_fd)
+                os.fsync(target_fd)
+            finally:
+                os.close(target_fd)
+        finally:
+            os.close(source_fd)
+        shutil.copystat(source_path, temp_path)
+        _commit(temp_path, path, overwrite)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return way
+
+
+def write_stream_atomic(stream: Iterable[bytes], path: str, overwrite: bool = True) -> int:
+    """
+    Writes the chunks to path, the target appears at once and complete
+    :raises: FileExistsError if the target exists and overwrite is False
+    :return: how many bytes were written
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = _temp_path(path)
+    written = 0
+    try:
+        with open(temp_path, 'wb') as target:
+            for chunk in stream:
+                target.write(chunk)
+                written += len(chunk)
+            target.flush()
+            os.fsync(target.fileno())
+        _commit(temp_path, path, overwrite)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return written
@@ -0,0 +1,161 @@
+import io
+import os
+import shutil
+
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+
+from cloud_storages.local.copy import TEMP_SUFFIX, copy_file_atomic, write_stream_atomic
+from cloud_storages.storage import Storage, LIST_PAGE_SIZE
+from database.database import Database
+from models.models import StorageMetaInfo, Resource, Size
+
+LOCAL_DB_KEY = 'local'
+
+
+class _BoundedReader(io.RawIOBase):
+    """Reads a file from start up to end"""
+
+    def __init__(self, f: BinaryIO, start: int, end: int or None):
+        self._file = f
+        self._file.seek(start)
+        self._left = None if end is None else max(end - start, 0)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer)
+        if self._left is not None:
+            view = view[:self._left]
+        count = self._file.readinto(view)
+        if self._left is not None:
+            self._left -= count
+        return count
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+class LocalStorage(Storage):
+    """
+    A storage in a local directory, e.g. a NAS mount. The token is the path to the directory
+    Files are copied by the kernel and every file is written to a temporary file that is renamed over the target
+    """
+
+    def __init__(self, token: str):
+        self.token = token
+        self.root = os.path.abspath(token)
+        if not os.path.isdir(self.root):
+            raise ValueError(f'{self.root} is not a directory. Please run: python main.py auth -s local')
+
+    @classmethod
+    def auth(cls, db: Database):
+        directory = os.path.abspath(os.path.expanduser(input('A directory to keep the backups in: ').strip()))
+        if not os.path.isdir(directory):
+            raise ValueError(f'{directory} is not a directory')
+        if not os.access(directory, os.W_OK):
+            raise ValueError(f'{directory} is not writable')
+        db.set(LOCAL_DB_KEY, directory)
+
+    def _local_path(self, remote_path: str) -> str:
+        """
+        :raises: ValueError if the remote path points outside of the storage directory
+        """
+        parts = [part for part in remote_path.replace('\\', '/').split('/') if part not in ('', '.')]
+        if '..' in parts:
+            raise ValueError(f'{remote_path} points outside of the storage')
+        return os.path.join(self.root, *parts)
+
+    @classmethod
+    def _deserialize_resource(cls, entry: os.DirEntry, remote_path: str) -> Resource:
+        stat = entry.stat()
+        is_file = entry.is_file()
+        res = Resource(is_file, '/'.join([remote_path.strip('/'), entry.name]).lstrip('/'))
+        res.size = Size(stat.st_size, 'b') if is_file else None
+        res.updated = datetime.fromtimestamp(stat.st_mtime).isoformat()
+        return res
+
+    def list_resources_on_path(self, remote_path: str) -> List[Resource]:
+        # A directory listing costs less than a lookup in the cache
+        return list(self.iter_resources_on_path(remote_path))
+
+    def iter_resources_on_path(self, remote_path: str, page_size: int = LIST_PAGE_SIZE) -> Iterator[Resource]:
+        """
+        Yields all items in directory
+        :param remote_path: a path relative to the storage directory
+        :param page_size: not used, the directory is read at once
+        :raises: FileNotFoundError if the directory doesn't exist
+        """
+        try:
+            with os.scandir(self._local_path(remote_path)) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(TEMP_SUFFIX):
+                        yield self._deserialize_resource(entry, remote_path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f'Directory not found: {remote_path}')
+
+    def get_meta_info(self) -> StorageMetaInfo:
+        """
+        Gets meta info of the filesystem that has the storage directory
+        """
+        usage = shutil.disk_usage(self.root)
+        return StorageMetaInfo(usage.used, usage.total)
+
+    def _saved(self, remote_path: str) -> Resource:
+        self._on_resource_saved(remote_path)
+        path = self._local_path(remote_path)
+        res = Resource(True, remote_path, os.path.getsize(path))
+        res.updated = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+        return res
+
+    def save_resource_to_path(self, resource: Resource, remote_path: str, overwrite: bool) -> Resource or None:
+        """
+        Copies the local file to the storage without reading it into Python
+        :raises: ValueError if the remote file exists and overwrite is False
+        """
+        try:
+            way = copy_file_atomic(resource.path, self._local_path(remote_path), overwrite)
+        except FileExistsError as e:
+            raise ValueError(f'Something went wrong with the local storage: {e}')
+        print(f'[{__name__}] Copied {resource.path} with {way}')
+        return self._saved(remote_path)
+
+    def save_stream_to_path(self, stream: Iterable[bytes], remote_path: str, overwrite: bool) -> Resource or None:
+        """
+        Writes the stream of chunks to the storage
+        :raises: ValueError if the remote file exists and overwrite is False
+        """
+        try:
+            write_stream_atomic(stream, self._local_path(remote_path), overwrite)
+        except FileExistsError as e:
+            raise ValueError(f'Something went wrong with the local storage: {e}')
+        return self._saved(remote_path)
+
+    def download_resource(self, remote_path: str, local_path, segments: int = 1) -> str:
+        """
+        Copies the file from the storage to local_path, segments are not needed for a local copy
+        """
+        copy_file_atomic(self._local_path(remote_path), local_path)
+        return local_path
+
+    def get_download_link(self, remote_path: str) -> Tuple[str, dict]:
+        return Path(self._local_path(remote_path)).as_uri(), {}
+
+    def open_resource(self, remote_path: str) -> BinaryIO:
+        return open(self._local_path(remote_path), 'rb')
+
+    def stream_resource(self, remote_path: str, start: int = 0, end: int or None = None) -> BinaryIO:
+        return io.BufferedReader(_BoundedReader(self.open_resource(remote_path), start, end))
+
+    def delete_resource(self, remote_path: str) -> None:
+        path = self._local_path(remote_path)
+        if path == self.root:
+            raise ValueError('The storage directory itself can\'t be deleted')
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.unlink(path)
+        self._on_resource_deleted(remote_path)
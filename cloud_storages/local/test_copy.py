@@ -0,0 +1,89 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from cloud_storages.local.copy import TEMP_SUFFIX, copy_fd, copy_file_atomic, write_stream_atomic
+
+
+class CopyTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, 'source.bin')
+        self.content = os.urandom(300000)
+        with open(self.source, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _read(self, path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_copy_fd(self):
+        target_path = os.path.join(self.tmp, 'target.bin')
+        source_fd = os.open(self.source, os.O_RDONLY)
+        target_fd = os.open(target_path, os.O_WRONLY | os.O_CREAT)
+        try:
+            way = copy_fd(source_fd, target_fd)
+        finally:
+            os.close(source_fd)
+            os.close(target_fd)
+        self.assertIn(way, ('copy_file_range', 'sendfile', 'read'))
+        self.assertEqual(self.content, self._read(target_path))
+
+    def test_atomic_copy(self):
+        target_path = os.path.join(self.tmp, 'a', 'b', 'target.bin')
+        copy_file_atomic(self.source, target_path)
+        self.assertEqual(self.content, self._read(target_path))
+
+        with self.assertRaises(FileExistsError):
+            write_stream_atomic([b'new'], target_path, overwrite=False)
+        self.assertEqual(self.content, self._read(target_path))
+        self.assertEqual(['target.bin'], os.listdir(os.path.dirname(target_path)))
+
+    def test_file_made_by_another_writer_is_kept(self):
+        target_path = os.path.join(self.tmp, 'target.bin')
+
+        def _stream():
+            yield b'new'
+            # Another writer makes the file while this one is being written
+            with open(target_path, 'wb') as f:
+                f.write(b'other')
+
+        with self.assertRaises(FileExistsError):
+            write_stream_atomic(_stream(), target_path, overwrite=False)
+        self.assertEqual(b'other', self._read(target_path))
+        self.assertEqual(['source.bin', 'target.bin'], sorted(os.listdir(self.tmp)))
+
+        write_stream_atomic(_stream(), os.path.join(self.tmp, 'new.bin'), overwrite=False)
+        self.assertEqual(b'new', self._read(os.path.join(self.tmp, 'new.bin')))
+
+    def test_filesystem_without_hard_links(self):
+        target_path = os.path.join(self.tmp, 'target.bin')
+        with mock.patch.object(os, 'link', side_effect=OSError(errno.EPERM, 'Operation not permitted')):
+            copy_file_atomic(self.source, target_path, overwrite=False)
+            self.assertEqual(self.content, self._read(target_path))
+            with self.assertRaises(FileExistsError):
+                write_stream_atomic([b'new'], target_path, overwrite=False)
+        self.assertEqual(self.content, self._read(target_path))
+        self.assertEqual(['source.bin', 'target.bin'], sorted(os.listdir(self.tmp)))
+
+    def test_failed_stream_leaves_nothing(self):
+        def _stream():
+            yield b'part'
+            raise ValueError('broken')
+
+        target_path = os.path.join(self.tmp, 'target.bin')
+        with self.assertRaises(ValueError):
+            write_stream_atomic(_stream(), target_path)
+        self.assertFalse([name for name in os.listdir(self.tmp) if name.endswith(TEMP_SUFFIX)])
+        self.assertFalse(os.path.exists(target_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cloud_storages.local.copy import TEMP_SUFFIX
+from cloud_storages.local.local import LocalStorage
+from models.models import Resource
+
+
+class LocalStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, 'storage')
+        os.makedirs(self.root)
+        self.storage = LocalStorage(self.root)
+        self.source = os.path.join(self.tmp, 'source.bin')
+        self.content = os.urandom(100000)
+        with open(self.source, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _read(self, remote_path: str) -> bytes:
+        with self.storage.stream_resource(remote_path) as f:
+            return f.read()
+
+    def test_missing_directory_is_refused(self):
+        with self.assertRaises(ValueError):
+            LocalStorage(os.path.join(self.tmp, 'missing'))
+
+    def test_saved_resources_are_listed(self):
+        saved = self.storage.save_resource_to_path(Resource(True, self.source), 'savezone/a/file.bin', False)
+        self.assertEqual(('savezone/a/file.bin', len(self.content)), (saved.path, saved.size.size))
+        saved = self.storage.save_stream_to_path([b'ab', b'c'], 'savezone/a/stream.bin', False)
+        self.assertEqual(3, saved.size.size)
+        # A file that is being written is not listed
+        open(os.path.join(self.root, 'savezone', 'a', 'partial' + TEMP_SUFFIX), 'wb').close()
+
+        listed = sorted(self.storage.list_resources_on_path('savezone/a'), key=lambda r: r.path)
+        self.assertEqual([('savezone/a/file.bin', True, len(self.content)), ('savezone/a/stream.bin', True, 3)],
+                         [(r.path, r.is_file, r.size.size) for r in listed])
+        self.assertEqual([('savezone/a', False)],
+                         [(r.path, r.is_file) for r in self.storage.list_resources_on_path('savezone')])
+        self.assertEqual(self.content, self._read('savezone/a/file.bin'))
+        with self.storage.stream_resource('savezone/a/file.bin', 10, 20) as f:
+            self.assertEqual(self.content[10:20], f.read())
+
+        with self.assertRaises(FileNotFoundError):
+            self.storage.list_resources_on_path('savezone/missing')
+
+    def test_existing_resource_is_overwritten_only_when_asked(self):
+        self.storage.save_stream_to_path([b'old'], 'savezone/file.bin', False)
+        with self.assertRaises(ValueError):
+            self.storage.save_resource_to_path(Resource(True, self.source), 'savezone/file.bin', False)
+        with self.assertRaises(ValueError):
+            self.storage.save_stream_to_path([b'new'], 'savezone/file.bin', False)
+        self.assertEqual(b'old', self._read('savezone/file.bin'))
+
+        self.storage.save_resource_to_path(Resource(True, self.source), 'savezone/file.bin', True)
+        self.assertEqual(self.content, self._read('savezone/file.bin'))
+        self.assertEqual(['file.bin'], os.listdir(os.path.join(self.root, 'savezone')))
+
+    def test_resources_are_deleted(self):
+        self.storage.save_stream_to_path([b'a'], 'savezone/a/1.bin', False)
+        self.storage.save_stream_to_path([b'b'], 'savezone/a/2.bin', False)
+        self.storage.save_stream_to_path([b'c'], 'savezone/b/1.bin', False)
+
+        self.assertEqual({}, self.storage.delete_resources(['savezone/a/1.bin', 'savezone/b']))
+        self.assertEqual(['savezone/a'], [r.path for r in self.storage.list_resources_on_path('savezone')])
+        self.assertEqual(['savezone/a/2.bin'], [r.path for r in self.storage.list_resources_on_path('savezone/a')])
+        # Deleting what is gone is fine
+        self.storage.delete_resource('savezone/a/1.bin')
+        with self.assertRaises(ValueError):
+            self.storage.delete_resource('/')
+
+    def test_paths_stay_inside_the_storage(self):
+        with self.assertRaises(ValueError):
+            self.storage.save_stream_to_path([b'x'], '../outside.bin', True)
+        with self.assertRaises(ValueError):
+            self.storage.delete_resource('savezone/../../source.bin')
+        self.assertTrue(os.path.exists(self.source))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'outside.bin')))
+
+    def test_resource_is_downloaded(self):
+        self.storage.save_resource_to_path(Resource(True, self.source), 'savezone/file.bin', False)
+        local_path = os.path.join(self.tmp, 'restored', 'file.bin')
+        self.assertEqual(local_path, self.storage.download_resource('savezone/file.bin', local_path))
+        with open(local_path, 'rb') as f:
+            self.assertEqual(self.content, f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import datetime
+import json
+import time
+
+from threading import Lock
+from typing import List
+
+from database.catalog import normalize_remote_path
+from database.database import Database
+from models.models import Resource, Size
+
+CACHE_TTL = 10 * 60
+CACHE_MAX_ENTRIES = 5000
+
+
+def _serialize_resource(resource: Resource) -> dict:
+    updated = resource.updated
+    if isinstance(updated, datetime.datetime):
+        updated = updated.isoformat()
+    return {
+        'is_file': resource.is_file,
+        'path': resource.path,
+        'size': resource.size.size if resource.size is not None else None,
+        'name': resource.name,
+        'url': resource.url,
+        'updated': updated,
+        'md5': resource.md5,
+    }
+
+
+def _deserialize_resource(data: dict) -> Resource:
+    res = Resource(data['is_file'], data['path'], name=data['name'], url=data['url'], update_time=data['updated'])
+    res.size = Size(data['size'], 'b') if data['size'] is not None else None
+    res.md5 = data['md5']
+    return res
+
+
+class MetadataCache:
+    """
+    Keeps the listings of remote directories in the listings table of the local database,
+    a row for every directory of every storage with the time it was listed at
+    A listing is used until it is older than ttl seconds or until something is saved under its directory.
+    When there are more than max_entries listings, the oldest ones are evicted
+    New listings are written to the database by flush(), so listing many directories costs one transaction.
+    Invalidation deletes only the rows of the parent directories, so processes that run at once don't lose
+    each other's listings
+    """
+
+    def __init__(self, database: Database, storage_key: str, ttl: float = CACHE_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        """
+        :param database: a local database
+        :param storage_key: a name of the storage, listings of different storages are kept apart
+        :param ttl: how long a listing stays valid, in seconds
+        :param max_entries: how many listings to keep
+        """
+        self.database = database
+        self.storage_key = storage_key
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = Lock()
+        # Listings that are not written yet: normalized path -> (time, serialized resources)
+        self._pending = {}
+        with database.transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS listings (storage TEXT NOT NULL, path TEXT NOT NULL, '
+                'time REAL NOT NULL, resources TEXT NOT NULL, PRIMARY KEY (storage, path)) WITHOUT ROWID'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS listings_time ON listings (storage, time)')
+            # Older versions kept the whole cache as one JSON value, it is only a cache, so it is dropped
+            database.delete(f'metadata:{storage_key}')
+
+    def flush(self) -> None:
+        """
+        Writes the new listings to the database and evicts the oldest ones
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with self.database.transaction() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO listings (storage, path, time, resources) VALUES (?, ?, ?, ?)',
+                ((self.storage_key, path, listed, resources) for path, (listed, resources) in pending.items())
+            )
+            connection.execute(
+                'DELETE FROM listings WHERE storage = ? AND path NOT IN '
+                '(SELECT path FROM listings WHERE storage = ? ORDER BY time DESC LIMIT ?)',
+                (self.storage_key, self.storage_key, self.max_entries)
+            )
+
+    def get(self, remote_path: str) -> List[Resource] or None:
+        """
+        Returns the cached listing of the directory, or None if there is no valid one
+        """
+        path = normalize_remote_path(remote_path)
+        with self._lock:
+            entry = self._pending.get(path)
+        if entry is None:
+            entry = self.database.connection.execute(
+                'SELECT time, resources FROM listings WHERE storage = ? AND path = ?', (self.storage_key, path)
+            ).fetchone()
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return None
+        return [_deserialize_resource(r) for r in json.loads(entry[1])]
+
+    def set(self, remote_path: str, resources: List[Resource]) -> None:
+        resources = json.dumps([_serialize_resource(r) for r in resources])
+        with self._lock:
+            self._pending[normalize_remote_path(remote_path)] = (time.time(), resources)
+
+    def invalidate(self, remote_path: str) -> None:
+        """
+        Drops the listings that a save to remote_path changes: the listings of all its parent directories
+        """
+        parts = normalize_remote_path(remote_path).split('/')
+        parents = ['/'.join(parts[:i]) for i in range(len(parts) + 1)]
+        with self._lock:
+            for path in parents:
+                self._pending.pop(path, None)
+        self.database.connection.execute(
+            f'DELETE FROM listings WHERE storage = ? AND path IN ({", ".join("?" * len(parents))})',
+            (self.storage_key, *parents)
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending = {}
+        self.database.connection.execute('DELETE FROM listings WHERE storage = ?', (self.storage_key,))
@@ -0,0 +1,114 @@
+# Random access to remote files over HTTP Range requests
+# Lets zipfile read the central directory and chosen members of a remote archive without downloading all of it
+import io
+
+from bisect import bisect_right
+from typing import BinaryIO, List
+
+from cloud_storages.downloads import get_remote_size
+from cloud_storages.http_shortcuts import HttpSession
+
+READ_BUFFER_SIZE = 256 * 1024
+
+
+class HttpRangeFile(io.RawIOBase):
+    """
+    A read-only seekable file over the url. Sequential reads are served by one streamed response,
+    a seek elsewhere starts a new Range request. A request ends at the next boundary after its start,
+    so when boundaries are the offsets of zip members, reading a member fetches only that member
+    """
+
+    def __init__(self, url: str, headers: dict or None = None, session: HttpSession or None = None):
+        """
+        :param url: url of the file, the server has to support Range requests
+        :param headers: additional headers, e.g. authorization
+        :param session: HttpSession to send the requests with
+        :raises: ValueError if the server doesn't support Range requests
+        """
+        super().__init__()
+        self.url = url
+        self.headers = headers or {}
+        self.session = session or HttpSession()
+        self.size = get_remote_size(self.session, url, self.headers)
+        if self.size is None:
+            raise ValueError(f"[{__name__}] The server doesn't support range requests")
+        self.position = 0
+        self.boundaries: List[int] = []
+        self.requests_count = 0
+        self._response = None
+        self._response_position = None
+
+    def set_boundaries(self, boundaries: List[int]) -> None:
+        """
+        Sets the offsets that a single request doesn't read past, e.g. the offsets of zip members
+        """
+        self.boundaries = sorted(set(boundaries))
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f'Negative seek position {offset}')
+        self.position = offset
+        return self.position
+
+    def _close_response(self) -> None:
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def _open_response(self) -> None:
+        self._close_response()
+        i = bisect_right(self.boundaries, self.position)
+        end = self.boundaries[i] if i < len(self.boundaries) else self.size
+        response = self.session.request('GET', self.url, headers={**self.headers,
+                                                                  'Range': f'bytes={self.position}-{end - 1}'},
+                                        stream=True)
+        self.requests_count += 1
+        if response.status_code != 206:
+            response.close()
+            raise ValueError(f"[{__name__}] Couldn't read bytes {self.position}-{end - 1}: "
+                             f"Response: {str(response.status_code)}")
+        # Download links are often redirects, the next requests go to where they lead
+        self.url = response.url
+        self._response = response
+        self._response_position = self.position
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.size or not len(buffer):
+            return 0
+        for attempt in range(2):
+            if self._response is None or self._response_position != self.position:
+                self._open_response()
+            data = self._response.raw.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                self.position += len(data)
+                self._response_position = self.position
+                return len(data)
+            # The response has reached its boundary
+            self._close_response()
+        raise ValueError(f"[{__name__}] Couldn't read bytes from {self.position}: the response is empty")
+
+    def close(self) -> None:
+        self._close_response()
+        super().close()
+
+
+def open_remote_file(url: str, headers: dict or None = None, session: HttpSession or None = None) -> BinaryIO:
+    """
+    Opens the remote file for reading, see HttpRangeFile
+    The result is buffered, its raw attribute is the HttpRangeFile
+    """
+    return io.BufferedReader(HttpRangeFile(url, headers, session), READ_BUFFER_SIZE)
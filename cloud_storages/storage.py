@@ -1,16 +1,63 @@
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, Iterable, Iterator, Tuple
 
+from cloud_storages.downloads import open_stream
+from cloud_storages.range_reader import open_remote_file
 from models.models import Resource, StorageMetaInfo
 
+LIST_PAGE_SIZE = 1000
+DELETE_WORKERS = 8
+
 
 class Storage:
     """A storage abstract class"""
 
+    # A MetadataCache for directory listings, no caching if not set
+    metadata_cache = None
+    # An HttpSession that the storage sends its requests with
+    http = None
+
     def list_resources_on_path(self, remote_path: str, ) -> List[Resource]:
         """
         List all items in directory
         :param dir: directory
         """
+        if self.metadata_cache is not None:
+            cached = self.metadata_cache.get(remote_path)
+            if cached is not None:
+                return cached
+        result = list(self.iter_resources_on_path(remote_path))
+        if self.metadata_cache is not None:
+            self.metadata_cache.set(remote_path, result)
+        return result
+
+    def flush(self) -> None:
+        """
+        Writes the local state kept by the storage (e.g. cached listings) to the local database
+        """
+        if self.metadata_cache is not None:
+            self.metadata_cache.flush()
+
+    def _on_resource_saved(self, remote_path: str) -> None:
+        """
+        Should be called by the storage after a resource is saved, so cached listings of its directories are dropped
+        """
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(remote_path)
+
+    def _on_resource_deleted(self, remote_path: str) -> None:
+        """
+        Should be called by the storage after a resource is deleted, drops the cached listings the same way
+        """
+        self._on_resource_saved(remote_path)
+
+    def iter_resources_on_path(self, remote_path: str, page_size: int = LIST_PAGE_SIZE) -> Iterator[Resource]:
+        """
+        Yields all items in directory, fetching them page by page
+        :param remote_path: directory
+        :param page_size: how many items to fetch with one request
+        :raises: FileNotFoundError if the directory doesn't exist, ValueError if the storage failed
+        """
         pass
 
     def get_meta_info(self) -> StorageMetaInfo:
@@ -25,8 +72,69 @@ class Storage:
         """
         pass
 
-    def download_resource(self, remote_path: str, local_path) -> str:
+    def save_stream_to_path(self, stream: Iterable[bytes], remote_path: str, overwrite: bool) -> Resource or None:
+        """
+        Put a resource to the directory, reading its content from the stream of chunks
+        """
+        pass
+
+    def has_pending_upload(self, resource: Resource) -> str or None:
+        """
+        Tells whether an upload of the local resource was interrupted and can be continued
+        :return: the remote path the interrupted upload was sending the resource to, None if there is no such upload
+        """
+        return None
+
+    def download_resource(self, remote_path: str, local_path, segments: int = 1) -> str:
         """
         Download a resource from path to folder to local_path and return path to the download
+        The resource is written to the disk block by block, an interrupted download is continued on the next call
+        :param segments: how many parts of the resource to download in parallel
+        """
+        pass
+
+    def get_download_link(self, remote_path: str) -> Tuple[str, dict]:
+        """
+        Returns the url of the content of the resource and the headers to request it with
+        """
+        pass
+
+    def open_resource(self, remote_path: str) -> BinaryIO:
+        """
+        Opens the resource for reading without downloading it, every read fetches only the bytes it needs
+        """
+        url, headers = self.get_download_link(remote_path)
+        return open_remote_file(url, headers, self.http)
+
+    def stream_resource(self, remote_path: str, start: int = 0, end: int or None = None) -> BinaryIO:
+        """
+        Opens the content of the resource as a stream that is read while it is being downloaded
+        :param start: the first byte to read
+        :param end: the byte to stop before, the end of the resource if not given
+        """
+        url, headers = self.get_download_link(remote_path)
+        return open_stream(url, headers, self.http, start, end)
+
+    def delete_resource(self, remote_path: str) -> None:
+        """
+        Deletes the resource permanently, bypassing the trash
         """
         pass
+
+    def delete_resources(self, remote_paths: List[str], workers: int = DELETE_WORKERS) -> Dict[str, str]:
+        """
+        Deletes the resources concurrently
+        :param workers: how many resources to delete at once
+        :return: errors by the remote paths that couldn't be deleted
+        """
+        errors = {}
+
+        def _delete(remote_path: str) -> None:
+            try:
+                self.delete_resource(remote_path)
+            except (ValueError, OSError) as e:
+                errors[remote_path] = str(e)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_delete, remote_paths))
+        return errors
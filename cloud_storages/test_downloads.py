@@ -0,0 +1,224 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from benchmarks.fake_cloud import FakeCloud, NetworkProfile
+from cloud_storages import async_http, downloads
+from cloud_storages.downloads import PART_SUFFIX, RESUME_SUFFIX, SEGMENTS_SUFFIX, download_to_file
+from cloud_storages.http_shortcuts import HttpSession
+
+SIZE = 64 * 1024
+SEGMENT_SIZE = 16 * 1024
+
+
+class _FailingNetwork(NetworkProfile):
+    """Fails the next requests with 503 when failures is set"""
+
+    def __init__(self):
+        super().__init__()
+        self.failures = 0
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.failures -= 1
+            return self.failures >= 0
+
+
+class DownloadTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.network = _FailingNetwork()
+        self.cloud = FakeCloud(self.network).start()
+        self.addCleanup(self.cloud.stop)
+        self.content = os.urandom(SIZE)
+        with open(os.path.join(self.cloud.yadisk.root, 'file.bin'), 'wb') as f:
+            f.write(self.content)
+        self.url = f'{self.cloud.url}/_yadisk/download?path=file.bin'
+        self.local_path = os.path.join(self.tmp, 'file.bin')
+        self.part_path = self.local_path + PART_SUFFIX
+        self.http = HttpSession(retries=0)
+        self.request = mock.patch.object(self.http, 'request', wraps=self.http.request).start()
+        self.addCleanup(mock.patch.stopall)
+        patcher = mock.patch.object(downloads, 'MIN_SEGMENT_SIZE', SEGMENT_SIZE)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _read(self) -> bytes:
+        with open(self.local_path, 'rb') as f:
+            return f.read()
+
+    def _change_remote_file(self) -> None:
+        self.content = os.urandom(SIZE)
+        path = os.path.join(self.cloud.yadisk.root, 'file.bin')
+        with open(path, 'wb') as f:
+            f.write(self.content)
+        # The ETag of the fake cloud is made of the size and the time of the last change
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def _validator(self) -> str:
+        validator = downloads._probe(self.http, self.url, {})[1]
+        self.request.reset_mock()
+        return validator
+
+    def _ranges(self) -> list:
+        """The Range headers of the requests sent so far, None for a request of the whole file"""
+        ranges = [call.kwargs.get('headers', {}).get('Range') for call in self.request.call_args_list]
+        self.request.reset_mock()
+        return ranges
+
+    def test_file_is_downloaded(self):
+        download_to_file(self.url, self.local_path, session=self.http)
+        self.assertEqual(self.content, self._read())
+        self.assertFalse(os.path.exists(self.part_path))
+
+    def test_leftover_part_is_continued_with_a_range(self):
+        with open(self.part_path, 'wb') as f:
+            f.write(self.content[:1000])
+        download_to_file(self.url, self.local_path, session=self.http)
+        self.assertEqual(self.content, self._read())
+        self.assertEqual(['bytes=1000-'], self._ranges())
+
+    def test_complete_part_is_not_downloaded_again(self):
+        with open(self.part_path, 'wb') as f:
+            f.write(self.content)
+        download_to_file(self.url, self.local_path, session=self.http)
+        self.assertEqual(self.content, self._read())
+        # The server answers 416 to a range after the end of the file
+        self.assertEqual([f'bytes={SIZE}-'], self._ranges())
+
+    def test_segments_are_downloaded_in_parallel(self):
+        download_to_file(self.url, self.local_path, segments=4, block_size=1024, session=self.http)
+        self.assertEqual(self.content, self._read())
+        self.assertFalse(os.path.exists(self.part_path + SEGMENTS_SUFFIX))
+        # One byte is asked for to learn the size
+        self.assertEqual(['bytes=0-0'] + [f'bytes={start}-{start + SEGMENT_SIZE - 1}'
+                                          for start in range(0, SIZE, SEGMENT_SIZE)], sorted(self._ranges()))
+
+    def test_interrupted_segments_are_continued(self):
+        # The download of one segment fails, the others are kept in the state file
+        validator = self._validator()
+        self.network.failures = 1
+        with self.assertRaises(ValueError):
+            downloads._download_segmented(self.http, self.url, self.part_path, {}, 1024, SIZE, 4, validator)
+        with open(self.part_path + SEGMENTS_SUFFIX) as f:
+            plan = json.load(f)['segments']
+        self.assertEqual(4, len(plan))
+        unfinished = [(offset, end) for _, end, offset in plan if offset < end]
+        self.assertEqual(1, len(unfinished))
+
+        self._ranges()
+        download_to_file(self.url, self.local_path, segments=4, block_size=1024, session=self.http)
+        self.assertEqual(self.content, self._read())
+        self.assertEqual(['bytes=0-0'] + [f'bytes={offset}-{end - 1}' for offset, end in unfinished], self._ranges())
+        self.assertFalse(os.path.exists(self.part_path + SEGMENTS_SUFFIX))
+
+    def test_state_saved_halfway_through_the_segments_is_continued(self):
+        # As if the process was killed: the first segment is complete, the others are halfway through
+        plan = [[start, start + SEGMENT_SIZE, start + SEGMENT_SIZE // 2] for start in range(0, SIZE, SEGMENT_SIZE)]
+        plan[0][2] = SEGMENT_SIZE
+        part = bytearray(SIZE)
+        for start, _, offset in plan:
+            part[start:offset] = self.content[start:offset]
+        with open(self.part_path, 'wb') as f:
+            f.write(part)
+        with open(self.part_path + SEGMENTS_SUFFIX, 'w') as f:
+            json.dump({'size': SIZE, 'validator': self._validator(), 'segments': plan}, f)
+
+        download_to_file(self.url, self.local_path, segments=4, block_size=1024, session=self.http)
+        self.assertEqual(self.content, self._read())
+        self.assertEqual(['bytes=0-0'] + [f'bytes={start + SEGMENT_SIZE // 2}-{start + SEGMENT_SIZE - 1}'
+                                          for start in range(SEGMENT_SIZE, SIZE, SEGMENT_SIZE)], sorted(self._ranges()))
+
+    def test_sequential_download_drops_a_segmented_part(self):
+        with open(self.part_path, 'wb') as f:
+            f.write(bytes(SIZE))
+        with open(self.part_path + SEGMENTS_SUFFIX, 'w') as f:
+            json.dump([[0, SIZE, 1000]], f)
+        download_to_file(self.url, self.local_path, session=self.http)
+        self.assertEqual(self.content, self._read())
+        self.assertEqual([None], self._ranges())
+        self.assertFalse(os.path.exists(self.part_path + SEGMENTS_SUFFIX))
+
+    def test_changed_file_is_downloaded_again_instead_of_continued(self):
+        with open(self.part_path, 'wb') as f:
+            f.write(self.content[:1000])
+        with open(self.part_path + RESUME_SUFFIX, 'w') as f:
+            json.dump({'size': SIZE, 'validator': self._validator()}, f)
+        self._change_remote_file()
+
+        download_to_file(self.url, self.local_path, session=self.http)
+        self.assertEqual(self.content, self._read())
+        # The range is asked for if the file is the same, the server sends the whole new file instead
+        self.assertEqual(['bytes=1000-'], self._ranges())
+        self.assertFalse(os.path.exists(self.part_path + RESUME_SUFFIX))
+
+    def test_part_longer_than_the_file_is_started_over(self):
+        with open(self.part_path, 'wb') as f:
+            f.write(bytes(SIZE + 1000))
+        download_to_file(self.url, self.local_path, session=self.http)
+        self.assertEqual(self.content, self._read())
+        self.assertEqual([f'bytes={SIZE + 1000}-', None], self._ranges())
+
+    def test_part_of_a_file_of_another_size_is_started_over(self):
+        with open(self.part_path, 'wb') as f:
+            f.write(self.content[:1000])
+        with open(self.part_path + RESUME_SUFFIX, 'w') as f:
+            json.dump({'size': SIZE + 1, 'validator': None}, f)
+        download_to_file(self.url, self.local_path, session=self.http)
+        self.assertEqual(self.content, self._read())
+        self.assertEqual(['bytes=1000-', None], self._ranges())
+
+    def test_range_that_starts_elsewhere_is_not_appended(self):
+        with open(self.part_path, 'wb') as f:
+            f.write(b'x' * 50)
+        with self.assertRaises(FileNotFoundError):
+            downloads._resume_mode(self.part_path, 206, {'Content-Range': 'bytes 0-99/100'}, 50)
+        self.assertFalse(os.path.exists(self.part_path))
+        with self.assertRaises(ValueError):
+            downloads._resume_mode(self.part_path, 503, {}, 0)
+
+    def test_changed_file_drops_the_segments_plan(self):
+        validator = self._validator()
+        self.network.failures = 1
+        with self.assertRaises(ValueError):
+            downloads._download_segmented(self.http, self.url, self.part_path, {}, 1024, SIZE, 4, validator)
+        self._change_remote_file()
+
+        self._ranges()
+        download_to_file(self.url, self.local_path, segments=4, block_size=1024, session=self.http)
+        self.assertEqual(self.content, self._read())
+        self.assertEqual(['bytes=0-0'] + [f'bytes={start}-{start + SEGMENT_SIZE - 1}'
+                                          for start in range(0, SIZE, SEGMENT_SIZE)], sorted(self._ranges()))
+        self.assertFalse(os.path.exists(self.part_path + SEGMENTS_SUFFIX))
+
+    @unittest.skipUnless(async_http.aiohttp, 'aiohttp is not installed')
+    def test_async_download_of_a_changed_file_is_started_over(self):
+        with open(self.part_path, 'wb') as f:
+            f.write(self.content[:1000])
+        with open(self.part_path + RESUME_SUFFIX, 'w') as f:
+            json.dump({'size': SIZE, 'validator': self._validator()}, f)
+        self._change_remote_file()
+
+        async def _download():
+            session = async_http.AsyncHttpSession(retries=0)
+            try:
+                await async_http.download_to_file(session, self.url, self.local_path)
+            finally:
+                await session.close()
+
+        asyncio.run(_download())
+        self.assertEqual(self.content, self._read())
+        self.assertFalse(os.path.exists(self.part_path + RESUME_SUFFIX))
+
+
+if __name__ == '__main__':
+    unittest.main()
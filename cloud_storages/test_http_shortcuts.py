@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+import requests
+
+from benchmarks.fake_cloud import FakeCloud, NetworkProfile
+from cloud_storages import http_shortcuts
+from cloud_storages.http_shortcuts import HttpSession
+
+
+class _FailingNetwork(NetworkProfile):
+    """Fails the first requests with 503, then answers all the others"""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.failures -= 1
+            return self.failures >= 0
+
+
+class HttpSessionTests(unittest.TestCase):
+    def setUp(self):
+        self.network = _FailingNetwork(0)
+        self.cloud = FakeCloud(self.network).start()
+        self.addCleanup(self.cloud.stop)
+        self.http = HttpSession(retries=3, backoff=0.01)
+
+    def _upload_link(self, path: str) -> str:
+        response = self.http.request('GET', f'{self.cloud.url}/v1/disk/resources/upload',
+                                     params={'path': path, 'overwrite': 'true'})
+        self.assertEqual(200, response.status_code)
+        return response.json()['href']
+
+    def _download(self, path: str) -> bytes:
+        response = self.http.request('GET', f'{self.cloud.url}/_yadisk/download', params={'path': path})
+        self.assertEqual(200, response.status_code)
+        return response.content
+
+    def test_idempotent_request_is_retried_on_5xx(self):
+        self.network.failures = 2
+        response = self.http.request('GET', f'{self.cloud.url}/v1/disk/')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, self.http.retries_count)
+        self.assertEqual(3, self.http.requests_count)
+        self.assertEqual(2, self.cloud.stats()['failed'])
+
+    def test_last_5xx_is_returned_when_retries_run_out(self):
+        self.network.failures = 10
+        response = self.http.request('GET', f'{self.cloud.url}/v1/disk/')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(3, self.http.retries_count)
+        self.assertEqual(4, self.cloud.stats()['failed'])
+
+    def test_post_is_not_retried(self):
+        self.network.failures = 1
+        response = self.http.request('POST', f'{self.cloud.url}/upload/drive/v3/files',
+                                     params={'uploadType': 'resumable'}, json={'parents': ['root-folder-id']})
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(0, self.http.retries_count)
+        self.assertEqual(1, self.cloud.stats()['requests'])
+
+    def test_file_body_is_sent_again_from_its_start(self):
+        content = os.urandom(100 * 1024)
+        with tempfile.TemporaryFile() as f:
+            f.write(b'header' + content)
+            f.seek(len(b'header'))
+            link = self._upload_link('file.bin')
+            self.network.failures = 2
+            response = self.http.request('PUT', link, data=f)
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(2, self.http.retries_count)
+        # The body starts where the file was when the request was made, not at the start of the file
+        self.assertEqual(content, self._download('file.bin'))
+
+    def test_generator_body_is_not_retried(self):
+        link = self._upload_link('file.bin')
+        requests_before = self.cloud.stats()['requests']
+        self.network.failures = 1
+        try:
+            response = self.http.request('PUT', link, data=(block for block in [b'a', b'b']))
+            self.assertEqual(503, response.status_code)
+        except requests.ConnectionError:
+            # The server may close the connection before the whole body is sent
+            pass
+        self.assertEqual(0, self.http.retries_count)
+        self.assertEqual(requests_before + 1, self.cloud.stats()['requests'])
+
+    def test_connection_errors_are_retried_with_backoff(self):
+        url = f'{self.cloud.url}/v1/disk/'
+        self.cloud.stop()
+        with mock.patch.object(http_shortcuts.time, 'sleep') as sleep:
+            with self.assertRaises(requests.ConnectionError):
+                self.http.request('GET', url)
+            self.assertEqual([0.01, 0.02, 0.04], [call.args[0] for call in sleep.call_args_list])
+            self.assertEqual(3, self.http.retries_count)
+
+            sleep.reset_mock()
+            with self.assertRaises(requests.ConnectionError):
+                self.http.request('POST', url)
+            sleep.assert_not_called()
+            self.assertEqual(3, self.http.retries_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
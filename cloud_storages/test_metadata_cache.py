@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from cloud_storages import metadata_cache
+from cloud_storages.metadata_cache import MetadataCache
+from database.database import Database
+from models.models import Resource
+
+
+class MetadataCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.tmp)
+
+    @staticmethod
+    def _listing(path: str):
+        return [Resource(True, f'{path}/{name}', name=name) for name in ('a.zip', 'b.zip')]
+
+    def _names(self, cache: MetadataCache, path: str):
+        listing = cache.get(path)
+        return None if listing is None else [r.name for r in listing]
+
+    def test_listings_of_other_processes_are_kept(self):
+        first = MetadataCache(self.database, 'yandex')
+        # Another process with its own connection to the same database
+        second = MetadataCache(Database(self.database.db_path), 'yandex')
+        first.set('disk:/savezone/x', self._listing('/savezone/x'))
+        second.set('/savezone/y', self._listing('/savezone/y'))
+        first.flush()
+        second.flush()
+        self.assertEqual(['a.zip', 'b.zip'], self._names(second, 'savezone/x'))
+        self.assertEqual(['a.zip', 'b.zip'], self._names(first, 'savezone/y'))
+
+        second.invalidate('/savezone/x/c.zip')
+        self.assertIsNone(first.get('savezone/x'))
+        self.assertIsNotNone(first.get('savezone/y'))
+        self.assertIsNone(MetadataCache(self.database, 'google').get('savezone/y'))
+
+    def test_expired_and_evicted_listings(self):
+        cache = MetadataCache(self.database, 'yandex', ttl=60, max_entries=2)
+        with mock.patch.object(metadata_cache.time, 'time', return_value=1000):
+            cache.set('a', self._listing('a'))
+        with mock.patch.object(metadata_cache.time, 'time', return_value=2000):
+            cache.set('b', self._listing('b'))
+            cache.set('c', self._listing('c'))
+            cache.flush()
+            self.assertIsNone(cache.get('a'))
+            self.assertIsNotNone(cache.get('b'))
+        with mock.patch.object(metadata_cache.time, 'time', return_value=2061):
+            self.assertIsNone(cache.get('b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
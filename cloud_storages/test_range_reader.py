@@ -0,0 +1,114 @@
+import io
+import os
+import unittest
+import zipfile
+
+from unittest import mock
+
+from benchmarks.fake_cloud import FakeCloud
+from cloud_storages.http_shortcuts import HttpSession
+from cloud_storages.range_reader import HttpRangeFile, open_remote_file
+
+SIZE = 64 * 1024
+
+
+class HttpRangeFileTests(unittest.TestCase):
+    def setUp(self):
+        self.cloud = FakeCloud().start()
+        self.addCleanup(self.cloud.stop)
+        self.http = HttpSession(retries=0)
+        self.content = self._put('file.bin', os.urandom(SIZE))
+
+    def _put(self, name: str, content: bytes) -> bytes:
+        with open(os.path.join(self.cloud.yadisk.root, name), 'wb') as f:
+            f.write(content)
+        return content
+
+    def _open(self, name: str = 'file.bin') -> HttpRangeFile:
+        f = HttpRangeFile(f'{self.cloud.url}/_yadisk/download?path={name}', session=self.http)
+        self.addCleanup(f.close)
+        return f
+
+    def test_sequential_reads_share_one_request(self):
+        f = self._open()
+        self.assertEqual(SIZE, f.size)
+        self.assertEqual(self.content[:1000], f.read(1000))
+        self.assertEqual(self.content[1000:], f.read())
+        self.assertEqual(1, f.requests_count)
+        self.assertEqual(b'', f.read(1))
+
+    def test_seek_starts_a_new_request(self):
+        f = self._open()
+        f.seek(5000)
+        self.assertEqual(self.content[5000:5100], f.read(100))
+        f.seek(-100, io.SEEK_CUR)
+        self.assertEqual(self.content[5000:5010], f.read(10))
+        self.assertEqual(2, f.requests_count)
+        f.seek(-10, io.SEEK_END)
+        self.assertEqual(SIZE - 10, f.tell())
+        self.assertEqual(self.content[-10:], f.read(100))
+        self.assertEqual(b'', f.read(100))
+        self.assertEqual(3, f.requests_count)
+
+    def test_seek_before_the_start_is_refused(self):
+        f = self._open()
+        with self.assertRaises(ValueError):
+            f.seek(-1)
+        with self.assertRaises(ValueError):
+            f.seek(-SIZE - 1, io.SEEK_END)
+        self.assertEqual(0, f.tell())
+
+    def test_seek_past_the_end_reads_nothing(self):
+        f = self._open()
+        f.seek(SIZE + 10)
+        self.assertEqual(b'', f.read(10))
+        self.assertEqual(0, f.requests_count)
+
+    def test_request_ends_at_the_next_boundary(self):
+        f = self._open()
+        f.set_boundaries([30000, 10000, 20000, 10000])
+        self.assertEqual([10000, 20000, 30000], f.boundaries)
+        with mock.patch.object(self.http, 'request', wraps=self.http.request) as request:
+            f.seek(12000)
+            # The read ends exactly at the boundary
+            self.assertEqual(self.content[12000:20000], f.read(8000))
+            # The next read goes on with a request of the next range
+            self.assertEqual(self.content[20000:20010], f.read(10))
+        self.assertEqual(['bytes=12000-19999', 'bytes=20000-29999'],
+                         [call.kwargs['headers']['Range'] for call in request.call_args_list])
+        self.assertEqual(2, f.requests_count)
+
+    def test_read_across_a_boundary_returns_what_is_left_of_the_range(self):
+        f = self._open()
+        f.set_boundaries([10000])
+        f.seek(9990)
+        self.assertEqual(self.content[9990:10000], f.read(100))
+        self.assertEqual(self.content[10000:10100], f.read(100))
+        self.assertEqual(2, f.requests_count)
+
+    def test_last_range_ends_at_the_end_of_the_file(self):
+        f = self._open()
+        f.set_boundaries([SIZE - 100])
+        f.seek(SIZE - 100)
+        self.assertEqual(self.content[-100:], f.read())
+        self.assertEqual(b'', f.read())
+        self.assertEqual(1, f.requests_count)
+
+    def test_zip_member_is_read_without_the_whole_archive(self):
+        buffer = io.BytesIO()
+        members = {f'{i}.bin': os.urandom(SIZE) for i in range(8)}
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            for name, content in members.items():
+                archive.writestr(name, content)
+        self._put('archive.zip', buffer.getvalue())
+
+        sent = self.cloud.stats()['sent_bytes']
+        with open_remote_file(f'{self.cloud.url}/_yadisk/download?path=archive.zip', session=self.http) as f:
+            with zipfile.ZipFile(f) as archive:
+                f.raw.set_boundaries([info.header_offset for info in archive.infolist()])
+                self.assertEqual(members['3.bin'], archive.read('3.bin'))
+        self.assertLess(self.cloud.stats()['sent_bytes'] - sent, 2 * SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cloud_storages.upload_sessions import UploadSessionStore
+from database.database import Database
+
+
+class UploadSessionStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+        self.sessions = UploadSessionStore(self.database, 'google')
+        self.path = os.path.join(self.tmp, 'archive.zip')
+        with open(self.path, 'wb') as f:
+            f.write(b'content')
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.tmp)
+
+    def test_session_is_kept_until_it_is_finished(self):
+        session = self.sessions.start(self.path, 'https://upload/1', 'savezone/a/01012024120000.zip')
+        self.sessions.update(self.path, session, 5)
+
+        session = UploadSessionStore(self.database, 'google').get(self.path)
+        self.assertEqual(('https://upload/1', 5, 7, 'savezone/a/01012024120000.zip'),
+                         (session['url'], session['offset'], session['size'], session['remote_path']))
+        self.assertIsNone(UploadSessionStore(self.database, 'yandex').get(self.path))
+
+        self.sessions.finish(self.path)
+        self.assertIsNone(self.sessions.get(self.path))
+
+    def test_session_of_a_changed_file_is_not_continued(self):
+        self.sessions.start(self.path, 'https://upload/1', 'savezone/a/01012024120000.zip')
+        with open(self.path, 'ab') as f:
+            f.write(b'more')
+        self.assertIsNone(self.sessions.get(self.path))
+
+    def test_session_of_a_deleted_file_is_not_continued(self):
+        self.sessions.start(self.path, 'https://upload/1', 'savezone/a/01012024120000.zip')
+        os.unlink(self.path)
+        self.assertIsNone(self.sessions.get(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
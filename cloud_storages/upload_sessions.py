@@ -0,0 +1,48 @@
+import os
+
+from database.database import Database
+
+
+class UploadSessionStore:
+    """
+    Keeps the state of unfinished uploads in the local database, so an upload can be continued by the next run
+    A session is a dict: {'url': session URL, 'offset': confirmed offset, 'size': file size, 'mtime': file mtime,
+                          'remote_path': where the file is uploaded to}
+    """
+
+    def __init__(self, database: Database, storage_key: str):
+        """
+        :param database: a local database
+        :param storage_key: a name of the storage, sessions of different storages are kept apart
+        """
+        self.database = database
+        self.storage_key = storage_key
+
+    def _key(self, local_path: str) -> str:
+        return f'upload:{self.storage_key}:{os.path.abspath(local_path)}'
+
+    def get(self, local_path: str) -> dict or None:
+        """
+        Returns the session of the file, if the file is still the same as when the session was started
+        """
+        session = self.database.get(self._key(local_path))
+        if not session or not os.path.exists(local_path):
+            return None
+        stat = os.stat(local_path)
+        if session.get('size') != stat.st_size or session.get('mtime') != stat.st_mtime_ns:
+            return None
+        return session
+
+    def start(self, local_path: str, url: str, remote_path: str) -> dict:
+        stat = os.stat(local_path)
+        session = {'url': url, 'offset': 0, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'remote_path': remote_path}
+        self.database.set(self._key(local_path), session)
+        return session
+
+    def update(self, local_path: str, session: dict, offset: int) -> None:
+        session['offset'] = offset
+        self.database.set(self._key(local_path), session)
+
+    def finish(self, local_path: str) -> None:
+        if self.database.get(self._key(local_path)):
+            self.database.delete(self._key(local_path))
@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+from typing import AsyncIterator, List
+
+from cloud_storages.async_http import AsyncHttpSession, download_to_file
+from cloud_storages.async_storage import AsyncStorage
+from cloud_storages.storage import LIST_PAGE_SIZE
+from cloud_storages.yadisk.yadisk import YadiskStorage, OPERATION_POLL_DELAY, OPERATION_MAX_POLL_DELAY, \
+    OPERATION_TIMEOUT, _error, _listing_params, _upload_params
+from models.models import StorageMetaInfo, Resource
+from settings import YADISK_API_URL
+
+
+class AsyncYadiskStorage(AsyncStorage):
+    """The asyncio counterpart of YadiskStorage"""
+
+    def __init__(self, token, http: AsyncHttpSession or None = None):
+        self.token = token
+        self.http = http or AsyncHttpSession()
+
+    async def iter_resources_on_path(self, remote_path: str,
+                                     page_size: int = LIST_PAGE_SIZE) -> AsyncIterator[Resource]:
+        """
+        Yields all items in directory, page by page
+        :param remote_path: path to the resource
+        :param page_size: how many items to fetch with one request
+        """
+        offset = 0
+        while True:
+            response = await self.http.request('GET', f'{YADISK_API_URL}/v1/disk/resources',
+                                               params=_listing_params(remote_path, page_size, offset),
+                                               token=self.token)
+            if response.status_code == 404:
+                raise FileNotFoundError(f'Directory not found: {remote_path}')
+            if response.status_code != 200:
+                raise _error(response)
+
+            _embedded = response.json()['_embedded']
+            _embedded_objects = _embedded['items']
+            for resource in _embedded_objects:
+                res: Resource or None = YadiskStorage._deserialize_resource(resource)
+                if res is not None:
+                    yield res
+
+            offset += len(_embedded_objects)
+            if len(_embedded_objects) < page_size or offset >= _embedded.get('total', 0):
+                return
+
+    async def get_meta_info(self) -> StorageMetaInfo:
+        response = await self.http.request('GET', f'{YADISK_API_URL}/v1/disk/', token=self.token)
+        if response.status_code != 200:
+            raise _error(response)
+        response_read = response.json()
+        return StorageMetaInfo(int(response_read['used_space']), int(response_read['total_space']))
+
+    async def create_path(self, remote_path: List[str]) -> None:
+        """
+        Creates the remote path on yandex disk, a directory that exists already is fine
+        """
+        for i in range(1, len(remote_path) + 1):
+            path_to_create = '/'.join(remote_path[:i])
+            response = await self.http.request('PUT', f'{YADISK_API_URL}/v1/disk/resources',
+                                               params={'path': path_to_create}, token=self.token)
+            if response.status_code not in (201, 409):
+                raise _error(response)
+
+    async def save_resource_to_path(self, resource: Resource, remote_path: str, overwrite: bool,
+                                    _rec_call: bool = False) -> Resource or None:
+        """
+        Gets an upload link and puts the file to it
+        :param resource: resource on the local fs
+        :param remote_path: string, path to resource on remote fs
+        :param _rec_call: bool, a system parameter, whether or not this function was called as a recursive call
+        :return: saved resource or raises exception
+        """
+        response = await self.http.request('GET', f'{YADISK_API_URL}/v1/disk/resources/upload',
+                                           params=_upload_params(remote_path, overwrite), token=self.token)
+        # This dir is not present in the storage
+        if response.status_code == 409 and not _rec_call:
+            await self.create_path(remote_path.split('/')[:-1])
+            return await self.save_resource_to_path(resource, remote_path, overwrite, _rec_call=True)
+        if response.status_code != 200:
+            raise _error(response)
+
+        with open(resource.path, 'rb') as f:
+            response = await self.http.request('PUT', response.json()['href'], data=f)
+        if not 199 < response.status_code < 300:
+            raise ValueError(f"Something went wrong with YD: the upload failed with {response.status_code}")
+        self._on_resource_saved(remote_path)
+
+        response = await self.http.request('GET', f'{YADISK_API_URL}/v1/disk/resources',
+                                           params={'path': remote_path}, token=self.token)
+        if response.status_code != 200:
+            return resource
+        return YadiskStorage._deserialize_resource(response.json()) or resource
+
+    async def download_resource(self, remote_path: str, local_path: str) -> str:
+        response = await self.http.request('GET', f'{YADISK_API_URL}/v1/disk/resources/download',
+                                           params={'path': remote_path}, token=self.token)
+        if response.status_code != 200:
+            raise _error(response)
+        return await download_to_file(self.http, response.json()['href'], local_path)
+
+    async def delete_resource(self, remote_path: str) -> None:
+        """
+        Deletes the resource, YD deletes a large one in the background: its status is polled with a growing delay.
+        Every deletion waits on its own, waiting costs nothing but a timer
+        """
+        response = await self.http.request('DELETE', f'{YADISK_API_URL}/v1/disk/resources',
+                                           params={'path': remote_path, 'permanently': 'true'}, token=self.token)
+        if response.status_code == 202:
+            link = response.json()['href']
+            delay = OPERATION_POLL_DELAY
+            deadline = time.monotonic() + OPERATION_TIMEOUT
+            while True:
+                if time.monotonic() > deadline:
+                    raise ValueError('The deletion did not finish in time')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, OPERATION_MAX_POLL_DELAY)
+                response = await self.http.request('GET', link, token=self.token)
+                # The status is asked again on the next round if YD couldn't tell it
+                status = response.json().get('status') if response.status_code == 200 else None
+                if status == 'success':
+                    break
+                if status == 'failed':
+                    raise ValueError('YD failed to delete the resource')
+        elif response.status_code not in (204, 404):
+            raise _error(response)
+        self._on_resource_deleted(remote_path)
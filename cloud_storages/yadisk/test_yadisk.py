@@ -0,0 +1,108 @@
+import asyncio
+import itertools
+import os
+import time
+import unittest
+
+from unittest import mock
+
+from benchmarks.fake_cloud import YADISK_OPERATION_SECONDS, FakeCloud
+from cloud_storages.yadisk import async_yadisk, yadisk
+from cloud_storages.yadisk.async_yadisk import AsyncYadiskStorage
+from cloud_storages.yadisk.yadisk import YadiskStorage
+
+
+class YadiskStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.cloud = FakeCloud().start()
+        self.addCleanup(self.cloud.stop)
+        for module, name, value in ((yadisk, 'YADISK_API_URL', self.cloud.url),
+                                    (async_yadisk, 'YADISK_API_URL', self.cloud.url),
+                                    (yadisk, 'OPERATION_POLL_DELAY', 0.05)):
+            patcher = mock.patch.object(module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.storage = YadiskStorage('token')
+
+    def _put(self, path: str, content: bytes = b'data') -> None:
+        local = os.path.join(self.cloud.yadisk.root, path)
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        with open(local, 'wb') as f:
+            f.write(content)
+
+    def _exists(self, path: str) -> bool:
+        return os.path.exists(os.path.join(self.cloud.yadisk.root, path))
+
+    def _listed_pages(self, remote_path: str, page_size: int, count: int or None = None) -> tuple:
+        """
+        :return: names of the first count items of the listing, all of them if count is None,
+                 and the offsets of the pages that were fetched for them
+        """
+        with mock.patch.object(self.storage.http, 'request', wraps=self.storage.http.request) as request:
+            names = [r.name for r in itertools.islice(self.storage.iter_resources_on_path(remote_path, page_size),
+                                                      count)]
+        return names, [int(call.kwargs['params']['offset']) for call in request.call_args_list]
+
+    def test_listing_spans_pages(self):
+        names = [f'{i:02}.bin' for i in range(25)]
+        for name in names:
+            self._put(f'savezone/{name}')
+        self.assertEqual((names, [0, 10, 20]), self._listed_pages('savezone', 10))
+        # A listing that fills the last page exactly stops at the total, with no request of an empty page
+        for name in names[20:]:
+            os.unlink(os.path.join(self.cloud.yadisk.root, 'savezone', name))
+        self.assertEqual((names[:20], [0, 10]), self._listed_pages('savezone', 10))
+
+    def test_listing_fetches_only_the_pages_that_are_read(self):
+        for i in range(25):
+            self._put(f'savezone/{i:02}.bin')
+        self.assertEqual([0], self._listed_pages('savezone', 10, 5)[1])
+        self.assertEqual([0, 10], self._listed_pages('savezone', 10, 11)[1])
+
+    def test_async_listing_spans_pages(self):
+        names = [f'{i:02}.bin' for i in range(25)]
+        for name in names:
+            self._put(f'savezone/{name}')
+
+        async def _list():
+            async with AsyncYadiskStorage('token') as storage:
+                return [r.name async for r in storage.iter_resources_on_path('savezone', 10)], storage.http.stats()
+
+        listed, stats = asyncio.run(_list())
+        self.assertEqual(names, listed)
+        self.assertEqual(3, stats['requests'])
+
+    def test_deleted_directories_are_waited_for(self):
+        self._put('savezone/a/1.bin')
+        self._put('savezone/b/1.bin')
+        self._put('savezone/c.bin')
+
+        started = time.monotonic()
+        with mock.patch.object(self.storage, '_get_operation_status',
+                               wraps=self.storage._get_operation_status) as get_status:
+            errors = self.storage.delete_resources(['savezone/a', 'savezone/b', 'savezone/c.bin'])
+        self.assertEqual({}, errors)
+        # A directory is deleted by an operation, it is polled until it is done. A file is deleted at once
+        self.assertGreaterEqual(time.monotonic() - started, YADISK_OPERATION_SECONDS)
+        links = {call.args[0] for call in get_status.call_args_list}
+        self.assertEqual(2, len(links))
+        self.assertTrue(all('/v1/disk/operations/' in link for link in links))
+        self.assertEqual(['success', 'success'], [self.storage._get_operation_status(link) for link in links])
+        self.assertFalse(any(self._exists(path) for path in ('savezone/a', 'savezone/b', 'savezone/c.bin')))
+
+    def test_operation_that_does_not_finish_in_time_is_an_error(self):
+        self._put('savezone/a/1.bin')
+        with mock.patch.object(yadisk, 'OPERATION_TIMEOUT', 0), \
+                mock.patch.object(self.storage, '_get_operation_status', return_value='in-progress'):
+            errors = self.storage.delete_resources(['savezone/a'])
+        self.assertEqual(['savezone/a'], list(errors))
+
+    def test_missing_resource_is_deleted_already(self):
+        self._put('savezone/a.bin')
+        self.assertEqual({}, self.storage.delete_resources(['savezone/a.bin', 'savezone/missing']))
+        self.assertFalse(self._exists('savezone/a.bin'))
+        self.storage.delete_resource('savezone/missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
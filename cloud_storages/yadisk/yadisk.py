@@ -1,14 +1,45 @@
-from typing import List
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Iterable, Iterator, Tuple
+
+from cloud_storages.downloads import download_to_file
 from cloud_storages.http_shortcuts import *
 from models.models import StorageMetaInfo, Resource, Size
-from cloud_storages.storage import Storage
+from cloud_storages.storage import Storage, DELETE_WORKERS, LIST_PAGE_SIZE
+from settings import YADISK_API_URL
+
+# Only the fields that _deserialize_resource reads
+LIST_FIELDS = ','.join(['_embedded.total'] + [
+    f'_embedded.items.{field}' for field in ('type', 'path', 'size', 'name', 'file', 'modified', 'md5')
+])
+# Deleting a large resource is done by YD in the background, its status is polled with a growing delay
+OPERATION_POLL_DELAY = 0.5
+OPERATION_MAX_POLL_DELAY = 8
+OPERATION_TIMEOUT = 600
+
+
+def _listing_params(remote_path: str, page_size: int, offset: int) -> dict:
+    return {'path': remote_path, 'limit': str(page_size), 'offset': str(offset), 'fields': LIST_FIELDS}
+
+
+def _upload_params(remote_path: str, overwrite: bool) -> dict:
+    return {'path': remote_path, 'overwrite': str(overwrite).lower()}
+
+
+def _error(response) -> ValueError:
+    try:
+        message = response.json().get('message', '')
+    except ValueError:
+        message = response.text
+    return ValueError(f"Something went wrong with YD: Response: {str(response.status_code)} — {message}")
 
 
 class YadiskStorage(Storage):
 
-    def __init__(self, token):
+    def __init__(self, token, http: HttpSession or None = None):
         self.token = token
+        self.http = http or HttpSession()
 
     @classmethod
     def get_oauth_request_url(cls):
@@ -38,35 +69,38 @@ class YadiskStorage(Storage):
         res.md5 = json.get('md5')
         return res
 
-    def list_resources_on_path(self, remote_path: str) -> List[Resource]:
+    def iter_resources_on_path(self, remote_path: str, page_size: int = LIST_PAGE_SIZE) -> Iterator[Resource]:
         """
-        List all items in directory
+        Yields all items in directory, page by page
         :param path: path to the resource
+        :param page_size: how many items to fetch with one request
         """
+        offset = 0
+        while True:
+            response = self.http.get_with_OAuth(f'{YADISK_API_URL}/v1/disk/resources',
+                                                params=_listing_params(remote_path, page_size, offset),
+                                                token=self.token)
+            if response.status_code == 404:
+                raise FileNotFoundError(f'Directory not found: {remote_path}')
+            if response.status_code != 200:
+                raise _error(response)
 
-        response = get_with_OAuth('https://cloud-api.yandex.net/v1/disk/resources',
-                                  params={'path': remote_path},
-                                  token=self.token)
-        if response.status_code == 200:
-            result = []
-            response_as_json = response.json()
-            _embedded_objects = response_as_json['_embedded']['items']
-
+            _embedded = response.json()['_embedded']
+            _embedded_objects = _embedded['items']
             for resource in _embedded_objects:
                 res: Resource or None = self._deserialize_resource(resource)
                 if res is not None:
-                    result.append(res)
+                    yield res
 
-            return result
-        else:
-            raise ValueError(f"Something went wrong with YD: Response: "
-                             f"{str(response.status_code)} — {response.json()['message']}")
+            offset += len(_embedded_objects)
+            if len(_embedded_objects) < page_size or offset >= _embedded.get('total', 0):
+                return
 
     def get_meta_info(self) -> StorageMetaInfo:
         """
         Gets meta info of storage
         """
-        response = get_with_OAuth('https://cloud-api.yandex.net/v1/disk/', token=self.token)
+        response = self.http.get_with_OAuth(f'{YADISK_API_URL}/v1/disk/', token=self.token)
         if response.status_code == 200:
             response_read = response.json()
             used_space = response_read['used_space']
@@ -78,81 +112,150 @@ class YadiskStorage(Storage):
 
     def create_path(self, remote_path: List[str]) -> None:
         """
-        Creates the remote path on yandex disk
+        Creates the remote path on yandex disk, a directory that exists already is fine
         """
         print(f'[{__name__}] Trying to create directory {"/".join(remote_path)} on remote...')
-
-        dir_to_create = []
-
-        for dir in remote_path:
-            dir_to_create.append(dir)
-            path_to_create = '/'.join(dir_to_create)
-            response = put_with_OAuth(f'https://cloud-api.yandex.net/v1/disk/resources?path={path_to_create}',
-                                      token=self.token)
-            if 199 < response.status_code < 401:
+        for i in range(1, len(remote_path) + 1):
+            path_to_create = '/'.join(remote_path[:i])
+            response = self.http.put_with_OAuth(f'{YADISK_API_URL}/v1/disk/resources',
+                                                params={'path': path_to_create}, token=self.token)
+            if response.status_code == 201:
                 print(f'[{__name__}] Created directory {path_to_create}')
-                continue
-            elif response.status_code == 409 and 'уже существует' in response.json().get('message', ''):
-                continue
-        return
+            elif response.status_code != 409:
+                raise _error(response)
 
-    def save_resource_to_path(self, resource: Resource, remote_path: str, overwrite: bool, _rec_call:bool = False) -> Resource or None:
+    def save_resource_to_path(self, resource: Resource, remote_path: str, overwrite: bool) -> Resource or None:
         """
         Put an Item to the directory
         :param resource: resource on the local fs
         :param remote_path: string, path to resource on remote fs
-        :param _rec_call: bool, a system parameter, whether or not this function was called as a recursive call
         :return: saved resource or raises exception
         """
+        with open(resource.path, 'rb') as f:
+            return self._upload(f, remote_path, overwrite, fallback=resource)
 
-        upload_successful_flag = False
+    def save_stream_to_path(self, stream: Iterable[bytes], remote_path: str, overwrite: bool) -> Resource or None:
+        """
+        Put an Item to the directory, the content is sent with chunked transfer encoding while it is being read
+        :param stream: iterable of bytes, the content of the resource
+        :param remote_path: string, path to resource on remote fs
+        :return: saved resource or raises exception
+        """
+        return self._upload(stream, remote_path, overwrite, fallback=Resource(True, remote_path))
 
-        response = get_with_OAuth(
-            f'https://cloud-api.yandex.net/v1/disk/resources/upload?path={remote_path}&overwrite=${overwrite}',
-            token=self.token
-        )
-        if response.status_code == 200:
-            response_read = response.json()
-            upload_link = response_read['href']
-
-            with open(resource.path, 'rb') as f:
-                files = f
-                response = put_with_OAuth(upload_link, data=files)
-                if 199 < response.status_code < 401:
-                    upload_successful_flag = True
-
-            response = get_with_OAuth(f'https://cloud-api.yandex.net/v1/disk/resources?path={remote_path}',
-                                      token=self.token)
-            resource_metainfo = self._deserialize_resource(response.json())
-            if 199 < response.status_code < 401:
-                return resource_metainfo
-            elif upload_successful_flag:
-                return resource
+    def _upload(self, data, remote_path: str, overwrite: bool, fallback: Resource, _rec_call: bool = False) -> Resource or None:
+        """
+        Gets an upload link and puts the data to it
+        :param data: file-like object or iterable of bytes
+        :param fallback: resource to return if the upload went well but the meta info couldn't be fetched
+        :param _rec_call: bool, a system parameter, whether or not this function was called as a recursive call
+        :return: saved resource or raises exception
+        """
 
+        response = self.http.get_with_OAuth(f'{YADISK_API_URL}/v1/disk/resources/upload',
+                                            params=_upload_params(remote_path, overwrite), token=self.token)
         # This dir is not present in the storage
         # We use _rec_call to tell that the next call was made as recursive call, so we don't cause SO
-        elif response.status_code == 409 and not _rec_call:
+        if response.status_code == 409 and not _rec_call:
             # We don't need to create a folder with the name equal to the filename, so we do [:-1]
             self.create_path(remote_path.split('/')[:-1])
-            return self.save_resource_to_path(resource, remote_path, overwrite, _rec_call=True)
+            return self._upload(data, remote_path, overwrite, fallback, _rec_call=True)
+        if response.status_code != 200:
+            raise _error(response)
 
-        raise ValueError(f"Something went wrong with YD: Response: "
-                         f"{str(response.status_code)} — {response.json().get('message', '')}")
+        response = self.http.put_with_OAuth(response.json()['href'], data=data)
+        if not 199 < response.status_code < 300:
+            raise ValueError(f"Something went wrong with YD: the upload failed with {response.status_code}")
+        self._on_resource_saved(remote_path)
 
-    def download_resource(self, remote_path, local_path) -> str:
+        response = self.http.get_with_OAuth(f'{YADISK_API_URL}/v1/disk/resources', params={'path': remote_path},
+                                            token=self.token)
+        if response.status_code != 200:
+            return fallback
+        return self._deserialize_resource(response.json()) or fallback
 
-        response = get_with_OAuth(
-            f'https://cloud-api.yandex.net/v1/disk/resources/download?path={remote_path}',
-            token=self.token
-        )
-        if response.status_code == 200:
-            response_read = response.json()
-            dl_url = response_read.get('href')
-        else:
-            raise ValueError(f"[{__name__}] Something went wrong with YD: Response: "
-                             f"{str(response.status_code)} — {response.json()['message']}")
+    def get_download_link(self, remote_path: str) -> Tuple[str, dict]:
+        response = self.http.get_with_OAuth(f'{YADISK_API_URL}/v1/disk/resources/download',
+                                            params={'path': remote_path}, token=self.token)
+        if response.status_code != 200:
+            raise _error(response)
+        return response.json().get('href'), {}
+
+    def download_resource(self, remote_path, local_path, segments: int = 1) -> str:
+        dl_url, headers = self.get_download_link(remote_path)
+        return download_to_file(dl_url, local_path, headers, segments=segments, session=self.http)
+
+    def _start_delete(self, remote_path: str) -> str or None:
+        """
+        Asks YD to delete the resource
+        :return: a link to the status of the deletion if YD deletes it in the background, None if it's deleted
+        """
+        response = self.http.request('DELETE', f'{YADISK_API_URL}/v1/disk/resources',
+                                     params={'path': remote_path, 'permanently': 'true'}, token=self.token)
+        if response.status_code in (204, 404):
+            return None
+        if response.status_code == 202:
+            return response.json()['href']
+        raise _error(response)
+
+    def _get_operation_status(self, link: str) -> str:
+        """
+        :return: 'success', 'failed' or 'in-progress'
+        """
+        try:
+            response = self.http.get_with_OAuth(link, token=self.token)
+        except OSError:
+            return 'in-progress'
+        if response.status_code != 200:
+            # The status is asked again on the next round
+            return 'in-progress'
+        return response.json().get('status', 'in-progress')
+
+    def delete_resource(self, remote_path: str) -> None:
+        errors = self.delete_resources([remote_path], workers=1)
+        if errors:
+            raise ValueError(errors[remote_path])
+
+    def delete_resources(self, remote_paths: List[str], workers: int = DELETE_WORKERS) -> Dict[str, str]:
+        """
+        Starts all the deletions at once, then polls the ones that YD does in the background together,
+        each round asking for the status of every unfinished one and waiting twice as long as before the next round
+        :return: errors by the remote paths that couldn't be deleted
+        """
+        errors, operations = {}, {}
+
+        def _start(remote_path: str) -> None:
+            try:
+                link = self._start_delete(remote_path)
+            except (ValueError, OSError) as e:
+                errors[remote_path] = str(e)
+                return
+            if link is None:
+                self._on_resource_deleted(remote_path)
+            else:
+                operations[remote_path] = link
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_start, remote_paths))
 
-        file = requests.get(dl_url)
-        open(local_path, 'wb').write(file.content)
+            delay = OPERATION_POLL_DELAY
+            deadline = time.monotonic() + OPERATION_TIMEOUT
+            while operations:
+                if time.monotonic() > deadline:
+                    for remote_path in operations:
+                        errors[remote_path] = 'The deletion did not finish in time'
+                    break
+                time.sleep(delay)
+                delay = min(delay * 2, OPERATION_MAX_POLL_DELAY)
 
-        return local_path
+                pending = list(operations)
+                statuses = executor.map(self._get_operation_status, (operations[p] for p in pending))
+                for remote_path, status in zip(pending, statuses):
+                    if status == 'success':
+                        self._on_resource_deleted(remote_path)
+                    elif status == 'failed':
+                        errors[remote_path] = 'YD failed to delete the resource'
+                    else:
+                        continue
+                    del operations[remote_path]
+        return errors
@@ -0,0 +1,104 @@
+from datetime import datetime
+from typing import Iterable, List, Tuple
+
+from database.database import SUBTREE_CONDITION, Database, subtree_range
+from models.models import CatalogEntry
+
+
+def normalize_remote_path(remote_path: str) -> str:
+    # Yandex Disk returns paths as disk:/a/b, but accepts a/b as well
+    if remote_path.startswith('disk:'):
+        remote_path = remote_path[len('disk:'):]
+    return remote_path.strip('/')
+
+
+class Catalog:
+    """
+    A local index of the backups on all storages, kept in the local database
+    Every backup adds itself to the catalog, and a sync with the storage adds the backups that are missing
+    and drops the ones that are gone, so backups can be listed and searched without the network
+    """
+
+    def __init__(self, database: Database):
+        self.database = database
+        with database.transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS backups ('
+                'storage TEXT NOT NULL, remote_path TEXT NOT NULL, path TEXT NOT NULL, name TEXT NOT NULL, '
+                'version TEXT NOT NULL, created REAL NOT NULL, size INTEGER, '
+                'PRIMARY KEY (storage, remote_path))'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS backups_by_path ON backups (storage, path)')
+            connection.execute('CREATE INDEX IF NOT EXISTS backups_by_created ON backups (created)')
+            connection.execute('CREATE INDEX IF NOT EXISTS backups_by_size ON backups (size)')
+
+    def add(self, entry: CatalogEntry) -> None:
+        self.database.connection.execute(
+            'INSERT OR REPLACE INTO backups (storage, remote_path, path, name, version, created, size) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (entry.storage, normalize_remote_path(entry.remote_path), entry.path, entry.name, entry.version,
+             entry.created.timestamp(), entry.size)
+        )
+
+    def remove(self, storage: str, remote_path: str) -> None:
+        self.database.connection.execute('DELETE FROM backups WHERE storage = ? AND remote_path = ?',
+                                         (storage, normalize_remote_path(remote_path)))
+
+    def reconcile(self, storage: str, entries: Iterable[CatalogEntry],
+                  remove_missing: bool = True) -> Tuple[int, int]:
+        """
+        Makes the catalog of the storage match the backups found on it: adds new backups,
+        updates the changed ones and drops the ones that are not on the storage anymore
+        :param remove_missing: whether to drop the backups that are not in entries,
+                               False if only a part of the storage was listed
+        :return: how many backups were added and removed
+        """
+        entries = {normalize_remote_path(entry.remote_path): entry for entry in entries}
+        with self.database.transaction() as connection:
+            known = {remote_path: size for remote_path, size in connection.execute(
+                'SELECT remote_path, size FROM backups WHERE storage = ?', (storage,))}
+            added = 0
+            for remote_path, entry in entries.items():
+                if remote_path not in known:
+                    added += 1
+                if remote_path not in known or known[remote_path] != entry.size:
+                    self.add(entry)
+            removed = [remote_path for remote_path in known if remote_path not in entries] if remove_missing else []
+            connection.executemany('DELETE FROM backups WHERE storage = ? AND remote_path = ?',
+                                   ((storage, remote_path) for remote_path in removed))
+        return added, len(removed)
+
+    def find(self, storage: str or None = None, path: str or None = None, newer_than: datetime or None = None,
+             largest: int or None = None) -> List[CatalogEntry]:
+        """
+        Finds backups in the catalog, newest first
+        :param storage: a name of the storage, all storages if not given
+        :param path: a local path, finds backups of the path and of everything under it
+        :param newer_than: finds backups made after the date
+        :param largest: finds this many largest backups, largest first
+        """
+        conditions, params = [], []
+        if storage is not None:
+            conditions.append('storage = ?')
+            params.append(storage)
+        if path is not None:
+            conditions.append(SUBTREE_CONDITION)
+            params += subtree_range(path.rstrip('/') or '/')
+        if newer_than is not None:
+            conditions.append('created > ?')
+            params.append(newer_than.timestamp())
+
+        query = 'SELECT storage, remote_path, path, name, version, created, size FROM backups'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        if largest is not None:
+            query += ' ORDER BY size DESC LIMIT ?'
+            params.append(largest)
+        else:
+            query += ' ORDER BY created DESC'
+
+        return [
+            CatalogEntry(storage, remote_path, path, name, version, datetime.fromtimestamp(created), size)
+            for storage, remote_path, path, name, version, created, size
+            in self.database.connection.execute(query, params)
+        ]
@@ -1,25 +1,95 @@
-from typing import Any
+import json
+import os
+import sqlite3
+import threading
 
-import pickledb
+from contextlib import contextmanager
+from typing import Any, Iterator, Tuple
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+# A backup of the pickledb file that the database was migrated from
+MIGRATED_SUFFIX = '.json.bak'
+BUSY_TIMEOUT = 30
+# Matches the rows of the path and of everything under it, takes the parameters that subtree_range returns
+SUBTREE_CONDITION = '(path = ? OR (path >= ? AND path < ?))'
+
+
+def subtree_range(path: str, separator: str = '/') -> Tuple[str, str, str]:
+    """
+    Returns the parameters of SUBTREE_CONDITION: the path and the bounds of the paths under it.
+    Paths under the path sort between <path><separator> and <path><the character after the separator>,
+    so an index on the path column finds them with a range scan
+    """
+    prefix = path if path.endswith(separator) else path + separator
+    return path, prefix, prefix[:-1] + chr(ord(separator) + 1)
 
 
 class Database:
-    """A abstraction over KV storage"""
+    """
+    A abstraction over KV storage
+    Values are kept as JSON in a SQLite database in WAL mode: a write changes only its own row,
+    readers don't wait for writers, and a crash can't leave the database half-written.
+    Every thread gets its own connection. A storage.db left by pickledb is migrated on the first open
+    """
 
     def __init__(self, db_path: str = 'storage.db'):
         """
         Initializes the database
         :param db_path: string, a path to database
         """
-        self.db = pickledb.load(db_path, False)
+        self.db_path = db_path
+        self._local = threading.local()
+        _migrate_json(db_path)
+        with self.transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Transactions are started explicitly, a write outside of a transaction is committed at once
+            connection = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.depth = 0
+        return connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Groups the writes of the block into one transaction: they are committed together when the block ends,
+        or not at all if it raises. Transactions can be nested, the outermost one commits
+        """
+        connection = self.connection
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield connection
+            finally:
+                self._local.depth -= 1
+            return
+
+        connection.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        else:
+            connection.execute('COMMIT')
+        finally:
+            self._local.depth = 0
 
     def get(self, key: str) -> Any:
         """
         Get item by key from storage
         :param key: string
-        :return: item
+        :return: item, or False if there is no such key (like pickledb)
         """
-        return self.db.get(key)
+        row = self.connection.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else False
 
     def set(self, key: str, val: Any) -> None:
         """
@@ -27,19 +97,55 @@ class Database:
         :param key:
         :param val:
         """
-        self.db.set(key, val)
-        self.db.dump()
+        self.connection.execute('INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)', (key, json.dumps(val)))
 
     def delete(self, key: str) -> None:
         """
         Removes the key from the the database
         """
-        self.db.rem(key)
-        self.db.dump()
+        self.connection.execute('DELETE FROM kv WHERE key = ?', (key,))
 
     def flush(self) -> None:
         """
         Flushes the database
         """
-        self.db.deldb()
-        self.db.dump()
+        self.connection.execute('DELETE FROM kv')
+
+    def close(self) -> None:
+        """
+        Closes the connection of the current thread
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def _migrate_json(db_path: str) -> None:
+    """
+    Moves the keys of a pickledb JSON file on db_path to a new SQLite database on the same path.
+    The JSON file is kept next to it as <db_path>.json.bak
+    """
+    if not os.path.isfile(db_path) or os.path.getsize(db_path) == 0:
+        return
+    with open(db_path, 'rb') as f:
+        if f.read(len(SQLITE_HEADER)) == SQLITE_HEADER:
+            return
+    with open(db_path, encoding='utf-8') as f:
+        values = json.load(f)
+
+    print(f'[{__name__}] Migrating {db_path} to SQLite, the old file is kept as {db_path}{MIGRATED_SUFFIX}')
+    temp_path = db_path + '.migrating'
+    if os.path.exists(temp_path):
+        os.unlink(temp_path)
+    connection = sqlite3.connect(temp_path, isolation_level=None)
+    try:
+        connection.execute('BEGIN')
+        connection.execute('CREATE TABLE kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        connection.executemany('INSERT INTO kv (key, value) VALUES (?, ?)',
+                               ((key, json.dumps(value)) for key, value in values.items()))
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+    os.replace(db_path, db_path + MIGRATED_SUFFIX)
+    os.replace(temp_path, db_path)
@@ -0,0 +1,53 @@
+import json
+import os
+
+from typing import Dict, List, Tuple
+
+from database.database import SUBTREE_CONDITION, Database, subtree_range
+
+# (device, inode, mtime in ns, [directories, symlinks, files])
+Listing = Tuple[int, int, int, List[List[str]]]
+
+
+class StatCache:
+    """
+    Listings of local directories, kept in the local database with the device, inode and mtime of the directory.
+    Adding, removing or renaming an entry changes the mtime of its directory, so a directory whose device, inode
+    and mtime are the same as in the cache has the same entries, and it doesn't have to be read again
+    """
+
+    def __init__(self, database: Database):
+        self.database = database
+        with database.transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS directories ('
+                'path TEXT PRIMARY KEY, device INTEGER NOT NULL, inode INTEGER NOT NULL, mtime INTEGER NOT NULL, '
+                'entries TEXT NOT NULL)'
+            )
+
+    @staticmethod
+    def _subtree(root: str) -> Tuple[str, str, str]:
+        return subtree_range(os.path.abspath(root).rstrip(os.sep) or os.sep, os.sep)
+
+    def load(self, root: str) -> Dict[str, Listing]:
+        """
+        :return: cached listings of the root and of every directory under it by their absolute paths
+        """
+        rows = self.database.connection.execute(
+            f'SELECT path, device, inode, mtime, entries FROM directories WHERE {SUBTREE_CONDITION}',
+            self._subtree(root)
+        )
+        return {path: (device, inode, mtime, json.loads(entries)) for path, device, inode, mtime, entries in rows}
+
+    def update(self, root: str, listings: Dict[str, Listing]) -> None:
+        """
+        Replaces the cached listings of the root and everything under it, directories that are not in listings
+        are dropped from the cache
+        """
+        with self.database.transaction() as connection:
+            connection.execute(f'DELETE FROM directories WHERE {SUBTREE_CONDITION}', self._subtree(root))
+            connection.executemany(
+                'INSERT OR REPLACE INTO directories (path, device, inode, mtime, entries) VALUES (?, ?, ?, ?, ?)',
+                ((path, device, inode, mtime, json.dumps(entries))
+                 for path, (device, inode, mtime, entries) in listings.items())
+            )
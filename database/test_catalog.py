@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime, timedelta
+
+from database.catalog import Catalog
+from database.database import Database
+from models.models import CatalogEntry
+
+
+def _entry(path: str, days_ago: int, size: int, storage: str = 'Yandex Disk') -> CatalogEntry:
+    created = datetime(2021, 1, 31, 12) - timedelta(days=days_ago)
+    version = created.strftime('%d%m%Y%H%M%S')
+    return CatalogEntry(storage, f'disk:/savezone/{os.path.basename(path)}/{version}', path,
+                        os.path.basename(path), version, created, size)
+
+
+class CatalogTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.catalog = Catalog(Database(os.path.join(self.tmp, 'storage.db')))
+        self.entries = [
+            _entry('/etc', 1, 100),
+            _entry('/etc', 10, 300),
+            _entry('/etc/nginx', 2, 50),
+            _entry('/etcetera', 1, 1000),
+            _entry('/home', 3, 200, 'Google Drive'),
+        ]
+        for entry in self.entries:
+            self.catalog.add(entry)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_versions_of_a_path_newer_than(self):
+        found = self.catalog.find(path='/etc', newer_than=datetime(2021, 1, 31) - timedelta(days=7))
+        self.assertEqual([('/etc', 100), ('/etc/nginx', 50)], [(e.path, e.size) for e in found])
+
+    def test_largest(self):
+        found = self.catalog.find(storage='Yandex Disk', largest=2)
+        self.assertEqual([1000, 300], [e.size for e in found])
+
+    def test_reconcile_applies_the_difference(self):
+        remote = [self.entries[0], self.entries[1], _entry('/var', 0, 10)]
+        self.assertEqual((1, 2), self.catalog.reconcile('Yandex Disk', remote))
+        self.assertEqual(['/var', '/etc', '/etc'], [e.path for e in self.catalog.find(storage='Yandex Disk')])
+        self.assertEqual(['/home'], [e.path for e in self.catalog.find(storage='Google Drive')])
+
+        self.assertEqual((0, 0), self.catalog.reconcile('Yandex Disk', remote[:1], remove_missing=False))
+        self.assertEqual(3, len(self.catalog.find(storage='Yandex Disk')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from database.database import SUBTREE_CONDITION, Database, MIGRATED_SUFFIX, subtree_range
+
+
+class DatabaseTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'storage.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_values_are_kept(self):
+        database = Database(self.path)
+        database.set('token', 'secret')
+        database.set('manifest', {'files': {'a.txt': [1, 2]}})
+        database.delete('token')
+
+        database = Database(self.path)
+        self.assertFalse(database.get('token'))
+        self.assertEqual({'files': {'a.txt': [1, 2]}}, database.get('manifest'))
+
+    def test_failed_transaction_is_rolled_back(self):
+        database = Database(self.path)
+        database.set('a', 1)
+        with self.assertRaises(RuntimeError):
+            with database.transaction():
+                database.set('a', 2)
+                with database.transaction():
+                    database.set('b', 2)
+                raise RuntimeError()
+        self.assertEqual(1, database.get('a'))
+        self.assertFalse(database.get('b'))
+
+    def test_threads_read_and_write(self):
+        database = Database(self.path)
+
+        def _write(i):
+            database.set(f'upload:{i}', {'offset': i})
+
+        threads = [threading.Thread(target=_write, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([{'offset': i} for i in range(8)], [database.get(f'upload:{i}') for i in range(8)])
+
+    def test_pickledb_file_is_migrated(self):
+        with open(self.path, 'w') as f:
+            json.dump({'yandex': 'token', 'paths:google': {'': 'root-id'}}, f)
+
+        database = Database(self.path)
+        self.assertEqual('token', database.get('yandex'))
+        self.assertEqual({'': 'root-id'}, database.get('paths:google'))
+        self.assertTrue(os.path.exists(self.path + MIGRATED_SUFFIX))
+
+    def test_subtree_condition_matches_the_path_and_everything_under_it(self):
+        connection = Database(self.path).connection
+        connection.execute('CREATE TABLE paths (path TEXT PRIMARY KEY)')
+        connection.executemany('INSERT INTO paths VALUES (?)',
+                               [(p,) for p in ('a', 'a/b', 'a/b/c', 'a-b', 'a0', 'ab', 'b', '/', '/x')])
+
+        def _subtree(path):
+            rows = connection.execute(f'SELECT path FROM paths WHERE {SUBTREE_CONDITION} ORDER BY path',
+                                      subtree_range(path))
+            return [path for path, in rows]
+
+        self.assertEqual(['a', 'a/b', 'a/b/c'], _subtree('a'))
+        self.assertEqual(['a/b', 'a/b/c'], _subtree('a/b'))
+        self.assertEqual(['/', '/x'], _subtree('/'))
+
+
+if __name__ == '__main__':
+    unittest.main()
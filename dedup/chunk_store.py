@@ -0,0 +1,161 @@
+import zlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import BoundedSemaphore, Lock
+from typing import Deque, Iterable, Iterator, List
+
+from cloud_storages.storage import Storage
+from database.database import Database
+
+UPLOAD_WORKERS = 4
+
+
+class ChunkStore:
+    """
+    A deduplicated store of chunks on the remote storage. Chunks are addressed by the hash of their content
+    and are kept compressed under <directory>/<first two letters of the hash>/<hash>
+    The hashes of the uploaded chunks are kept in the chunks table of the local database, a row for every chunk,
+    so checking whether the remote already has a chunk doesn't need a request. A row is inserted as soon as its
+    chunk is uploaded, so the backups that run at once in other processes see it too.
+    The worker threads are started by the first upload or download and stopped by close, use the store as
+    a context manager or close it when done
+    """
+
+    def __init__(self, storage: Storage, directory: str, database: Database, storage_key: str,
+                 workers: int = UPLOAD_WORKERS):
+        """
+        :param storage: the storage to keep the chunks in
+        :param directory: a remote directory for the chunks
+        :param database: a local database for the index
+        :param storage_key: a name of the storage in the index, the index is separate for every storage
+        :param workers: how many chunks can be uploaded or downloaded at once
+        """
+        self.storage = storage
+        self.directory = directory
+        self.database = database
+        self.storage_key = storage_key
+        self.workers = workers
+        self.uploaded_bytes = 0
+        self.skipped_bytes = 0
+        self._lock = Lock()
+        self._queued = set()
+        self._pending: List[Future] = []
+        self._executor: ThreadPoolExecutor or None = None
+        # Bounds the amount of chunks that are read but not yet uploaded
+        self._slots = BoundedSemaphore(workers * 2)
+        with database.transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS chunks (storage TEXT NOT NULL, hash TEXT NOT NULL, '
+                               'PRIMARY KEY (storage, hash)) WITHOUT ROWID')
+            self._migrate(connection)
+
+    def _migrate(self, connection) -> None:
+        # Older versions kept the index as one JSON list under chunks:<storage>
+        legacy_key = f'chunks:{self.storage_key}'
+        hashes = self.database.get(legacy_key)
+        if hashes is not False:
+            connection.executemany('INSERT OR IGNORE INTO chunks (storage, hash) VALUES (?, ?)',
+                                   ((self.storage_key, chunk_hash) for chunk_hash in hashes))
+            self.database.delete(legacy_key)
+
+    def __enter__(self) -> 'ChunkStore':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor.submit(fn, *args)
+
+    def has(self, chunk_hash: str) -> bool:
+        """
+        Whether the chunk is uploaded to the storage, by this or by any other process
+        """
+        return self.database.connection.execute('SELECT 1 FROM chunks WHERE storage = ? AND hash = ?',
+                                                (self.storage_key, chunk_hash)).fetchone() is not None
+
+    def _remote_path(self, chunk_hash: str) -> str:
+        return '/'.join([self.directory, chunk_hash[:2], chunk_hash])
+
+    def _upload(self, chunk_hash: str, chunk: bytes) -> None:
+        try:
+            self.storage.save_stream_to_path([zlib.compress(chunk)], self._remote_path(chunk_hash), True)
+            self.database.connection.execute('INSERT OR IGNORE INTO chunks (storage, hash) VALUES (?, ?)',
+                                             (self.storage_key, chunk_hash))
+            with self._lock:
+                self.uploaded_bytes += len(chunk)
+        finally:
+            self._slots.release()
+
+    def skip_known(self, chunk_hash: str, size: int) -> bool:
+        """
+        Returns True and counts the chunk as skipped if the store has it or is uploading it already
+        """
+        with self._lock:
+            if chunk_hash in self._queued or self.has(chunk_hash):
+                self.skipped_bytes += size
+                return True
+        return False
+
+    def put(self, chunk_hash: str, chunk: bytes) -> None:
+        """
+        Uploads the chunk in background unless the store already has it
+        """
+        if self.skip_known(chunk_hash, len(chunk)):
+            return
+        with self._lock:
+            self._queued.add(chunk_hash)
+        self._slots.acquire()
+        self._pending.append(self._submit(self._upload, chunk_hash, chunk))
+
+    def get(self, chunk_hash: str) -> bytes:
+        """
+        Downloads the chunk and returns its content
+        """
+        with self.storage.stream_resource(self._remote_path(chunk_hash)) as f:
+            return zlib.decompress(f.read())
+
+    def get_many(self, hashes: Iterable[str]) -> Iterator[bytes]:
+        """
+        Downloads the chunks on the workers of the store and yields their contents in the order of hashes.
+        At most workers * 2 chunks are downloaded ahead of the one that is yielded
+        """
+        ahead: Deque[Future] = deque()
+        try:
+            for chunk_hash in hashes:
+                ahead.append(self._submit(self.get, chunk_hash))
+                if len(ahead) >= self.workers * 2:
+                    yield ahead.popleft().result()
+            while ahead:
+                yield ahead.popleft().result()
+        finally:
+            for future in ahead:
+                future.cancel()
+
+    def flush(self) -> None:
+        """
+        Waits for all uploads and raises the first upload error, if any
+        """
+        pending, self._pending = self._pending, []
+        errors = [future.exception() for future in pending]
+        with self._lock:
+            self._queued.clear()
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def close(self) -> None:
+        """
+        Waits for all uploads and stops the worker threads, raises the first upload error, if any.
+        The store can still be used, the threads are started again when needed
+        """
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                executor, self._executor = self._executor, None
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
@@ -0,0 +1,141 @@
+# Content-defined chunking
+# Splits data into chunks at positions chosen by a rolling (gear) hash of the content, as FastCDC does.
+# An insertion or deletion only moves the boundaries around the edit, so the rest of the chunks stay the same.
+# With numpy (pip install numpy) the hashes are computed for a block of bytes at once, which is tens of times faster
+# than the loop over the bytes that is used without it. Both find the same boundaries
+import hashlib
+
+from typing import BinaryIO, Iterator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 8 * 1024 * 1024
+# Bytes hashed at once with numpy, the scan stops at the first block that has a boundary.
+# The hashes of a block fit in the CPU cache, bigger blocks are slower
+SCAN_BLOCK_SIZE = 64 * 1024
+
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+# The hash is shifted by a bit on every byte, so a byte is out of the 64 bit hash 64 bytes later
+_WINDOW = 64
+
+
+def _gear_table() -> list:
+    # The table has to be the same on every run, otherwise the boundaries (and so the chunks) would change
+    return [int.from_bytes(hashlib.sha256(i.to_bytes(2, 'big')).digest()[:8], 'big') for i in range(256)]
+
+
+GEAR = _gear_table()
+_GEAR_ARRAY = numpy.array(GEAR, dtype=numpy.uint64) if numpy is not None else None
+
+
+def _mask(bits: int) -> int:
+    # FastCDC spreads the mask bits over the upper part of the hash, the upper bits depend on more bytes
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def chunk_id(chunk: bytes) -> str:
+    """
+    A strong hash of the chunk content, chunks are addressed by it
+    """
+    return hashlib.sha256(chunk).hexdigest()
+
+
+def find_boundary(data: bytes or bytearray, start: int, end: int, min_size: int = MIN_CHUNK_SIZE,
+                  avg_size: int = AVG_CHUNK_SIZE, max_size: int = MAX_CHUNK_SIZE) -> int:
+    """
+    Finds the end of the chunk that starts at data[start]
+    Before avg_size a harder mask is used and after it an easier one (normalized chunking),
+    so chunk sizes are kept close to avg_size
+    :param end: the end of the available data, if the chunk doesn't end before it - end is returned
+    :return: index right after the last byte of the chunk
+    """
+    size = end - start
+    if size <= min_size:
+        return end
+    if size > max_size:
+        end = start + max_size
+    normal = min(start + avg_size, end)
+
+    bits = avg_size.bit_length() - 1
+    mask_s = _mask(bits + 2)
+    mask_l = _mask(bits - 2)
+    if numpy is not None:
+        return _scan_blocks(data, start + min_size, normal, end, mask_s, mask_l)
+    gear = GEAR
+    h = 0
+
+    i = start + min_size
+    while i < normal:
+        h = ((h << 1) + gear[data[i]]) & _MASK_64
+        if not h & mask_s:
+            return i + 1
+        i += 1
+    while i < end:
+        h = ((h << 1) + gear[data[i]]) & _MASK_64
+        if not h & mask_l:
+            return i + 1
+        i += 1
+    return end
+
+
+def _gear_hashes(data: bytes or bytearray, first: int, start: int, end: int) -> 'numpy.ndarray':
+    """
+    Returns the hashes after each of data[start:end], the hash being started at data[first].
+    The hash after byte i is the sum of GEAR[data[i - k]] << k for k < 64, so it is computed from the block
+    and the 63 bytes before it, by doubling the summed window: 1, 2, 4, ... 64 bytes
+    """
+    offset = max(first, start - (_WINDOW - 1))
+    hashes = numpy.take(_GEAR_ARRAY, numpy.frombuffer(data, dtype=numpy.uint8, count=end - offset, offset=offset))
+    width = 1
+    while width < _WINDOW:
+        # The sums overflow the same way the loop masks them to 64 bits
+        hashes[width:] += hashes[:-width] << numpy.uint64(width)
+        width *= 2
+    return hashes[start - offset:]
+
+
+def _scan_blocks(data: bytes or bytearray, first: int, normal: int, end: int, mask_s: int, mask_l: int) -> int:
+    """
+    find_boundary with numpy: hashes are computed block by block, starting at data[first]
+    """
+    start = first
+    while start < end:
+        block_end = min(start + SCAN_BLOCK_SIZE, end)
+        hashes = _gear_hashes(data, first, start, block_end)
+        split = min(max(normal - start, 0), len(hashes))
+        for part, mask, base in ((hashes[:split], mask_s, start), (hashes[split:], mask_l, start + split)):
+            found = numpy.flatnonzero((part & numpy.uint64(mask)) == 0)
+            if len(found):
+                return base + int(found[0]) + 1
+        start = block_end
+    return end
+
+
+def iter_chunks(f: BinaryIO, min_size: int = MIN_CHUNK_SIZE, avg_size: int = AVG_CHUNK_SIZE,
+                max_size: int = MAX_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Reads the file and yields its content-defined chunks. At most max_size + READ_SIZE bytes are kept in memory
+    :param f: binary file-like object
+    :return: generator of chunks
+    """
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < max_size:
+            data = f.read(READ_SIZE)
+            if not data:
+                eof = True
+            buffer += data
+        if not buffer:
+            return
+
+        # Unless the file has ended, there is at least max_size bytes in the buffer, so the boundary is not premature
+        boundary = find_boundary(buffer, 0, len(buffer), min_size, avg_size, max_size)
+        yield bytes(buffer[:boundary])
+        del buffer[:boundary]
@@ -0,0 +1,182 @@
+# Deduplicating backup engine
+# A backup is a snapshot: a list of files of the resource, each described by the hashes of its chunks.
+# Only chunks that the chunk store doesn't have yet are uploaded. Files are chunked and hashed on a pool
+# of processes, and only the chunks that have to be uploaded are read once more
+import json
+import os
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Iterator, List, Tuple
+
+from archive.extract import member_path
+from archive.parallel import process_context
+
+from dedup.chunk_store import ChunkStore
+from dedup.chunker import iter_chunks, chunk_id
+from database.stat_cache import StatCache
+from scanner.walk import walk
+
+SNAPSHOT_FORMAT = 1
+# How many files are sent to a chunking process at once
+FILES_PER_TASK = 16
+# How many tasks are queued for every chunking process, so the hashes of a large tree are not all held at once
+TASKS_AHEAD_PER_WORKER = 2
+
+
+def _walk(resource_path: str, cache: StatCache or None = None):
+    """
+    Yields (local path, name in the snapshot, is_dir), using the archive layout:
+    a file is stored under its name, a directory relative to itself
+    """
+    if os.path.isfile(resource_path):
+        yield resource_path, os.path.basename(os.path.abspath(resource_path)), False
+        return
+
+    for dirpath, dirnames, filenames in walk(resource_path, cache=cache):
+        for name in sorted(dirnames):
+            path = os.path.join(dirpath, name)
+            yield path, os.path.relpath(path, resource_path).replace(os.sep, '/'), True
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            yield path, os.path.relpath(path, resource_path).replace(os.sep, '/'), False
+
+
+def _chunk_file(path: str) -> List[Tuple[str, int]]:
+    """
+    Splits the file into chunks and returns their hashes and sizes, the chunks themselves are not kept
+    """
+    with open(path, 'rb') as f:
+        return [(chunk_id(chunk), len(chunk)) for chunk in iter_chunks(f)]
+
+
+def _chunk_files(paths: List[str]) -> List[List[Tuple[str, int]]]:
+    return [_chunk_file(path) for path in paths]
+
+
+def _chunk_in_batches(paths: List[str], executor: ProcessPoolExecutor, workers: int) -> Iterator[List[Tuple[str, int]]]:
+    """
+    Yields the hashes and sizes of the chunks of every file, in the order of paths. The files are sent to the processes
+    FILES_PER_TASK at once, and the next tasks are submitted only as the results are taken
+    """
+    ahead: Deque[Future] = deque()
+    try:
+        for start in range(0, len(paths), FILES_PER_TASK):
+            ahead.append(executor.submit(_chunk_files, paths[start:start + FILES_PER_TASK]))
+            if len(ahead) >= workers * TASKS_AHEAD_PER_WORKER:
+                yield from ahead.popleft().result()
+        while ahead:
+            yield from ahead.popleft().result()
+    finally:
+        for future in ahead:
+            future.cancel()
+
+
+def _put_chunks(f, store: ChunkStore) -> List[Tuple[str, int]]:
+    """
+    Splits the file into chunks and puts them to the store
+    :return: hashes and sizes of the chunks
+    """
+    chunks = []
+    for chunk in iter_chunks(f):
+        chunk_hash = chunk_id(chunk)
+        store.put(chunk_hash, chunk)
+        chunks.append((chunk_hash, len(chunk)))
+    return chunks
+
+
+def _put_missing_chunks(path: str, chunks: List[Tuple[str, int]], store: ChunkStore) -> List[Tuple[str, int]]:
+    """
+    Puts the chunks of the file that the store doesn't have, only they are read
+    :param chunks: hashes and sizes of the chunks, as _chunk_file returns them
+    :return: hashes and sizes of the chunks of the file
+    """
+    with open(path, 'rb') as f:
+        offset = 0
+        for chunk_hash, size in chunks:
+            if not store.skip_known(chunk_hash, size):
+                f.seek(offset)
+                chunk = f.read(size)
+                if chunk_id(chunk) != chunk_hash:
+                    # The file has changed since it was chunked, it is chunked again as it is now
+                    f.seek(0)
+                    return _put_chunks(f, store)
+                store.put(chunk_hash, chunk)
+            offset += size
+    return chunks
+
+
+def backup_resource(resource_path: str, store: ChunkStore, cache: StatCache or None = None,
+                    workers: int or None = 1) -> dict:
+    """
+    Splits every file of the resource into chunks, puts them to the store and returns the snapshot
+    :param resource_path: A local path to the file or directory
+    :param store: ChunkStore
+    :param cache: Where to take the listings of unchanged directories from, see scanner.walk
+    :param workers: How many processes to chunk the files with, None for the number of CPUs
+    :return: snapshot
+    """
+    entries = list(_walk(resource_path, cache))
+    paths = [path for path, _, is_dir in entries if not is_dir]
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=process_context()) if workers != 1 else None
+    dirs = []
+    files = []
+    try:
+        if executor is not None:
+            chunked = _chunk_in_batches(paths, executor, workers)
+        else:
+            chunked = map(_chunk_file, paths)
+        for path, name, is_dir in entries:
+            if is_dir:
+                dirs.append(name)
+                continue
+            chunks = _put_missing_chunks(path, next(chunked), store)
+            files.append({'name': name, 'size': sum(size for _, size in chunks),
+                          'chunks': [chunk_hash for chunk_hash, _ in chunks]})
+    finally:
+        if executor is not None:
+            chunked.close()
+            executor.shutdown(cancel_futures=True)
+        store.close()
+    return {'format': SNAPSHOT_FORMAT, 'dirs': dirs, 'files': files}
+
+
+def restore_snapshot(snapshot: dict, store: ChunkStore, target: str) -> str:
+    """
+    Rebuilds the files of the snapshot in the target directory
+    :return: target
+    """
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f'Unsupported snapshot format: {snapshot.get("format")}')
+
+    os.makedirs(target, exist_ok=True)
+    # Names come from the remote snapshot, '..' and absolute parts are dropped so files stay inside the target
+    for name in snapshot['dirs']:
+        os.makedirs(member_path(target, name), exist_ok=True)
+    # Chunks of all files are downloaded in one ordered stream, so the workers of the store are busy across files
+    chunks = store.get_many(chunk_hash for file in snapshot['files'] for chunk_hash in file['chunks'])
+    try:
+        for file in snapshot['files']:
+            path = member_path(target, file['name'])
+            if path == target:
+                raise ValueError(f'A file of the snapshot has no name: {file["name"]!r}')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                for chunk_hash in file['chunks']:
+                    chunk = next(chunks)
+                    if chunk_id(chunk) != chunk_hash:
+                        raise ValueError(f'Chunk {chunk_hash} of {file["name"]} is corrupted')
+                    f.write(chunk)
+    finally:
+        chunks.close()
+        store.close()
+    return target
+
+
+def dumps(snapshot: dict) -> bytes:
+    return json.dumps(snapshot, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data: bytes) -> dict:
+    return json.loads(data)
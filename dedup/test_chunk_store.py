@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cloud_storages.local.local import LocalStorage
+from database.database import Database
+from dedup.chunk_store import ChunkStore
+from dedup.chunker import chunk_id
+
+
+class ChunkStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp, 'remote'))
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.tmp)
+
+    def _store(self, database: Database = None) -> ChunkStore:
+        return ChunkStore(LocalStorage(os.path.join(self.tmp, 'remote')), '/chunks', database or self.database,
+                          'local', workers=2)
+
+    def test_chunks_uploaded_by_another_process_are_skipped(self):
+        chunks = [os.urandom(1000) for _ in range(10)]
+        first = self._store()
+        # Another process has its own connection to the same database
+        second = self._store(Database(self.database.db_path))
+        for chunk in chunks[:5]:
+            first.put(chunk_id(chunk), chunk)
+        first.flush()
+        for chunk in chunks:
+            second.put(chunk_id(chunk), chunk)
+        second.flush()
+        self.assertEqual(5000, second.skipped_bytes)
+        self.assertTrue(all(first.has(chunk_id(chunk)) for chunk in chunks))
+        self.assertEqual(chunks, list(first.get_many(chunk_id(chunk) for chunk in chunks)))
+
+    def test_closed_store_stops_its_threads_and_can_be_used_again(self):
+        chunks = [os.urandom(1000) for _ in range(10)]
+        threads = threading.active_count()
+        with self._store() as store:
+            for chunk in chunks:
+                store.put(chunk_id(chunk), chunk)
+        self.assertEqual(10000, store.uploaded_bytes)
+        self.assertEqual(threads, threading.active_count())
+
+        self.assertEqual(chunks, list(store.get_many(chunk_id(chunk) for chunk in chunks)))
+        store.close()
+        self.assertEqual(threads, threading.active_count())
+
+    def test_index_of_older_versions_is_migrated(self):
+        self.database.set('chunks:local', ['a' * 64, 'b' * 64])
+        store = self._store()
+        self.assertTrue(store.has('a' * 64))
+        self.assertFalse(store.has('c' * 64))
+        self.assertFalse(self.database.get('chunks:local'))
+
+
+if __name__ == '__main__':
+    unittest.main()
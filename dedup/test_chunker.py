@@ -0,0 +1,52 @@
+import io
+import random
+import time
+import unittest
+
+from unittest import mock
+
+from dedup import chunker
+from dedup.chunker import iter_chunks
+
+SIZES = dict(min_size=2 * 1024, avg_size=8 * 1024, max_size=32 * 1024)
+
+
+class ChunkerTests(unittest.TestCase):
+    def setUp(self):
+        self.data = random.Random(42).randbytes(512 * 1024)
+
+    def test_chunks_make_up_the_data(self):
+        chunks = list(iter_chunks(io.BytesIO(self.data), **SIZES))
+        self.assertEqual(self.data, b''.join(chunks))
+        self.assertTrue(all(len(c) <= SIZES['max_size'] for c in chunks))
+        self.assertTrue(all(len(c) >= SIZES['min_size'] for c in chunks[:-1]))
+
+    def test_insertion_changes_only_nearby_chunks(self):
+        edited = self.data[:100000] + b'insertion' + self.data[100000:]
+        before = list(iter_chunks(io.BytesIO(self.data), **SIZES))
+        after = list(iter_chunks(io.BytesIO(edited), **SIZES))
+        self.assertLessEqual(len(set(after) - set(before)), 2)
+
+    def test_empty_file_has_no_chunks(self):
+        self.assertEqual([], list(iter_chunks(io.BytesIO(b''), **SIZES)))
+
+    @unittest.skipUnless(chunker.numpy, 'numpy is not installed')
+    def test_numpy_finds_the_same_boundaries(self):
+        for sizes in [SIZES, dict(min_size=64, avg_size=256, max_size=1024)]:
+            with_numpy = list(iter_chunks(io.BytesIO(self.data), **sizes))
+            with mock.patch.object(chunker, 'numpy', None):
+                without_numpy = list(iter_chunks(io.BytesIO(self.data), **sizes))
+            self.assertEqual(without_numpy, with_numpy)
+
+    @unittest.skipUnless(chunker.numpy, 'numpy is not installed')
+    def test_throughput(self):
+        data = random.Random(7).randbytes(16 * 1024 * 1024)
+        started = time.perf_counter()
+        for _ in iter_chunks(io.BytesIO(data)):
+            pass
+        # About 150 Mb/s here, the loop over the bytes makes about 7
+        self.assertGreater(len(data) / (time.perf_counter() - started) / 1024 / 1024, 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
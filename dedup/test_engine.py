@@ -0,0 +1,101 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+from concurrent.futures import Future
+from unittest import mock
+
+from cloud_storages.local.local import LocalStorage
+from database.database import Database
+from dedup import engine
+from dedup.chunk_store import ChunkStore
+
+
+class EngineTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, 'resource')
+        os.makedirs(os.path.join(self.root, 'sub', 'empty'))
+        rng = random.Random(3)
+        self.big = rng.randbytes(3 * 1024 * 1024)
+        with open(os.path.join(self.root, 'big.bin'), 'wb') as f:
+            f.write(self.big)
+        # The same content again, its chunks are uploaded once
+        with open(os.path.join(self.root, 'sub', 'copy.bin'), 'wb') as f:
+            f.write(self.big)
+        for i in range(40):
+            with open(os.path.join(self.root, 'sub', f'{i}.txt'), 'wb') as f:
+                f.write(rng.randbytes(i * 100))
+        os.makedirs(os.path.join(self.tmp, 'remote'))
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.tmp)
+
+    def _store(self) -> ChunkStore:
+        return ChunkStore(LocalStorage(os.path.join(self.tmp, 'remote')), '/chunks', self.database, 'local')
+
+    def test_chunking_processes_make_the_same_snapshot(self):
+        store = self._store()
+        snapshot = engine.backup_resource(self.root, store, workers=2)
+        self.assertEqual(len(self.big) + sum(i * 100 for i in range(40)), store.uploaded_bytes)
+        self.assertEqual(len(self.big), store.skipped_bytes)
+        self.assertEqual(snapshot, engine.backup_resource(self.root, self._store(), workers=1))
+
+        target = engine.restore_snapshot(snapshot, self._store(), os.path.join(self.tmp, 'restored'))
+        self.assertTrue(os.path.isdir(os.path.join(target, 'sub', 'empty')))
+        with open(os.path.join(target, 'sub', 'copy.bin'), 'rb') as f:
+            self.assertEqual(self.big, f.read())
+
+    def test_unchanged_resource_uploads_nothing(self):
+        engine.backup_resource(self.root, self._store(), workers=2)
+        store = self._store()
+        engine.backup_resource(self.root, store, workers=2)
+        self.assertEqual(0, store.uploaded_bytes)
+
+    def test_store_threads_are_stopped_after_backup_and_restore(self):
+        threads = threading.active_count()
+        store = self._store()
+        snapshot = engine.backup_resource(self.root, store, workers=1)
+        self.assertEqual(threads, threading.active_count())
+        engine.restore_snapshot(snapshot, store, os.path.join(self.tmp, 'restored'))
+        self.assertEqual(threads, threading.active_count())
+
+    def test_chunking_tasks_are_submitted_as_the_results_are_taken(self):
+        submitted = []
+
+        class _Executor:
+            def submit(self, fn, *args):
+                submitted.append(args[0])
+                future = Future()
+                future.set_result(fn(*args))
+                return future
+
+        paths = [f'{i}.bin' for i in range(100)]
+        with mock.patch.object(engine, '_chunk_files', lambda batch: [[(path, 1)] for path in batch]):
+            chunked = engine._chunk_in_batches(paths, _Executor(), workers=2)
+            self.assertEqual([('0.bin', 1)], next(chunked))
+            # Two tasks per process are queued, not all of them
+            self.assertEqual(2 * engine.TASKS_AHEAD_PER_WORKER, len(submitted))
+            self.assertEqual(paths[1:], [chunks[0][0] for chunks in chunked])
+        self.assertEqual(paths, [path for batch in submitted for path in batch])
+        self.assertTrue(all(len(batch) <= engine.FILES_PER_TASK for batch in submitted))
+
+    def test_names_of_the_snapshot_stay_inside_the_target(self):
+        store = self._store()
+        snapshot = engine.backup_resource(os.path.join(self.root, 'sub', '1.txt'), store)
+        snapshot['dirs'] = ['../outside']
+        snapshot['files'][0]['name'] = '../../escaped.txt'
+        target = engine.restore_snapshot(snapshot, store, os.path.join(self.tmp, 'restored', 'here'))
+        self.assertTrue(os.path.isdir(os.path.join(target, 'outside')))
+        self.assertTrue(os.path.isfile(os.path.join(target, 'escaped.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'escaped.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'restored', 'outside')))
+
+
+if __name__ == '__main__':
+    unittest.main()
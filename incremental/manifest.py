@@ -0,0 +1,159 @@
+# File manifests for incremental backups
+# A manifest describes every file of the resource at the moment of the backup and tells in which version
+# the content of each file was uploaded, so any version can be rebuilt from its own manifest
+import hashlib
+import json
+import os
+
+from typing import Dict, Iterable, List, Tuple
+
+from database.stat_cache import StatCache
+from scanner.walk import walk
+
+MANIFEST_NAME = '.savezone-manifest.json'
+MANIFEST_FORMAT = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _walk_files(resource_path: str, cache: StatCache or None = None) -> List[Tuple[str, str, os.stat_result]]:
+    """
+    Lists the files of the resource as (local path, path inside the backup, stat result) triples.
+    Paths inside the backup follow the archive layout: a file is stored under its name, a directory relative to itself
+    """
+    if os.path.isfile(resource_path):
+        return [(resource_path, os.path.basename(os.path.abspath(resource_path)), os.stat(resource_path))]
+
+    result = []
+    for directory in walk(resource_path, cache=cache, stat=True):
+        for name in directory.filenames:
+            path = os.path.join(directory.path, name)
+            result.append((path, os.path.relpath(path, resource_path).replace(os.sep, '/'), directory.stats.get(name)))
+    return result
+
+
+def local_path(resource_path: str, name: str) -> str:
+    """
+    Returns the local path of the file that is stored in the manifest under name
+    """
+    if os.path.isfile(resource_path):
+        return resource_path
+    return os.path.join(resource_path, *name.split('/'))
+
+
+def scan(resource_path: str, previous: dict or None = None, cache: StatCache or None = None) -> dict:
+    """
+    Builds a manifest of the resource without versions. A file is hashed only if its size, mtime or inode
+    differ from the previous manifest, otherwise the previous hash is reused
+    :param resource_path: A local path to the file or directory
+    :param previous: the manifest of the previous backup, if any
+    :param cache: Where to take the listings of unchanged directories from, see scanner.walk
+    :return: manifest
+    """
+    previous_files = previous['files'] if previous else {}
+    files = {}
+    for path, name, stat in _walk_files(resource_path, cache):
+        files[name] = _file_entry(path, previous_files.get(name), stat)
+    return {'format': MANIFEST_FORMAT, 'version': None, 'base': None, 'files': files}
+
+
+def _file_entry(path: str, known: dict or None, stat: os.stat_result or None = None) -> dict:
+    stat = stat or os.stat(path)
+    entry = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'inode': stat.st_ino,
+    }
+    if known and all(known[k] == entry[k] for k in ('size', 'mtime', 'inode')):
+        entry['sha256'] = known['sha256']
+    else:
+        entry['sha256'] = _hash_file(path)
+    return entry
+
+
+def update(resource_path: str, previous: dict, changed_paths: Iterable[str]) -> dict:
+    """
+    Builds a manifest of the resource from the previous one, looking only at the paths that are known to have changed,
+    e.g. by file system events. A changed file is checked as by scan, a changed directory is scanned as a whole,
+    a path that is gone is dropped along with everything under it
+    :param resource_path: A local path to the file or directory
+    :param previous: the manifest of the previous backup
+    :param changed_paths: local paths under resource_path, paths outside of it are skipped
+    :return: manifest
+    """
+    previous_files = previous['files']
+    files = {name: {k: v for k, v in entry.items() if k != 'version'} for name, entry in previous_files.items()}
+    root = os.path.abspath(resource_path)
+    for path in changed_paths:
+        path = os.path.abspath(path)
+        if os.path.isfile(root):
+            if path != root:
+                continue
+            name = os.path.basename(root)
+        else:
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            if name == '..' or name.startswith('../'):
+                continue
+
+        # Whatever was under the path is found again below, if it is still there
+        if name == '.':
+            files.clear()
+        else:
+            for known in [n for n in files if n == name or n.startswith(name + '/')]:
+                del files[known]
+
+        if os.path.isfile(path):
+            files[name] = _file_entry(path, previous_files.get(name))
+        elif os.path.isdir(path):
+            for file_path, relative, stat in _walk_files(path):
+                file_name = relative if name == '.' else f'{name}/{relative}'
+                files[file_name] = _file_entry(file_path, previous_files.get(file_name), stat)
+    return {'format': MANIFEST_FORMAT, 'version': None, 'base': None, 'files': files}
+
+
+def apply_version(current: dict, previous: dict or None, version: str) -> List[str]:
+    """
+    Assigns the version to the manifest. Files that are new or whose content has changed get the new version,
+    unchanged files keep the version of the previous manifest
+    :return: a list of files that have to be uploaded with this version
+    """
+    previous_files = previous['files'] if previous else {}
+    changed = []
+    for name, entry in current['files'].items():
+        known = previous_files.get(name)
+        if known and known['sha256'] == entry['sha256']:
+            entry['version'] = known['version']
+        else:
+            entry['version'] = version
+            changed.append(name)
+    current['version'] = version
+    current['base'] = previous['version'] if previous else None
+    return changed
+
+
+def files_by_version(manifest: dict) -> Dict[str, List[str]]:
+    """
+    Groups the files of the manifest by the version that holds their content
+    """
+    result = {}
+    for name, entry in manifest['files'].items():
+        result.setdefault(entry['version'], []).append(name)
+    return result
+
+
+def dumps(manifest: dict) -> bytes:
+    return json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data: bytes) -> dict:
+    manifest = json.loads(data)
+    if manifest.get('format') != MANIFEST_FORMAT:
+        raise ValueError(f'Unsupported manifest format: {manifest.get("format")}')
+    return manifest
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from incremental import manifest as manifests
+
+
+class ManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'sub'))
+        self._write('a.txt', b'a')
+        self._write('sub/b.txt', b'b')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, name: str, content: bytes):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(content)
+
+    def test_first_version_uploads_everything(self):
+        manifest = manifests.scan(self.root)
+        changed = manifests.apply_version(manifest, None, 'v1')
+        self.assertEqual(['a.txt', 'sub/b.txt'], sorted(changed))
+        self.assertIsNone(manifest['base'])
+
+    def test_next_version_uploads_only_changes(self):
+        first = manifests.scan(self.root)
+        manifests.apply_version(first, None, 'v1')
+        first = manifests.loads(manifests.dumps(first))
+
+        self._write('sub/b.txt', b'changed')
+        self._write('c.txt', b'c')
+        os.unlink(os.path.join(self.root, 'a.txt'))
+
+        second = manifests.scan(self.root, first)
+        changed = manifests.apply_version(second, first, 'v2')
+
+        self.assertEqual(['c.txt', 'sub/b.txt'], sorted(changed))
+        self.assertEqual('v1', second['base'])
+        self.assertEqual({'v2': ['sub/b.txt', 'c.txt']},
+                         {k: sorted(v, reverse=True) for k, v in manifests.files_by_version(second).items()})
+
+    def test_unchanged_files_keep_their_version(self):
+        first = manifests.scan(self.root)
+        manifests.apply_version(first, None, 'v1')
+        self._write('c.txt', b'c')
+
+        second = manifests.scan(self.root, first)
+        manifests.apply_version(second, first, 'v2')
+
+        self.assertEqual(['a.txt', 'sub/b.txt'], sorted(manifests.files_by_version(second)['v1']))
+        self.assertEqual(['c.txt'], manifests.files_by_version(second)['v2'])
+
+    def test_update_looks_only_at_changed_paths(self):
+        first = manifests.scan(self.root)
+        manifests.apply_version(first, None, 'v1')
+
+        self._write('a.txt', b'changed')
+        os.makedirs(os.path.join(self.root, 'new'))
+        self._write('new/d.txt', b'd')
+        shutil.rmtree(os.path.join(self.root, 'sub'))
+        # Not reported, so not seen until the next full scan
+        self._write('e.txt', b'e')
+
+        changed_paths = [os.path.join(self.root, name) for name in ('a.txt', 'new', 'sub/b.txt', 'sub')]
+        second = manifests.update(self.root, first, changed_paths + ['/elsewhere/f.txt'])
+        changed = manifests.apply_version(second, first, 'v2')
+
+        self.assertEqual(['a.txt', 'new/d.txt'], sorted(changed))
+        self.assertEqual(['a.txt', 'new/d.txt'], sorted(second['files']))
+        self.assertEqual(sorted(manifests.scan(self.root)['files']), ['a.txt', 'e.txt', 'new/d.txt'])
+        self.assertEqual('v1', first['files']['a.txt']['version'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# Digests of backups
+# MD5 and SHA-256 of a backup are computed over its bytes while they pass on their way to or from the storage,
+# so checking a backup never takes another read of it. MD5 is compared with what the storage reports,
+# SHA-256 is kept locally and checked on restore
+import hashlib
+
+from typing import BinaryIO, Iterable, Iterator
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class Digests:
+    """MD5, SHA-256 and the size of the bytes it was updated with"""
+
+    def __init__(self):
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def update(self, data: bytes) -> None:
+        self._md5.update(data)
+        self._sha256.update(data)
+        self.size += len(data)
+
+    @property
+    def md5(self) -> str:
+        return self._md5.hexdigest()
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+    def to_dict(self) -> dict:
+        return {'size': self.size, 'md5': self.md5, 'sha256': self.sha256}
+
+    def check(self, expected: dict, what: str) -> None:
+        check(self.to_dict(), expected, what)
+
+
+def check(actual: dict, expected: dict, what: str) -> None:
+    """
+    Compares the digests with the expected ones, a digest that is missing on either side is not compared
+    :param actual: {'size': ..., 'md5': ..., 'sha256': ...}
+    :param expected: the same, any of them can be missing or None
+    :param what: what is checked, for the error message
+    :raises: ValueError on a mismatch
+    """
+    for key in ('size', 'md5', 'sha256'):
+        value, expected_value = actual.get(key), expected.get(key)
+        if value is not None and expected_value is not None and str(value).lower() != str(expected_value).lower():
+            raise ValueError(f'{what} is corrupted: {key} is {value}, expected {expected_value}')
+
+
+def hashed(stream: Iterable[bytes], digests: Digests) -> Iterator[bytes]:
+    """
+    Passes the chunks of the stream through, updating the digests with them
+    """
+    for chunk in stream:
+        digests.update(chunk)
+        yield chunk
+
+
+def file_digests(path: str, block_size: int = HASH_BLOCK_SIZE) -> Digests:
+    digests = Digests()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digests.update(block)
+    return digests
+
+
+class HashingWriter:
+    """
+    A write-only file-like object that updates the digests with the bytes on their way to fileobj.
+    It can't tell or seek, so archives are written to it the same way as to a pipe
+    """
+
+    def __init__(self, fileobj: BinaryIO, digests: Digests):
+        self.fileobj = fileobj
+        self.digests = digests
+
+    def write(self, data: bytes) -> int:
+        self.digests.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self) -> None:
+        self.fileobj.flush()
+
+
+class VerifyingReader:
+    """
+    Reads the stream, updating the digests with every byte, and checks them when the stream ends.
+    Fails as soon as the stream turns out to be longer than expected, without waiting for its end
+    """
+
+    def __init__(self, stream: BinaryIO, expected: dict, what: str):
+        """
+        :param expected: {'size': ..., 'md5': ..., 'sha256': ...} of the whole stream
+        :param what: what is read, for the error message
+        """
+        self.stream = stream
+        self.expected = expected
+        self.what = what
+        self.digests = Digests()
+        self.verified = False
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.digests.update(data)
+        expected_size = self.expected.get('size')
+        if expected_size is not None and self.digests.size > expected_size:
+            raise ValueError(f'{self.what} is corrupted: it is longer than {expected_size} bytes')
+        if not data and size != 0 and not self.verified:
+            self.digests.check(self.expected, self.what)
+            self.verified = True
+        return data
+
+    def tell(self) -> int:
+        return self.digests.size
+
+    def finish(self) -> None:
+        """
+        Reads the rest of the stream, e.g. what an unpacker didn't need, and checks the digests
+        :raises: ValueError on a mismatch
+        """
+        while self.read(HASH_BLOCK_SIZE):
+            pass
+
+    def close(self) -> None:
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,56 @@
+import hashlib
+import io
+import unittest
+import zipfile
+
+from integrity.digests import Digests, HashingWriter, VerifyingReader, hashed
+
+
+class DigestsTests(unittest.TestCase):
+    def setUp(self):
+        self.data = bytes(range(256)) * 1000
+        self.expected = {
+            'size': len(self.data),
+            'md5': hashlib.md5(self.data).hexdigest(),
+            'sha256': hashlib.sha256(self.data).hexdigest(),
+        }
+
+    def test_hashed_stream(self):
+        digests = Digests()
+        chunks = [self.data[i:i + 1000] for i in range(0, len(self.data), 1000)]
+        self.assertEqual(self.data, b''.join(hashed(chunks, digests)))
+        self.assertEqual(self.expected, digests.to_dict())
+        digests.check({'md5': self.expected['md5'].upper(), 'sha256': None}, 'stream')
+        with self.assertRaises(ValueError):
+            digests.check({'sha256': '0' * 64}, 'stream')
+
+    def test_hashing_writer_is_not_seekable(self):
+        digests = Digests()
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(HashingWriter(buffer, digests), 'w') as zf:
+            zf.writestr('a.bin', self.data)
+        self.assertEqual(hashlib.sha256(buffer.getvalue()).hexdigest(), digests.sha256)
+        with zipfile.ZipFile(io.BytesIO(buffer.getvalue())) as zf:
+            self.assertEqual(self.data, zf.read('a.bin'))
+
+    def test_verifying_reader(self):
+        reader = VerifyingReader(io.BytesIO(self.data), self.expected, 'backup')
+        self.assertEqual(self.data[:100], reader.read(100))
+        reader.finish()
+        self.assertTrue(reader.verified)
+        self.assertEqual(len(self.data), reader.tell())
+
+        corrupted = bytearray(self.data)
+        corrupted[-1] ^= 1
+        with self.assertRaises(ValueError):
+            VerifyingReader(io.BytesIO(bytes(corrupted)), self.expected, 'backup').finish()
+
+    def test_verifying_reader_fails_on_extra_bytes(self):
+        reader = VerifyingReader(io.BytesIO(self.data + b'x' * 10), self.expected, 'backup')
+        reader.read(len(self.data))
+        with self.assertRaises(ValueError):
+            reader.read(10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,21 +1,47 @@
 # Handles the input, uses typer as a framework
 # https://github.com/tiangolo/typer
 
+import asyncio
+
 import savezone
+import savezone_async
 import typer
 import webbrowser
 
-from database.database import Database
+from contextlib import contextmanager
+
+from cloud_storages.storage import DELETE_WORKERS
+from metrics.recorder import RunMetrics
 from models.models import StorageMetaInfo, Backup
-from typing import Optional, List
+from typing import Iterator, Optional, List
 
 from oauth_handler.app import launch_oauth_handler_app
+from retention.planner import RetentionPolicy
 from storage_registry import get_storage_true_name, get_storage_by_name
-from templates import display_metainfo, display_exception, display_resource, display_backup_list
+from templates import display_metainfo, display_exception, display_resource, display_backup_list, \
+    display_batch_results, display_catalog, display_prune_plan
 
 app = typer.Typer()
 
 
+@contextmanager
+def _recording(command: str, storage_name: str, metrics_file: str or None) -> Iterator[RunMetrics]:
+    """
+    Records the metrics of the command and writes them to metrics_file, also when the command fails
+    """
+    metrics = RunMetrics(command, get_storage_true_name(storage_name))
+    try:
+        yield metrics
+    except BaseException as e:
+        metrics.finish(e)
+        raise
+    else:
+        metrics.finish()
+    finally:
+        if metrics_file:
+            metrics.write(metrics_file)
+
+
 @app.command()
 def auth(
     storage_name: str = typer.Option('yandex', '-s'),
@@ -25,7 +51,7 @@ def auth(
     # Check if storage has custom auth setup by checking the auth attribute. If no custom auth is specified -> run OAuth
     use_custom_auth = callable(getattr(storage, "auth", None))
     if use_custom_auth:
-        database = Database()
+        database = savezone._database()
         storage.auth(database)
         print('You can start using the utility now...')
         exit(0)
@@ -34,7 +60,7 @@ def auth(
         webbrowser.open(storage.get_oauth_request_url())
         print('Please continue in web browser')
         # Start flask web server as daemon
-        database = Database()
+        database = savezone._database()
         launch_oauth_handler_app(database, storage_name)
         exit(0)
 
@@ -45,7 +71,14 @@ def backup(
     storage_name: str = typer.Option('yandex', '-s'),
     target: str = typer.Option('/', '-t'),
     token: str or None = None,
-    overwrite: bool = typer.Option(False, '-o')
+    overwrite: bool = typer.Option(False, '-o'),
+    stream: bool = typer.Option(False, '--stream'),
+    incremental: bool = typer.Option(False, '-i', '--incremental'),
+    dedup: bool = typer.Option(False, '-d', '--dedup'),
+    codec: str = typer.Option(savezone.DEFAULT_CODEC, '-c', '--codec'),
+    level: Optional[int] = typer.Option(None, '--level'),
+    workers: Optional[int] = typer.Option(None, '-w', '--workers'),
+    metrics_file: Optional[str] = typer.Option(None, '--metrics-file'),
 ) -> None:
     """
     Backs the resource in the storage name \r\n
@@ -53,28 +86,112 @@ def backup(
     :param storage_name: the name of the storage
     :param target: A path on the remote storage to save to, defaults to '/'
     :param oauth: An access token to the storage
+    :param stream: Upload the archive while it is being made, no temp file is written
+    :param incremental: Upload only the files that changed since the last incremental backup
+    :param dedup: Upload only the chunks of the resource that are not on the storage yet
+    :param codec: A compression codec: store, deflate, bzip2, lzma, zstd or lz4
+    :param level: A compression level of the codec
+    :param workers: How many processes to compress or chunk with, defaults to the number of CPUs
+    :param metrics_file: Write durations, bytes and requests of the phases here, as a Prometheus textfile
+                         if the name ends with .prom, as JSON otherwise
     :return:
     """
-    saved_resource: Backup = savezone.backup(resource, target, storage_name, token, overwrite)
+    with _recording('backup', storage_name, metrics_file) as metrics:
+        saved_resource: Backup = savezone.backup(resource, target, storage_name, token, overwrite, stream,
+                                                 incremental, dedup, codec, level, workers, metrics)
     display_resource(saved_resource.versions[0], storage_name)
 
 
+@app.command()
+def watch(
+    resources: List[str],
+    storage_name: str = typer.Option('yandex', '-s'),
+    token: str or None = None,
+    codec: str = typer.Option(savezone.DEFAULT_CODEC, '-c', '--codec'),
+    level: Optional[int] = typer.Option(None, '--level'),
+    debounce: float = typer.Option(savezone.DEBOUNCE, '--debounce'),
+    max_delay: float = typer.Option(savezone.MAX_DELAY, '--max-delay'),
+    reconcile: float = typer.Option(savezone.RECONCILE_INTERVAL / 60, '--reconcile'),
+) -> None:
+    """
+    Keeps the resources backed up in the storage: changed files are uploaded as incremental backups
+    minutes after they change. Runs until interrupted \r\n
+    :param resources: Paths to the files or directories to watch
+    :param storage_name: the name of the storage
+    :param codec: A compression codec: store, deflate, bzip2, lzma, zstd or lz4
+    :param level: A compression level of the codec
+    :param debounce: Seconds without changes after which the changes are backed up
+    :param max_delay: Seconds after which the changes are backed up even if the files keep changing
+    :param reconcile: Minutes between full scans, they catch the changes that were missed
+    """
+    try:
+        savezone.watch(resources, storage_name, token, codec, level, debounce, max_delay, reconcile * 60)
+    except KeyboardInterrupt:
+        pass
+
+
+@app.command()
+def batch(
+    resources: Optional[List[str]] = typer.Argument(None),
+    job_file: Optional[str] = typer.Option(None, '-f'),
+    storage_name: str = typer.Option('yandex', '-s'),
+    token: str or None = None,
+    overwrite: bool = typer.Option(False, '-o'),
+    archive_workers: Optional[int] = typer.Option(None, '--archive-workers'),
+    uploads_per_storage: int = typer.Option(savezone.UPLOADS_PER_STORAGE, '--uploads-per-storage'),
+    codec: str = typer.Option(savezone.DEFAULT_CODEC, '-c', '--codec'),
+    level: Optional[int] = typer.Option(None, '--level'),
+    metrics_file: Optional[str] = typer.Option(None, '--metrics-file'),
+) -> None:
+    """
+    Backs up many resources at once \r\n
+    :param resources: Paths to the resources
+    :param job_file: A file with a path to the resource on every line, optionally followed by a tab and a storage name
+    :param storage_name: the name of the storage for the resources that don't name one
+    :param archive_workers: How many resources to archive at once, defaults to the number of CPUs
+    :param uploads_per_storage: How many uploads to run at once to one storage
+    :param codec: A compression codec: store, deflate, bzip2, lzma, zstd or lz4
+    :param level: A compression level of the codec
+    :param metrics_file: Write durations, bytes and requests of the phases of all the jobs here, as for backup
+    :return:
+    """
+    jobs = [(resource, storage_name) for resource in resources or []]
+    if job_file:
+        jobs += [(resource, job_storage or storage_name) for resource, job_storage in savezone.read_job_file(job_file)]
+    with _recording('batch', storage_name, metrics_file) as metrics:
+        results = savezone.backup_batch(jobs, token, overwrite, archive_workers, uploads_per_storage, codec,
+                                        level, metrics)
+    display_batch_results(results)
+    if not all(result.ok for result in results):
+        raise typer.Exit(1)
+
+
 @app.command()
 def restore(
     resource_id: str,
     storage_name: str = typer.Option('yandex', '-s'),
     target: str = typer.Option(None, '-t'),
     token: str or None = None,
+    segments: int = typer.Option(1, '-j', '--segments'),
+    members: Optional[List[str]] = typer.Option(None, '-m', '--member'),
+    workers: int = typer.Option(savezone.EXTRACT_WORKERS, '-w', '--workers'),
+    metrics_file: Optional[str] = typer.Option(None, '--metrics-file'),
 ) -> None:
     """
     Restores resource from storage \r\n
     :param resource: A path to the resource
     :param storage_name: the name of the storage
-    :param target: A path on the local storage to save to, defaults to './restored'
+    :param target: A directory on the local storage to restore to, defaults to './restored/<name>'
     :param oauth: An access token to the storage
+    :param segments: How many parts of the backup to download in parallel
+    :param members: A file or directory inside the backup to restore, can be given many times
+    :param workers: How many threads write the unpacked files
+    :param metrics_file: Write durations, bytes and requests of the phases here, as for backup
     :return:
     """
-    downloaded_file_path = savezone.restore(resource_id, storage_name, target=target, token=token)
+    with _recording('restore', storage_name, metrics_file) as metrics:
+        downloaded_file_path = savezone.restore(resource_id, storage_name, target=target, token=token,
+                                                segments=segments, members=members, workers=workers, metrics=metrics)
     print(f'File was downloaded, please check {downloaded_file_path}')
 
 
@@ -96,14 +213,77 @@ def meta(storage_name: str = typer.Option('yandex', '-s'), token: str or None =
 def list(storage_name: str = typer.Option('yandex', '-s'),
          token: str or None = None,
          remote_path: Optional[str] = typer.Argument(None),
-         detailed: Optional[bool] = False):
+         detailed: Optional[bool] = False,
+         refresh: bool = typer.Option(False, '-r', '--refresh'),
+         local: bool = typer.Option(False, '-l', '--local'),
+         path: Optional[str] = typer.Option(None, '-p', '--path'),
+         newer_than: Optional[float] = typer.Option(None, '--newer-than'),
+         largest: Optional[int] = typer.Option(None, '--largest'),
+         metrics_file: Optional[str] = typer.Option(None, '--metrics-file'),
+         use_async: bool = typer.Option(False, '-a', '--async'),
+         concurrency: int = typer.Option(savezone_async.CONCURRENCY, '--concurrency')):
     """
-    Lists all resources in STORAGE in DIR
+    Lists all resources in STORAGE in DIR \r\n
+    :param local: List backups from the local catalog, without requests to the storage
+    :param path: Only backups of this local path and everything under it, implies --local
+    :param newer_than: Only backups made in this many last days, implies --local
+    :param largest: Only this many largest backups, implies --local
+    :param metrics_file: Write durations and requests of listing here, as for backup
+    :param use_async: List all backups at once on one thread, needs aiohttp
+    :param concurrency: How many listings are in flight at once with --async
     """
-    backup_list: List[Backup] = savezone.get_backups(storage_name, token=token)
     storage = get_storage_true_name(storage_name)
+    if local or path or newer_than is not None or largest is not None:
+        entries = savezone.find_backups(storage_name, path, newer_than, largest)
+        display_catalog(entries, storage)
+        return
+    with _recording('list', storage_name, metrics_file) as metrics:
+        if use_async:
+            backup_list: List[Backup] = asyncio.run(savezone_async.get_backups(
+                storage_name, token=token, concurrency=concurrency, use_cache=not refresh, metrics=metrics))
+        else:
+            backup_list: List[Backup] = savezone.get_backups(storage_name, token=token, use_cache=not refresh,
+                                                             metrics=metrics)
     display_backup_list(backup_list, storage)
 
 
+@app.command()
+def sync(storage_name: str = typer.Option('yandex', '-s'), token: str or None = None):
+    """
+    Updates the local catalog of backups in STORAGE, so they can be listed with list --local
+    """
+    added, removed = savezone.sync_catalog(storage_name, token)
+    print(f'Catalog is up to date: {added} backups added, {removed} removed')
+
+
+@app.command()
+def prune(storage_name: str = typer.Option('yandex', '-s'),
+          token: str or None = None,
+          keep_last: Optional[int] = typer.Option(None, '--keep-last'),
+          keep_daily: Optional[int] = typer.Option(None, '--keep-daily'),
+          keep_weekly: Optional[int] = typer.Option(None, '--keep-weekly'),
+          keep_monthly: Optional[int] = typer.Option(None, '--keep-monthly'),
+          max_size: Optional[float] = typer.Option(None, '--max-size'),
+          dry_run: bool = typer.Option(False, '-n', '--dry-run'),
+          workers: int = typer.Option(DELETE_WORKERS, '-w', '--workers')):
+    """
+    Deletes old versions of the backups in STORAGE \r\n
+    :param keep_last: Keep this many last versions of every backup
+    :param keep_daily: Keep the last version of each of this many last days
+    :param keep_weekly: Keep the last version of each of this many last weeks
+    :param keep_monthly: Keep the last version of each of this many last months
+    :param max_size: Delete the oldest versions until all backups take no more than this many Mb
+    :param dry_run: Only print what would be deleted
+    :param workers: How many versions to delete at once
+    """
+    policy = RetentionPolicy(keep_last, keep_daily, keep_weekly, keep_monthly,
+                             int(max_size * 1024 * 1024) if max_size is not None else None)
+    if not policy.has_time_rules and policy.max_total_size is None:
+        raise typer.BadParameter('Give at least one of --keep-last, --keep-daily, --keep-weekly, '
+                                 '--keep-monthly or --max-size')
+    keep, delete, errors = savezone.prune(storage_name, policy, token=token, dry_run=dry_run, workers=workers)
+    display_prune_plan(keep, delete, errors, get_storage_true_name(storage_name), dry_run)
+
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,165 @@
+# Run metrics
+# Every command is split into phases (archive, upload, list, ...). A phase records how long it took, how many bytes
+# it processed and how many HTTP requests and retries it made, so a slow run shows where the time went.
+# The metrics of a run are written as JSON or as a Prometheus textfile for node_exporter
+import json
+import os
+import time
+
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator, List
+
+PROMETHEUS_SUFFIX = '.prom'
+METRIC_PREFIX = 'savezone'
+
+
+class Phase:
+    """A part of a run. A phase that is entered many times sums up, also when it runs in many threads at once"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        # Bytes and items are counted by the code of the phase, if it knows them
+        self.bytes = None
+        self.items = None
+        self.requests = 0
+        self.retries = 0
+        self._lock = Lock()
+
+    def add_bytes(self, count: int) -> None:
+        with self._lock:
+            self.bytes = (self.bytes or 0) + count
+
+    def add_items(self, count: int) -> None:
+        with self._lock:
+            self.items = (self.items or 0) + count
+
+    @property
+    def throughput(self) -> float or None:
+        """
+        Bytes per second
+        """
+        if self.bytes is None or self.seconds <= 0:
+            return None
+        return self.bytes / self.seconds
+
+    def to_dict(self) -> dict:
+        return {
+            'seconds': self.seconds,
+            'bytes': self.bytes,
+            'items': self.items,
+            'throughput': self.throughput,
+            'requests': self.requests,
+            'retries': self.retries,
+        }
+
+
+class RunMetrics:
+    """Metrics of one run of a command"""
+
+    def __init__(self, command: str, storage: str or None = None):
+        """
+        :param command: A name of the command, e.g. backup
+        :param storage: A name of the storage the command works with
+        """
+        self.command = command
+        self.storage = storage
+        self.started = time.time()
+        self.seconds = None
+        self.ok = None
+        self.error = None
+        self.phases: Dict[str, Phase] = {}
+        self._lock = Lock()
+        self._monotonic_start = time.monotonic()
+
+    @contextmanager
+    def phase(self, name: str, http=None) -> Iterator[Phase]:
+        """
+        Measures the block as the phase
+        :param http: An HttpSession whose requests in the block are counted. If the phase runs in many threads
+                     at once, each of them should have its own session, or the requests are counted by every one
+        """
+        with self._lock:
+            phase = self.phases.setdefault(name, Phase(name))
+        before = http.stats() if http is not None else None
+        started = time.monotonic()
+        try:
+            yield phase
+        finally:
+            seconds = time.monotonic() - started
+            after = http.stats() if http is not None else None
+            with phase._lock:
+                phase.seconds += seconds
+                if before is not None:
+                    phase.requests += after['requests'] - before['requests']
+                    phase.retries += after['retries'] - before['retries']
+
+    def finish(self, error: BaseException or None = None) -> None:
+        self.seconds = time.monotonic() - self._monotonic_start
+        self.ok = error is None
+        self.error = str(error) if error is not None else None
+
+    def to_dict(self) -> dict:
+        return {
+            'command': self.command,
+            'storage': self.storage,
+            'started': self.started,
+            'seconds': self.seconds,
+            'ok': self.ok,
+            'error': self.error,
+            'phases': {name: phase.to_dict() for name, phase in self.phases.items()},
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        Formats the metrics in the Prometheus text format
+        """
+        labels = {'command': self.command, 'storage': self.storage or ''}
+        lines: List[str] = []
+
+        def _metric(name: str, help_text: str, samples: List[tuple]) -> None:
+            samples = [(sample_labels, value) for sample_labels, value in samples if value is not None]
+            if not samples:
+                return
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} gauge')
+            for sample_labels, value in samples:
+                lines.append(f'{METRIC_PREFIX}_{name}{{{_format_labels({**labels, **sample_labels})}}} {value}')
+
+        _metric('run_timestamp_seconds', 'When the run started', [({}, self.started)])
+        _metric('run_duration_seconds', 'How long the run took', [({}, self.seconds)])
+        _metric('run_success', 'Whether the run succeeded', [({}, None if self.ok is None else int(self.ok))])
+
+        phases = self.phases.values()
+        for name, help_text, attribute in (
+                ('phase_duration_seconds', 'How long the phase took', 'seconds'),
+                ('phase_bytes', 'How many bytes the phase processed', 'bytes'),
+                ('phase_items', 'How many items the phase processed', 'items'),
+                ('phase_throughput_bytes_per_second', 'Bytes per second of the phase', 'throughput'),
+                ('phase_http_requests', 'How many HTTP requests the phase made', 'requests'),
+                ('phase_http_retries', 'How many HTTP requests of the phase were retried', 'retries'),
+        ):
+            _metric(name, help_text, [({'phase': phase.name}, getattr(phase, attribute)) for phase in phases])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        """
+        Writes the metrics to path: a Prometheus textfile if it ends with .prom, JSON otherwise.
+        The file is replaced at once, so a collector never reads it half-written
+        """
+        if path.endswith(PROMETHEUS_SUFFIX):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    def _escape(value: str) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics.recorder import RunMetrics
+
+
+class FakeHttp:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+
+    def stats(self) -> dict:
+        return {'requests': self.requests, 'reused_connections': 0, 'retries': self.retries}
+
+
+class RunMetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_phases_sum_up(self):
+        http = FakeHttp()
+        metrics = RunMetrics('backup', 'Yandex Disk')
+        for _ in range(2):
+            with metrics.phase('upload', http) as phase:
+                http.requests += 3
+                http.retries += 1
+                phase.add_bytes(100)
+        with metrics.phase('archive'):
+            pass
+        metrics.finish()
+
+        upload = metrics.phases['upload']
+        self.assertEqual((6, 2, 200), (upload.requests, upload.retries, upload.bytes))
+        self.assertIsNone(metrics.phases['archive'].bytes)
+        self.assertTrue(metrics.ok)
+
+    def test_phase_in_many_threads_sums_up(self):
+        metrics = RunMetrics('batch')
+
+        def _upload(_) -> None:
+            http = FakeHttp()
+            with metrics.phase('upload', http) as phase:
+                http.requests += 2
+                for _ in range(100):
+                    phase.add_bytes(1)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(_upload, range(50)))
+        upload = metrics.phases['upload']
+        self.assertEqual((100, 5000), (upload.requests, upload.bytes))
+
+    def test_failed_phase_is_recorded(self):
+        metrics = RunMetrics('restore')
+        with self.assertRaises(ValueError):
+            with metrics.phase('download'):
+                raise ValueError('no')
+        metrics.finish(ValueError('no'))
+        self.assertIn('download', metrics.phases)
+        self.assertEqual((False, 'no'), (metrics.ok, metrics.error))
+
+    def test_write(self):
+        metrics = RunMetrics('list', 'Say "hi"')
+        with metrics.phase('list') as phase:
+            phase.add_items(5)
+        metrics.finish()
+
+        metrics.write(os.path.join(self.tmp, 'run.json'))
+        with open(os.path.join(self.tmp, 'run.json')) as f:
+            self.assertEqual(5, json.load(f)['phases']['list']['items'])
+
+        metrics.write(os.path.join(self.tmp, 'run.prom'))
+        with open(os.path.join(self.tmp, 'run.prom')) as f:
+            text = f.read()
+        self.assertIn('savezone_phase_items{command="list",storage="Say \\"hi\\"",phase="list"} 5', text)
+        self.assertIn('savezone_run_success{command="list",storage="Say \\"hi\\""} 1', text)
+        self.assertNotIn('savezone_phase_bytes', text)
+        self.assertEqual(['run.json', 'run.prom'], sorted(os.listdir(self.tmp)))
+
+
+if __name__ == '__main__':
+    unittest.main()
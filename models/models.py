@@ -114,3 +114,46 @@ class Backup:
     def _toJson(self) -> str:
         """Serializes the object to JSON"""
         pass
+
+
+class BatchResult:
+    """A result of one job of the batch backup"""
+
+    def __init__(self, resource_path: str, storage: str):
+        """
+        :param resource_path: A path to the resource that was backed up
+        :param storage: A name of the storage the resource was backed up to
+        """
+        self.resource_path = resource_path
+        self.storage = storage
+        self.backup: Backup or None = None
+        self.error: str or None = None
+        self.archive_seconds: float = 0
+        self.upload_seconds: float = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.backup is not None
+
+
+class CatalogEntry:
+    """A backup version as it is kept in the local catalog"""
+
+    def __init__(self, storage: str, remote_path: str, path: str, name: str, version: str, created: datetime,
+                 size: int or None = None):
+        """
+        :param storage: A name of the storage the backup is on
+        :param remote_path: A path to the backup on the storage
+        :param path: A path to the resource that was backed up
+        :param name: A name of the resource that was backed up
+        :param version: A name of the backup version
+        :param created: When the backup was made
+        :param size: A size of the backup in bytes, if known
+        """
+        self.storage = storage
+        self.remote_path = remote_path
+        self.path = path
+        self.name = name
+        self.version = version
+        self.created = created
+        self.size = size
@@ -0,0 +1,124 @@
+# Retention planner
+# Decides which backup versions to keep, the way GFS rotation does: the last N versions, the newest version
+# of each of the last N days, weeks and months, all within a limit of the total size.
+# The planner only makes a plan, deleting is up to the caller
+from datetime import datetime
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+class Version:
+    """A backup version as the planner sees it"""
+
+    def __init__(self, resource: str, name: str, remote_path: str, created: datetime, size: int or None = None):
+        """
+        :param resource: An ID of the resource the version belongs to
+        :param name: A name of the version
+        :param remote_path: A path to the version on the storage
+        :param created: When the version was made
+        :param size: A size of the version in bytes, if known
+        """
+        self.resource = resource
+        self.name = name
+        self.remote_path = remote_path
+        self.created = created
+        self.size = size
+
+
+class RetentionPolicy:
+    """What to keep. Versions that no rule keeps are deleted, the newest version of a resource is always kept"""
+
+    def __init__(self, keep_last: int or None = None, keep_daily: int or None = None, keep_weekly: int or None = None,
+                 keep_monthly: int or None = None, max_total_size: int or None = None):
+        """
+        :param keep_last: Keep this many newest versions of every resource
+        :param keep_daily: Keep the newest version of each of this many last days that have versions
+        :param keep_weekly: The same for weeks
+        :param keep_monthly: The same for months
+        :param max_total_size: Delete the oldest versions of all resources until they take no more bytes than this
+        """
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.keep_monthly = keep_monthly
+        self.max_total_size = max_total_size
+
+    @property
+    def has_time_rules(self) -> bool:
+        return any(rule is not None for rule in (self.keep_last, self.keep_daily, self.keep_weekly, self.keep_monthly))
+
+
+PERIODS = {
+    'daily': lambda created: created.date(),
+    'weekly': lambda created: created.isocalendar()[:2],
+    'monthly': lambda created: (created.year, created.month),
+}
+
+
+def _keep_by_period(versions: List[Version], count: int, period: str) -> Set[str]:
+    """
+    Keeps the newest version of each of the count last periods, versions are sorted newest first
+    """
+    kept, periods = set(), set()
+    for version in versions:
+        key = PERIODS[period](version.created)
+        if key in periods:
+            continue
+        if len(periods) >= count:
+            break
+        periods.add(key)
+        kept.add(version.remote_path)
+    return kept
+
+
+def _keep_of_resource(versions: List[Version], policy: RetentionPolicy) -> Set[str]:
+    versions = sorted(versions, key=lambda v: v.created, reverse=True)
+    if not policy.has_time_rules:
+        return {v.remote_path for v in versions}
+
+    kept = {versions[0].remote_path}
+    if policy.keep_last is not None:
+        kept.update(v.remote_path for v in versions[:policy.keep_last])
+    for period, count in (('daily', policy.keep_daily), ('weekly', policy.keep_weekly),
+                          ('monthly', policy.keep_monthly)):
+        if count is not None:
+            kept |= _keep_by_period(versions, count, period)
+    return kept
+
+
+def plan(versions: Iterable[Version], policy: RetentionPolicy) -> Tuple[List[Version], List[Version]]:
+    """
+    Plans the retention of the versions of all resources
+    :return: versions to keep and versions to delete, newest first
+    """
+    by_resource: Dict[str, List[Version]] = {}
+    for version in versions:
+        by_resource.setdefault(version.resource, []).append(version)
+
+    kept = set()
+    newest = set()
+    for resource_versions in by_resource.values():
+        kept |= _keep_of_resource(resource_versions, policy)
+        newest.add(max(resource_versions, key=lambda v: v.created).remote_path)
+
+    everything = sorted((v for vs in by_resource.values() for v in vs), key=lambda v: v.created, reverse=True)
+    if policy.max_total_size is not None:
+        total = sum(v.size or 0 for v in everything if v.remote_path in kept)
+        # The oldest versions go first, but never the last version of a resource
+        for version in reversed(everything):
+            if total <= policy.max_total_size:
+                break
+            if version.remote_path in kept and version.remote_path not in newest:
+                kept.discard(version.remote_path)
+                total -= version.size or 0
+
+    return [v for v in everything if v.remote_path in kept], [v for v in everything if v.remote_path not in kept]
+
+
+def protect(keep: List[Version], delete: List[Version], needed: Set[str]) -> Tuple[List[Version], List[Version]]:
+    """
+    Moves the versions that kept versions depend on (e.g. older versions of an incremental backup) back to keep
+    :param needed: remote paths of the versions that can't be deleted
+    """
+    protected = [v for v in delete if v.remote_path in needed]
+    keep = sorted(keep + protected, key=lambda v: v.created, reverse=True)
+    return keep, [v for v in delete if v.remote_path not in needed]
@@ -0,0 +1,55 @@
+import unittest
+
+from datetime import datetime, timedelta
+
+from retention.planner import RetentionPolicy, Version, plan, protect
+
+
+def _versions(resource: str, dates, size: int = 100):
+    return [Version(resource, d.strftime('%d%m%Y%H%M%S'), f'{resource}/{d:%d%m%Y%H%M%S}', d, size) for d in dates]
+
+
+class PlannerTests(unittest.TestCase):
+    def setUp(self):
+        start = datetime(2026, 1, 1, 12)
+        # Two versions a day for 60 days
+        self.versions = _versions('a', [start + timedelta(hours=12 * i) for i in range(120)])
+        self.newest = self.versions[-1]
+
+    def _kept(self, policy: RetentionPolicy, versions=None):
+        keep, delete = plan(versions or self.versions, policy)
+        self.assertEqual(len(keep) + len(delete), len(versions or self.versions))
+        return keep
+
+    def test_no_rules_keep_everything(self):
+        self.assertEqual(len(self.versions), len(self._kept(RetentionPolicy())))
+
+    def test_keep_last_and_daily(self):
+        keep = self._kept(RetentionPolicy(keep_last=3, keep_daily=5))
+        # The last 3 versions cover 2 days, 3 more days are kept by their newest version
+        self.assertEqual(6, len(keep))
+        self.assertEqual(self.newest.remote_path, keep[0].remote_path)
+        self.assertEqual(5, len({v.created.date() for v in keep}))
+
+    def test_weekly_and_monthly(self):
+        # A version a day, the last one on Sunday, March 1
+        versions = _versions('a', [datetime(2026, 1, 1, 12) + timedelta(days=i) for i in range(60)])
+        keep = self._kept(RetentionPolicy(keep_weekly=2, keep_monthly=3), versions)
+        self.assertEqual([(3, 1), (2, 28), (2, 22), (1, 31)], [(v.created.month, v.created.day) for v in keep])
+
+    def test_max_size_spares_the_newest_of_each_resource(self):
+        a = _versions('a', [datetime(2026, 1, 1 + i) for i in range(3)], size=100)
+        b = _versions('b', [datetime(2025, 1, 1 + i) for i in range(2)], size=1000)
+        keep, delete = plan(a + b, RetentionPolicy(max_total_size=1100))
+        self.assertEqual([a[2].remote_path, b[1].remote_path], [v.remote_path for v in keep])
+        self.assertEqual({a[0].remote_path, a[1].remote_path, b[0].remote_path}, {v.remote_path for v in delete})
+
+    def test_protect(self):
+        keep, delete = plan(self.versions, RetentionPolicy(keep_last=1))
+        keep, delete = protect(keep, delete, {self.versions[0].remote_path})
+        self.assertEqual([self.newest.remote_path, self.versions[0].remote_path], [v.remote_path for v in keep])
+        self.assertEqual(len(self.versions) - 2, len(delete))
+
+
+if __name__ == '__main__':
+    unittest.main()
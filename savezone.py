@@ -1,17 +1,40 @@
 # Savezone command processor
 # Handles savezone related commands, returns raw data, could be used as a library
 import os
-import shutil
 import base64
+import shutil
+import tempfile
+import zipfile
 
-from typing import List, Tuple
-from datetime import datetime
+import threading
+import time
 
-from settings import BASE_DIRECTORY
-from storage_registry import get_storage_by_name
-from cloud_storages.storage import Storage
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Iterator, List, Tuple
+from datetime import datetime, timedelta
+
+from archive.codecs import ZipCodec, TarCodec, DEFAULT_CODEC, get_codec, get_codec_by_remote_path
+from archive.extract import EXTRACT_WORKERS, extract_stream
+from archive.parallel import process_context
+from archive.stream import stream_archive, stream_writer, write_archive, write_members
+from dedup import engine as dedup_engine
+from dedup.chunk_store import ChunkStore
+from incremental import manifest as manifests
+from integrity import digests as integrity
+from metrics.recorder import RunMetrics
+from retention import planner as retention
+from scanner.walk import walk
+from settings import BASE_DIRECTORY, CHUNKS_DIRECTORY
+from storage_registry import get_storage_by_name, get_storage_true_name
+from watch.batcher import ChangeBatcher, DEBOUNCE, MAX_DELAY
+from watch.sources import OVERFLOW, open_watcher
+from cloud_storages.metadata_cache import MetadataCache
+from cloud_storages.storage import Storage, DELETE_WORKERS
+from database.catalog import Catalog, normalize_remote_path
+from database.stat_cache import StatCache
 from database.database import Database as DBStorage
-from models.models import Resource, StorageMetaInfo, Backup
+from models.models import Resource, StorageMetaInfo, Backup, BatchResult, CatalogEntry
 
 
 DELIMITER = '-'
@@ -19,6 +42,16 @@ ENCODING = 'utf-8'
 DATETIME_FORMAT = '%d%m%Y%H%M%S'
 BASE_TEMP_DIRECTORY = 'temp'
 BASE_BACKUPS_DIRECTORY = 'restored'
+INCREMENTAL_SUFFIX = '.inc'
+DEDUP_SUFFIX = '.cdc'
+LIST_WORKERS = 8
+UPLOADS_PER_STORAGE = 4
+# Seconds between full scans of the watched resources, they catch the changes that events missed
+RECONCILE_INTERVAL = 6 * 60 * 60
+# A batch with more changed paths than this is backed up with a full scan of the resource
+MAX_WATCH_BATCH = 10000
+# Seconds to wait for events at once, so a stop is noticed
+WATCH_POLL_INTERVAL = 1.0
 
 
 # todo (toplenboren) DOES NOT WORK ON WIN
@@ -43,14 +76,150 @@ def _parse_date(date) -> datetime:
     return datetime.strptime(date, DATETIME_FORMAT)
 
 
+# The local database of the process, with the tables on top of it, see _database
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _database() -> DBStorage:
+    """
+    The local database of the process, opened once. Every thread gets its own connection to it.
+    A process forked by a pool opens it again, an SQLite connection can't be used on both sides of a fork
+    """
+    with _shared_lock:
+        if _shared.get('pid') != os.getpid():
+            _shared.clear()
+            _shared.update(pid=os.getpid(), database=DBStorage())
+        return _shared['database']
+
+
+def _catalog() -> Catalog:
+    database = _database()
+    with _shared_lock:
+        if 'catalog' not in _shared:
+            _shared['catalog'] = Catalog(database)
+        return _shared['catalog']
+
+
+def _stat_cache() -> StatCache:
+    # Listings of the local directories, so the next backup of a tree doesn't read its unchanged directories again
+    database = _database()
+    with _shared_lock:
+        if 'stat_cache' not in _shared:
+            _shared['stat_cache'] = StatCache(database)
+        return _shared['stat_cache']
+
+
 def _restore_token(storage_name) -> str:
-    database = DBStorage()
-    token_from_storage = database.get(storage_name)
+    token_from_storage = _database().get(storage_name)
     if not token_from_storage:
         raise ValueError(f'No auth token was found. Please run: python main.py auth -s {storage_name}')
     return token_from_storage
 
 
+def _manifest_db_key(storage_name: str, resource_id: str) -> str:
+    return f'manifest:{get_storage_true_name(storage_name)}:{resource_id}'
+
+
+def _get_storage(storage_name: str, token: str, use_cache: bool = True) -> Storage:
+    """
+    Creates the storage. Listings of remote directories are cached in the local database
+    :param use_cache: if False, the cached listings are dropped and fetched from the storage again
+    """
+    storage_class = get_storage_by_name(storage_name)
+    storage: Storage = storage_class(token=token)
+    storage.metadata_cache = MetadataCache(_database(), get_storage_true_name(storage_name))
+    if not use_cache:
+        storage.metadata_cache.clear()
+    return storage
+
+
+def _chunk_store(storage: Storage, storage_name: str) -> ChunkStore:
+    return ChunkStore(storage, CHUNKS_DIRECTORY, _database(), get_storage_true_name(storage_name))
+
+
+def _catalog_entry(storage_name: str, path: str, name: str, version: Resource) -> CatalogEntry or None:
+    """
+    Makes a catalog entry of the version, or returns None if it is not a backup made by savezone
+    """
+    try:
+        created = _parse_date(version.name.split('.')[0])
+    except ValueError:
+        return None
+    size = version.size.size if version.size is not None else None
+    return CatalogEntry(get_storage_true_name(storage_name), version.path, path, name, version.name, created, size)
+
+
+def _record_backup(storage_name: str, resource_path: str, remote_path: str, saved_resource: Resource,
+                   metrics: RunMetrics or None = None) -> None:
+    """
+    Adds the new backup to the local catalog
+    """
+    metrics = metrics or RunMetrics('catalog')
+    # The saved resource is the local archive if the storage couldn't return the uploaded one
+    size = saved_resource.size if saved_resource is not None and saved_resource.path.endswith(remote_path) else None
+    version = Resource(True, remote_path, size.size if size is not None else None)
+    abspath = os.path.abspath(resource_path)
+    entry = _catalog_entry(storage_name, abspath, os.path.basename(abspath), version)
+    if entry is not None:
+        with metrics.phase('catalog') as phase:
+            _catalog().add(entry)
+            phase.add_items(1)
+
+
+def _digests_db_key(storage_name: str, remote_path: str) -> str:
+    return f'digests:{get_storage_true_name(storage_name)}:{normalize_remote_path(remote_path)}'
+
+
+def _verify_upload(storage_name: str, remote_path: str, saved_resource: Resource, digests: dict) -> None:
+    """
+    Compares the digests of the bytes that were sent with the size and the MD5 that the storage reports,
+    and keeps them in the local database so restore can check the backup
+    :raises: ValueError if the storage has other bytes than were sent
+    """
+    # The saved resource is the local archive if the storage couldn't return the uploaded one
+    if saved_resource is not None and saved_resource.path.endswith(remote_path):
+        remote = {'size': saved_resource.size.size if saved_resource.size is not None else None,
+                  'md5': saved_resource.md5}
+        integrity.check(remote, digests, f'The uploaded {remote_path}')
+        verified = 'verified' if saved_resource.md5 else 'the storage reports no MD5 to verify'
+    else:
+        verified = 'the storage returned no metadata to verify'
+    _database().set(_digests_db_key(storage_name, remote_path), digests)
+    print(f'[{__name__}] MD5 {digests["md5"]}, SHA-256 {digests["sha256"]} ({verified})')
+
+
+def _expected_digests(storage: Storage, storage_name: str, remote_path: str) -> dict or None:
+    """
+    Returns the digests recorded when the backup was made, or the size and the MD5 that the storage reports
+    if the backup was made on another machine
+    """
+    digests = _database().get(_digests_db_key(storage_name, remote_path))
+    if digests:
+        return digests
+    parent_path, name = remote_path.rstrip('/').rsplit('/', 1)
+    try:
+        remote = next((r for r in storage.list_resources_on_path(parent_path) if r.name == name), None)
+    except (ValueError, FileNotFoundError):
+        return None
+    if remote is None or not remote.md5:
+        return None
+    return {'size': remote.size.size if remote.size is not None else None, 'md5': remote.md5}
+
+
+def _counted(stream: Iterable[bytes], phase) -> Iterator[bytes]:
+    """
+    Passes the chunks of the stream through, counting their bytes as processed by the phase
+    """
+    for chunk in stream:
+        phase.add_bytes(len(chunk))
+        yield chunk
+
+
+def _directory_size(path: str) -> int:
+    return sum(stat.st_size for directory in walk(path, stat=True) for stat in directory.stats.values())
+
+
 def _check_resource(resource_path: str) -> bool:
     """
     Checks if the resource is file and accessible, or checks that all resources in directory are files and accessible
@@ -77,13 +246,14 @@ def meta(storage_name: str, token: str or None = None) -> StorageMetaInfo:
     if not token:
         token = _restore_token(storage_name)
 
-    storage_class = get_storage_by_name(storage_name)
-    storage: Storage = storage_class(token=token)
+    storage: Storage = _get_storage(storage_name, token)
     return storage.get_meta_info()
 
 
 def backup(resource_path: str, remote_path: str, storage_name: str, token: str or None = None,
-           overwrite: bool = False) -> Backup:
+           overwrite: bool = False, stream: bool = False, incremental: bool = False, dedup: bool = False,
+           codec: str = DEFAULT_CODEC, level: int or None = None, workers: int or None = None,
+           metrics: RunMetrics or None = None) -> Backup:
     """
     Saves resource from resource_path to the cloud. Resolves access token and provides additional business logic
 
@@ -91,6 +261,14 @@ def backup(resource_path: str, remote_path: str, storage_name: str, token: str o
     :param remote_path: A path on the remote to save to
     :param token: An access token to the storage
     :param storage_name: Storage name
+    :param stream: Whether to send the archive to the storage while it is being made, without a temp file
+    :param incremental: Whether to upload only the files that changed since the last incremental backup
+    :param dedup: Whether to split the resource into chunks and upload only chunks that the storage doesn't have
+    :param codec: A compression codec: store, deflate, bzip2, lzma, zstd or lz4
+    :param level: A compression level of the codec, the default of the codec if not given
+    :param workers: How many processes to compress the archive, or to chunk the files of a deduplicated backup with,
+                    defaults to the number of CPUs
+    :param metrics: Where to record the durations, bytes and requests of the phases of the backup
 
     :return: saved Resource if everything went OK or raises exception
     :raises: ValueError if something went wrong
@@ -99,19 +277,31 @@ def backup(resource_path: str, remote_path: str, storage_name: str, token: str o
     if not _check_resource(resource_path):
         raise ValueError(f'Object on {resource_path} couldn`t be opened')
 
+    metrics = metrics or RunMetrics('backup', get_storage_true_name(storage_name))
+    if incremental and dedup:
+        raise ValueError('Choose either incremental or deduplicated backup')
+
+    codec = get_codec(codec, level)
+    if incremental and isinstance(codec, TarCodec):
+        raise ValueError(f'Incremental backups are zip archives, {codec.name} codec can\'t be used for them')
+
     if not token:
         token = _restore_token(storage_name)
 
     # If remote path is not specified - then make it!
     # /<BASE>/<ID>/<DATETIME>
     print(f'[{__name__}] Calculating remote file path...')
-    if remote_path in ['/', '']:
+    # Only backups on the automatic path can be found by list, so only they go to the catalog
+    automatic_path = remote_path in ['/', '']
+    if automatic_path:
         resource_id = _encode_resource_id(resource_path)
         current_date = _get_current_date()
         remote_path = '/'.join([BASE_DIRECTORY, resource_id, current_date])
         print(f'[{__name__}] Calculated resource_id - {resource_id}')
     # If remote path is specified we mount this lad to custom directory
     # todo (toplenboren) learn how to process complex pathes
+    elif incremental or dedup:
+        raise ValueError('Incremental and deduplicated backups are only supported on the automatic remote path (leave the -t empty)')
     else:
         file_name = os.path.basename(resource_path)
         remote_path = BASE_DIRECTORY + '-custom/' + remote_path + '/' + file_name
@@ -119,42 +309,605 @@ def backup(resource_path: str, remote_path: str, storage_name: str, token: str o
               f'Note: You wont be able to fully use this util using -t argument.'
               f' Consider using automatic method instead (leave the -t empty)')
 
-    # Archiving the directory or file in order not to do recursive stuff
-    print(f'[{__name__}] Archiving resource...')
-    archived_file_path = f'{BASE_TEMP_DIRECTORY}/{resource_id}'
-    # https://stackoverflow.com/questions/30049201/how-to-compress-a-file-with-shutil-make-archive-in-python
-    if os.path.isfile(resource_path):
-        abspath = os.path.abspath(resource_path)
-        head, tail = os.path.split(abspath)
-        shutil.make_archive(archived_file_path, 'zip', head, tail)
-    elif os.path.isdir(resource_path):
-        shutil.make_archive(archived_file_path, 'zip', resource_path)
-    archived_file_path += '.zip'
+    storage: Storage = _get_storage(storage_name, token)
+
+    if incremental:
+        saved_resource = _backup_incremental(storage, storage_name, resource_path, resource_id, remote_path,
+                                             overwrite, stream, codec, workers, metrics)
+        _record_backup(storage_name, resource_path, remote_path + INCREMENTAL_SUFFIX, saved_resource, metrics)
+        return Backup([saved_resource], storage_name, resource_path)
+
+    if dedup:
+        print(f'[{__name__}] Uploading new chunks of the resource...')
+        store = _chunk_store(storage, storage_name)
+        with metrics.phase('chunks', storage.http) as phase:
+            snapshot = dedup_engine.backup_resource(resource_path, store, _stat_cache(), workers)
+            phase.add_bytes(store.uploaded_bytes)
+        print(f'[{__name__}] Uploaded {store.uploaded_bytes} bytes, {store.skipped_bytes} bytes were already stored')
+        print(f'[{__name__}] Saving snapshot on remote file path...')
+        with metrics.phase('upload', storage.http) as phase:
+            content = dedup_engine.dumps(snapshot)
+            saved_resource = storage.save_stream_to_path([content], remote_path + DEDUP_SUFFIX, overwrite)
+            phase.add_bytes(len(content))
+        _record_backup(storage_name, resource_path, remote_path + DEDUP_SUFFIX, saved_resource, metrics)
+        return Backup([saved_resource], storage_name, resource_path)
+
+    # The codec is recorded in the name of the backup, so restore knows how to unpack it
+    remote_path += codec.suffix
+
+    if stream:
+        print(f'[{__name__}] Archiving resource and saving it on remote file path...')
+        digests = integrity.Digests()
+        archive = stream_archive(resource_path, codec=codec, workers=workers, cache=_stat_cache())
+        with metrics.phase('archive_upload', storage.http) as phase:
+            saved_resource = storage.save_stream_to_path(
+                _counted(integrity.hashed(archive, digests), phase), remote_path, overwrite
+            )
+        _verify_upload(storage_name, remote_path, saved_resource, digests.to_dict())
+        if automatic_path:
+            _record_backup(storage_name, resource_path, remote_path, saved_resource, metrics)
+        return Backup([saved_resource], storage_name, resource_path)
+
+    resource = Resource(True, f'{BASE_TEMP_DIRECTORY}/{resource_id}{codec.suffix or ".zip"}')
+
+    # The archive of an interrupted upload is kept, so the upload can be continued instead of being started over
+    pending_path = storage.has_pending_upload(resource)
+    if pending_path is not None:
+        # The upload goes on to the path of the run that started it, so it is verified and recorded under that path
+        remote_path = pending_path
+        print(f'[{__name__}] Found an interrupted upload of the resource to {remote_path}, continuing it...')
+        # The archive was made by an earlier run, it is the only case when it is read once more to be hashed
+        digests = integrity.file_digests(resource.path).to_dict()
+    else:
+        # Archiving the directory or file in order not to do recursive stuff
+        print(f'[{__name__}] Archiving resource...')
+        with metrics.phase('archive') as phase:
+            digests = _make_archive(resource_path, resource.path, codec, workers)
+            phase.add_bytes(digests['size'])
 
     print(f'[{__name__}] Saving archived file on remote file path...')
+    saved_resource = _upload_archive(storage, resource, remote_path, overwrite, metrics)
+    _verify_upload(storage_name, remote_path, saved_resource, digests)
+    if automatic_path:
+        _record_backup(storage_name, resource_path, remote_path, saved_resource, metrics)
+    return Backup([saved_resource], storage_name, resource_path)
+
+
+def _make_archive(resource_path: str, archived_file_path: str, codec: ZipCodec or TarCodec or None = None,
+                  workers: int or None = 1) -> dict:
+    """
+    Archives the file or directory to archived_file_path with the codec, deflate by default
+    :param workers: How many processes to compress with, None for the number of CPUs
+    :return: the size, MD5 and SHA-256 of the archive, computed while it is written
+    """
+    digests = integrity.Digests()
+    with open(archived_file_path, 'wb') as f:
+        write_archive(resource_path, integrity.HashingWriter(f, digests), codec, workers, _stat_cache())
+    return digests.to_dict()
+
+
+def _upload_archive(storage: Storage, resource: Resource, remote_path: str, overwrite: bool,
+                    metrics: RunMetrics or None = None) -> Resource:
+    """
+    Uploads the archive and deletes it, unless the upload was interrupted and can be continued later
+    """
+    metrics = metrics or RunMetrics('upload')
     try:
-        storage_class = get_storage_by_name(storage_name)
-        storage: Storage = storage_class(token=token)
-        resource = Resource(True, archived_file_path)
-        saved_resource = storage.save_resource_to_path(resource, remote_path, overwrite)
+        with metrics.phase('upload', storage.http) as phase:
+            size = os.path.getsize(resource.path)
+            saved_resource = storage.save_resource_to_path(resource, remote_path, overwrite)
+            phase.add_bytes(size)
+        return saved_resource
     finally:
-        print(f'[{__name__}] Deleting temp files...')
-        os.unlink(archived_file_path)
+        if storage.has_pending_upload(resource) is not None:
+            print(f'[{__name__}] Upload of {resource.path} was interrupted, run the backup again to continue it')
+        else:
+            print(f'[{__name__}] Deleting temp files...')
+            with metrics.phase('cleanup'):
+                os.unlink(resource.path)
 
-    return Backup([saved_resource], storage_name, resource_path)
+
+def read_job_file(job_file_path: str) -> List[Tuple[str, str or None]]:
+    """
+    Reads the jobs of the batch backup. Every line is a path to the resource, optionally followed by a tab and
+    the name of the storage. Empty lines and lines starting with # are skipped
+    :return: a list of (resource path, storage name or None) pairs
+    :raises: ValueError if a line has no path, more than one tab or an unknown storage, nothing is backed up then
+    """
+    jobs = []
+    with open(job_file_path, encoding=ENCODING) as f:
+        for number, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            fields = [field.strip() for field in line.split('\t')]
+            if len(fields) > 2 or not fields[0]:
+                raise ValueError(f'{job_file_path}:{number}: expected a path, optionally followed by a tab and '
+                                 f'a storage name, got {line!r}')
+            storage_name = fields[1] if len(fields) == 2 and fields[1] else None
+            if storage_name is not None:
+                try:
+                    get_storage_true_name(storage_name)
+                except ValueError:
+                    raise ValueError(f'{job_file_path}:{number}: there is no storage named {storage_name}')
+            jobs.append((fields[0], storage_name))
+    return jobs
+
+
+def backup_batch(jobs: List[Tuple[str, str]], token: str or None = None, overwrite: bool = False,
+                 archive_workers: int or None = None,
+                 uploads_per_storage: int = UPLOADS_PER_STORAGE, codec: str = DEFAULT_CODEC,
+                 level: int or None = None, metrics: RunMetrics or None = None) -> List[BatchResult]:
+    """
+    Backs up many resources at once. Resources are archived on a pool of processes, and every archive is handed
+    to the upload pool of its storage as soon as it is ready, so archiving and uploading overlap
+
+    :param jobs: A list of (resource path, storage name) pairs
+    :param token: An access token, used for all storages. If not given, tokens are taken from the local database
+    :param archive_workers: How many resources to archive at once, defaults to the number of CPUs
+    :param uploads_per_storage: How many uploads to run at once to one storage
+    :param codec: A compression codec: store, deflate, bzip2, lzma, zstd or lz4
+    :param level: A compression level of the codec
+    :param metrics: Where to record the phases of all the jobs: archive is the time until every resource is
+                    archived, upload and catalog sum up the jobs
+
+    :return: results of the jobs in the order of the jobs. A failed job has an error instead of a backup
+    """
+    metrics = metrics or RunMetrics('batch')
+    codec = get_codec(codec, level)
+    results = [BatchResult(resource_path, storage_name) for resource_path, storage_name in jobs]
+    tokens: Dict[str, str] = {}
+    uploaders: Dict[str, ThreadPoolExecutor] = {}
+    # Every upload thread has a storage of its own, so the requests of its uploads are counted only once
+    thread_storages = threading.local()
+
+    def _upload(result: BatchResult, storage_name: str, resource: Resource, remote_path: str, digests: dict) -> None:
+        started = time.monotonic()
+        try:
+            if getattr(thread_storages, 'storage', None) is None:
+                thread_storages.storage = _get_storage(result.storage, tokens[storage_name])
+            saved_resource = _upload_archive(thread_storages.storage, resource, remote_path, overwrite, metrics)
+            _verify_upload(result.storage, remote_path, saved_resource, digests)
+            result.backup = Backup([saved_resource], result.storage, result.resource_path)
+            _record_backup(result.storage, result.resource_path, remote_path, saved_resource, metrics)
+        except Exception as e:
+            result.error = str(e)
+        result.upload_seconds = time.monotonic() - started
+
+    print(f'[{__name__}] Archiving {len(jobs)} resources...')
+    uploads = []
+    with metrics.phase('archive') as archive_phase, \
+            ProcessPoolExecutor(max_workers=archive_workers, mp_context=process_context()) as archivers:
+        archives = {}
+        resource_ids = set()
+        for result in results:
+            try:
+                if not _check_resource(result.resource_path):
+                    raise ValueError(f'Object on {result.resource_path} couldn`t be opened')
+                resource_id = _encode_resource_id(result.resource_path)
+                if resource_id in resource_ids:
+                    raise ValueError(f'{result.resource_path} is already in the batch')
+                resource_ids.add(resource_id)
+                storage_name = get_storage_true_name(result.storage)
+                if storage_name not in tokens:
+                    tokens[storage_name] = token or _restore_token(result.storage)
+                    uploaders[storage_name] = ThreadPoolExecutor(max_workers=uploads_per_storage)
+
+                remote_path = '/'.join([BASE_DIRECTORY, resource_id, _get_current_date()]) + codec.suffix
+                archived_file_path = f'{BASE_TEMP_DIRECTORY}/{resource_id}{codec.suffix or ".zip"}'
+                future = archivers.submit(_make_archive, result.resource_path, archived_file_path, codec)
+                archives[future] = (result, storage_name, remote_path, archived_file_path, time.monotonic())
+            except Exception as e:
+                result.error = str(e)
+
+        for future in as_completed(archives):
+            result, storage_name, remote_path, archived_file_path, started = archives[future]
+            result.archive_seconds = time.monotonic() - started
+            try:
+                digests = future.result()
+                resource = Resource(True, archived_file_path)
+            except Exception as e:
+                result.error = str(e)
+                continue
+            archive_phase.add_bytes(digests['size'])
+            archive_phase.add_items(1)
+            print(f'[{__name__}] Archived {result.resource_path}, uploading it...')
+            uploads.append(uploaders[storage_name].submit(_upload, result, storage_name, resource, remote_path,
+                                                          digests))
+
+    wait(uploads)
+    for uploader in uploaders.values():
+        uploader.shutdown()
+    return results
+
+
+def _backup_incremental(storage: Storage, storage_name: str, resource_path: str, resource_id: str, remote_path: str,
+                        overwrite: bool, stream: bool, codec: ZipCodec or None = None,
+                        workers: int or None = 1, metrics: RunMetrics or None = None,
+                        changed_paths: Iterable[str] or None = None, skip_unchanged: bool = False) -> Resource or None:
+    """
+    Uploads the files that are new or changed since the previous incremental backup, along with the manifest
+    of the whole resource. The manifest of the last backup is kept in the local database
+    :param changed_paths: Local paths that are known to have changed, only they are looked at instead of
+                          the whole resource. Ignored if there is no previous backup
+    :param skip_unchanged: Whether to upload nothing and return None if no file was changed, added or removed
+    """
+    metrics = metrics or RunMetrics('backup')
+    database = _database()
+    db_key = _manifest_db_key(storage_name, resource_id)
+    previous = database.get(db_key) or None
+
+    print(f'[{__name__}] Scanning resource...')
+    with metrics.phase('scan') as phase:
+        if changed_paths is not None and previous is not None:
+            manifest = manifests.update(resource_path, previous, changed_paths)
+        else:
+            manifest = manifests.scan(resource_path, previous, _stat_cache())
+        changed = manifests.apply_version(manifest, previous, remote_path.split('/')[-1])
+        phase.add_items(len(manifest['files']))
+    print(f'[{__name__}] {len(changed)} of {len(manifest["files"])} files changed since the last backup')
+    if skip_unchanged and previous is not None and not changed and manifest['files'].keys() == previous['files'].keys():
+        return None
+
+    members = [(manifests.local_path(resource_path, name), name) for name in changed]
+    extra = {manifests.MANIFEST_NAME: manifests.dumps(manifest)}
+    remote_path += INCREMENTAL_SUFFIX
+
+    digests = integrity.Digests()
+    if stream:
+        print(f'[{__name__}] Archiving changes and saving them on remote file path...')
+        with metrics.phase('archive_upload', storage.http) as phase:
+            saved_resource = storage.save_stream_to_path(
+                _counted(integrity.hashed(stream_writer(lambda f: write_members(members, f, extra, codec, workers)),
+                                          digests), phase),
+                remote_path, overwrite
+            )
+    else:
+        print(f'[{__name__}] Archiving changes...')
+        archived_file_path = f'{BASE_TEMP_DIRECTORY}/{resource_id}{INCREMENTAL_SUFFIX}.zip'
+        with metrics.phase('archive') as phase:
+            with open(archived_file_path, 'wb') as f:
+                write_members(members, integrity.HashingWriter(f, digests), extra, codec, workers)
+            phase.add_bytes(digests.size)
+        print(f'[{__name__}] Saving archived changes on remote file path...')
+        try:
+            with metrics.phase('upload', storage.http) as phase:
+                size = os.path.getsize(archived_file_path)
+                saved_resource = storage.save_resource_to_path(Resource(True, archived_file_path), remote_path,
+                                                               overwrite)
+                phase.add_bytes(size)
+        finally:
+            print(f'[{__name__}] Deleting temp files...')
+            with metrics.phase('cleanup'):
+                os.unlink(archived_file_path)
+
+    _verify_upload(storage_name, remote_path, saved_resource, digests.to_dict())
+    database.set(db_key, manifest)
+    return saved_resource
+
+
+def watch(resource_paths: List[str], storage_name: str, token: str or None = None, codec: str = DEFAULT_CODEC,
+          level: int or None = None, debounce: float = DEBOUNCE, max_delay: float = MAX_DELAY,
+          reconcile_interval: float = RECONCILE_INTERVAL, max_batch: int = MAX_WATCH_BATCH,
+          stop: threading.Event or None = None) -> None:
+    """
+    Keeps the resources backed up until stopped: changes are taken from file system events, and when a resource
+    has been quiet for debounce seconds, an incremental backup of only the changed paths is made.
+    Every resource is fully scanned on start, every reconcile_interval seconds and when events were lost,
+    a backup is made only if something changed
+
+    :param resource_paths: Local paths to the files or directories to watch
+    :param storage_name: Storage name
+    :param token: An access token to the storage
+    :param codec: A compression codec of the zip archives: store, deflate, bzip2, lzma, zstd or lz4
+    :param level: A compression level of the codec, the default of the codec if not given
+    :param debounce: Seconds without events after which the changes are backed up
+    :param max_delay: Seconds after which the changes are backed up even if events keep coming
+    :param reconcile_interval: Seconds between full scans of the resources
+    :param max_batch: A resource with more changed paths than this is fully scanned instead
+    :param stop: Watching stops when the event is set, runs until interrupted if not given
+    :raises: ValueError if a resource doesn't exist or the resources can't be watched on this system
+    """
+    codec = get_codec(codec, level)
+    if isinstance(codec, TarCodec):
+        raise ValueError(f'Incremental backups are zip archives, {codec.name} codec can\'t be used for them')
+    for resource_path in resource_paths:
+        if not os.path.exists(resource_path) or not _check_resource(resource_path):
+            raise ValueError(f'Object on {resource_path} couldn`t be opened')
+
+    if not token:
+        token = _restore_token(storage_name)
+    storage: Storage = _get_storage(storage_name, token)
+    batcher = ChangeBatcher(resource_paths, debounce, max_delay)
+    stop = stop or threading.Event()
+    # The temp archives and the local database change on every backup, they must not trigger another one
+    own_paths = (os.path.join(os.path.abspath(BASE_TEMP_DIRECTORY), ''), os.path.abspath(_database().db_path))
+
+    def _backup_changes(resource_path: str, changed_paths: Iterable[str] or None) -> bool:
+        resource_id = _encode_resource_id(resource_path)
+        remote_path = '/'.join([BASE_DIRECTORY, resource_id, _get_current_date()])
+        try:
+            saved_resource = _backup_incremental(storage, storage_name, resource_path, resource_id, remote_path,
+                                                 False, False, codec, 1, changed_paths=changed_paths,
+                                                 skip_unchanged=True)
+        except (ValueError, OSError) as e:
+            print(f'[{__name__}] Warning: couldn\'t back up changes of {resource_path}. Reason: {e}')
+            return False
+        if saved_resource is None:
+            print(f'[{__name__}] Nothing changed in {resource_path}')
+        else:
+            _record_backup(storage_name, resource_path, remote_path + INCREMENTAL_SUFFIX, saved_resource)
+        return True
+
+    # The watches are set before the first scan, so nothing changed during it is missed
+    print(f'[{__name__}] Watching {len(batcher.resources)} resources...')
+    with open_watcher(batcher.resources) as watcher:
+        next_reconcile = time.monotonic()
+        while not stop.is_set():
+            if time.monotonic() >= next_reconcile:
+                print(f'[{__name__}] Scanning all watched resources...')
+                # The scan finds whatever the pending events are about
+                batcher.clear()
+                for resource_path in batcher.resources:
+                    _backup_changes(resource_path, None)
+                next_reconcile = time.monotonic() + reconcile_interval
+
+            for resource_path, changed_paths in batcher.pop_ready(time.monotonic()).items():
+                print(f'[{__name__}] {len(changed_paths)} paths changed in {resource_path}')
+                if not _backup_changes(resource_path, changed_paths if len(changed_paths) <= max_batch else None):
+                    # The changes are not lost, the next scan comes in max_delay at the latest
+                    next_reconcile = min(next_reconcile, time.monotonic() + max_delay)
+
+            deadline = min(d for d in (batcher.next_deadline(), next_reconcile) if d is not None)
+            timeout = min(max(deadline - time.monotonic(), 0), WATCH_POLL_INTERVAL)
+            for path in watcher.read(timeout):
+                if path is OVERFLOW:
+                    print(f'[{__name__}] Warning: file system events were lost, scanning everything again')
+                    next_reconcile = time.monotonic()
+                elif not os.path.abspath(path).startswith(own_paths):
+                    batcher.add(path, time.monotonic())
+    print(f'[{__name__}] Stopped watching')
+
+
+def _select_members(names: List[str], wanted: List[str]) -> List[str]:
+    """
+    Returns the names of the backup that were asked for: a name selects the file or the directory with everything in it
+    :raises: ValueError if something that was asked for is not in the backup
+    """
+    selected = set()
+    for name in wanted:
+        name = name.strip('/')
+        matched = [n for n in names if n.rstrip('/') == name or n.startswith(name + '/')]
+        if not matched:
+            raise ValueError(f'{name} is not in the backup')
+        selected.update(matched)
+    return [n for n in names if n in selected]
+
+
+def _extract_remote_members(storage: Storage, remote_path: str, wanted: List[str], target: str) -> List[str]:
+    """
+    Extracts the chosen members of the remote zip archive, reading only its central directory and those members
+    :return: extracted names
+    """
+    _warn_members_only(remote_path)
+    with storage.open_resource(remote_path) as remote, zipfile.ZipFile(remote) as zf:
+        names = _select_members(zf.namelist(), wanted)
+        # Every member is fetched with a request that ends where the next member starts.
+        # A local storage opens the file itself, it has no requests to bound
+        reader = getattr(remote, 'raw', None)
+        if hasattr(reader, 'set_boundaries'):
+            reader.set_boundaries([info.header_offset for info in zf.infolist()] + [zf.start_dir])
+        for name in names:
+            zf.extract(name, target)
+        requests_count = f' with {reader.requests_count} requests' if hasattr(reader, 'requests_count') else ''
+        print(f'[{__name__}] Read {len(names)} of {len(zf.namelist())} members{requests_count}')
+    return names
+
+
+def _restore_members(storage: Storage, storage_name: str, backup_path: str, target: str,
+                     members: List[str]) -> str:
+    """
+    Restores only the chosen files or directories of the backup
+    """
+    if get_codec_by_remote_path(backup_path).suffix:
+        raise ValueError('Only files of zip backups can be restored one by one, restore the whole backup instead')
+
+    if backup_path.endswith(DEDUP_SUFFIX):
+        print(f'[{__name__}] Downloading snapshot...')
+        snapshot = _download_snapshot(storage, backup_path)
+        names = _select_members(snapshot['dirs'] + [file['name'] for file in snapshot['files']], members)
+        snapshot['dirs'] = [name for name in snapshot['dirs'] if name in names]
+        snapshot['files'] = [file for file in snapshot['files'] if file['name'] in names]
+        print(f'[{__name__}] Downloading chunks...')
+        return dedup_engine.restore_snapshot(snapshot, _chunk_store(storage, storage_name), target)
+
+    os.makedirs(target, exist_ok=True)
+    if not backup_path.endswith(INCREMENTAL_SUFFIX):
+        print(f'[{__name__}] Reading chosen files from the backup...')
+        _extract_remote_members(storage, backup_path, members, target)
+        return target
+
+    # Every file of an incremental backup is read from the version that holds its content
+    versions_path, version_name = backup_path.rsplit('/', 1)
+    manifest = _read_manifest(storage, backup_path)
+    names = set(_select_members(sorted(manifest['files']), members))
+    for version, version_names in manifests.files_by_version(manifest).items():
+        version_names = [name for name in version_names if name in names]
+        if version_names:
+            print(f'[{__name__}] Reading chosen files from {version}...')
+            _extract_remote_members(storage, f'{versions_path}/{version}{INCREMENTAL_SUFFIX}', version_names, target)
+    return target
+
+
+def _read_manifest(storage: Storage, backup_path: str) -> dict:
+    with storage.open_resource(backup_path) as remote, zipfile.ZipFile(remote) as zf:
+        return manifests.loads(zf.read(manifests.MANIFEST_NAME))
+
+
+@contextmanager
+def _staged(target: str) -> Iterator[str]:
+    """
+    Yields a temporary directory next to target to unpack a backup that is verified only when it has been read.
+    The unpacked files are moved into target if the block succeeds and are removed if it fails,
+    so a corrupted backup leaves nothing behind
+    """
+    staging = tempfile.mkdtemp(prefix='.restoring-', dir=os.path.dirname(os.path.abspath(target)))
+    try:
+        yield staging
+        os.makedirs(target, exist_ok=True)
+        for name in os.listdir(staging):
+            os.replace(os.path.join(staging, name), os.path.join(target, name))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
 
 
-def restore(backup_path: str, storage_name: str, target: str or None = None, token: str or None = None) -> str:
+def _warn_members_only(remote_path: str) -> None:
+    print(f'[{__name__}] Only chosen files of {remote_path} are read, so the backup is not verified as a whole: '
+          f'only the CRCs of these files are checked')
+
+
+def _unpack_remote(storage: Storage, remote_path: str, target: str, segments: int = 1,
+                   workers: int = EXTRACT_WORKERS, names: List[str] or None = None,
+                   metrics: RunMetrics or None = None, expected: dict or None = None) -> None:
+    """
+    Unpacks the remote archive to target. By default the archive is unpacked while it is being downloaded,
+    so it is never written to the disk. With segments > 1 it is downloaded in parallel parts first
+    :param names: Names of the members to unpack, all of them if not given
+    :param expected: Digests of the archive to check it against, only when the whole archive is unpacked.
+                     A mismatch raises ValueError and leaves no unpacked files in target
+    """
+    what = f'The backup {remote_path}'
+
+    metrics = metrics or RunMetrics('restore')
+    codec = get_codec_by_remote_path(remote_path)
+
+    if segments > 1:
+        archive_path = f'{BASE_TEMP_DIRECTORY}/' + DELIMITER.join(remote_path.split('/')[-2:]) + \
+            ('' if codec.suffix else '.zip')
+        with metrics.phase('download', storage.http) as phase:
+            storage.download_resource(remote_path, archive_path, segments)
+            phase.add_bytes(os.path.getsize(archive_path))
+        try:
+            # Segments are written out of order, so the archive is hashed when it is complete, before it is unpacked
+            if expected is not None:
+                integrity.file_digests(archive_path).check(expected, what)
+            with metrics.phase('unpack') as phase:
+                if names is None:
+                    codec.extract(archive_path, target)
+                else:
+                    with zipfile.ZipFile(archive_path) as zf:
+                        for name in names:
+                            zf.extract(name, target)
+                phase.add_bytes(os.path.getsize(archive_path))
+        finally:
+            with metrics.phase('cleanup'):
+                os.unlink(archive_path)
+        return
+
+    if isinstance(codec, TarCodec):
+        with metrics.phase('download_unpack', storage.http) as phase:
+            with storage.stream_resource(remote_path) as stream, \
+                    (_staged(target) if expected is not None else nullcontext(target)) as unpack_to:
+                if expected is not None:
+                    stream = integrity.VerifyingReader(stream, expected, what)
+                codec.extract_stream(stream, unpack_to)
+                # The files are moved into target only if the digests match
+                if expected is not None:
+                    stream.finish()
+                # Bytes that came over the wire
+                phase.add_bytes(stream.tell())
+        return
+
+    # The central directory tells where every member is, then the members are read in one pass
+    with metrics.phase('metadata', storage.http):
+        with storage.open_resource(remote_path) as remote, zipfile.ZipFile(remote) as zf:
+            infos = zf.infolist()
+            end = zf.start_dir
+    offsets = [info.header_offset for info in infos if names is None or info.filename in names]
+    if expected is not None and names is None:
+        # The whole archive is read to be hashed: the central directory after the members is read too
+        with metrics.phase('download_unpack', storage.http) as phase:
+            with integrity.VerifyingReader(storage.stream_resource(remote_path), expected, what) as stream, \
+                    _staged(target) as unpack_to:
+                extract_stream(stream, infos, unpack_to, 0, names, workers)
+                stream.finish()
+            phase.add_bytes(stream.tell())
+    elif offsets:
+        if names is not None:
+            _warn_members_only(remote_path)
+        with metrics.phase('download_unpack', storage.http) as phase:
+            with storage.stream_resource(remote_path, min(offsets), end) as stream:
+                extract_stream(stream, infos, target, min(offsets), names, workers)
+            phase.add_bytes(end - min(offsets))
+
+
+def _restore_incremental(storage: Storage, backup_path: str, target: str, segments: int = 1,
+                         workers: int = EXTRACT_WORKERS, metrics: RunMetrics or None = None) -> str:
+    """
+    Rebuilds the version of an incremental backup: reads its manifest and takes every file
+    from the version that holds its content
+    """
+    metrics = metrics or RunMetrics('restore')
+    versions_path = backup_path.rsplit('/', 1)[0]
+    with metrics.phase('metadata', storage.http):
+        manifest = _read_manifest(storage, backup_path)
+
+    os.makedirs(target, exist_ok=True)
+    for version, names in manifests.files_by_version(manifest).items():
+        print(f'[{__name__}] Unpacking files of {version}...')
+        _unpack_remote(storage, f'{versions_path}/{version}{INCREMENTAL_SUFFIX}', target, segments, workers, names,
+                       metrics)
+    return target
+
+
+def _download_snapshot(storage: Storage, backup_path: str) -> dict:
+    snapshot_path = f'{BASE_TEMP_DIRECTORY}/' + backup_path.split('/')[-1]
+    storage.download_resource(backup_path, snapshot_path)
+    try:
+        with open(snapshot_path, 'rb') as f:
+            return dedup_engine.loads(f.read())
+    finally:
+        os.unlink(snapshot_path)
+
+
+def _restore_dedup(storage: Storage, storage_name: str, backup_path: str, target: str,
+                   metrics: RunMetrics or None = None) -> str:
+    """
+    Downloads the snapshot and rebuilds its files from the chunk store
+    """
+    metrics = metrics or RunMetrics('restore')
+    print(f'[{__name__}] Downloading snapshot...')
+    with metrics.phase('metadata', storage.http):
+        snapshot = _download_snapshot(storage, backup_path)
+
+    print(f'[{__name__}] Downloading chunks...')
+    with metrics.phase('chunks', storage.http) as phase:
+        dedup_engine.restore_snapshot(snapshot, _chunk_store(storage, storage_name), target)
+        phase.add_bytes(sum(file['size'] for file in snapshot['files']))
+    return target
+
+
+def restore(backup_path: str, storage_name: str, target: str or None = None, token: str or None = None,
+            segments: int = 1, members: List[str] or None = None, workers: int = EXTRACT_WORKERS,
+            metrics: RunMetrics or None = None) -> str:
     """
     Downloads the information from the backup
+    :param target: A local directory to restore to, restored/<name of the resource> by default.
+                   It has to be empty or not exist
+    :param segments: How many parts of the backup to download in parallel. If more than 1, the backup is downloaded
+                     first and unpacked then, otherwise it is unpacked while it is being downloaded
+    :param members: Paths of files or directories inside the backup to restore, the whole backup if not given.
+                    Only these files are downloaded
+    :param workers: How many threads write the unpacked files
+    :param metrics: Where to record the durations, bytes and requests of the phases of the restore
     :returns path to the file
     """
+    metrics = metrics or RunMetrics('restore', get_storage_true_name(storage_name))
     if not token:
         token = _restore_token(storage_name)
 
     print(f'[{__name__}] Getting storage...')
-    storage_class = get_storage_by_name(storage_name)
-    storage: Storage = storage_class(token=token)
+    storage: Storage = _get_storage(storage_name, token)
 
     # Handle files that were saved on a normal basis
     remote_path_resource_id = backup_path.split('/')[-2]
@@ -165,62 +918,230 @@ def restore(backup_path: str, storage_name: str, target: str or None = None, tok
 
     if target is None:
         print(f'[{__name__}] Calculating local file path...')
-        dl_target = f"{BASE_BACKUPS_DIRECTORY}/" + original_name + ".zip"
         target = f"{BASE_BACKUPS_DIRECTORY}/" + original_name
-        if os.path.exists(target):
-            raise ValueError(f"Path {target} is not empty. Please deal with it, then try to restore file again")
-    else:
-        raise NotImplementedError()
+    if os.path.exists(target) and (not os.path.isdir(target) or os.listdir(target)):
+        raise ValueError(f"Path {target} is not empty. Please deal with it, then try to restore file again")
 
-    print(f'[{__name__}] Downloading file...')
-    storage.download_resource(backup_path, dl_target)
+    if members:
+        with metrics.phase('download_unpack', storage.http) as phase:
+            _restore_members(storage, storage_name, backup_path, target, members)
+            phase.add_bytes(_directory_size(target))
+        return target
+    if backup_path.endswith(INCREMENTAL_SUFFIX):
+        return _restore_incremental(storage, backup_path, target, segments, workers, metrics)
+    if backup_path.endswith(DEDUP_SUFFIX):
+        return _restore_dedup(storage, storage_name, backup_path, target, metrics)
 
+    expected = _expected_digests(storage, storage_name, backup_path)
+    if expected is None:
+        print(f'[{__name__}] No digests of the backup are known, it is not verified')
+
+    print(f'[{__name__}] Downloading and unpacking file...')
+    created = not os.path.exists(target)
+    os.makedirs(target, exist_ok=True)
     try:
-        print(f'[{__name__}] Unpacking file...')
-        shutil.unpack_archive(dl_target, target, 'zip')
-        return target
-    finally:
-        os.unlink(dl_target)
+        _unpack_remote(storage, backup_path, target, segments, workers, metrics=metrics, expected=expected)
+    except ValueError:
+        # A corrupted backup leaves nothing behind, not even the directory if it was created for it
+        if created:
+            shutil.rmtree(target, ignore_errors=True)
+        raise
+    if expected is not None:
+        print(f'[{__name__}] The backup is verified: {", ".join(k for k in ("md5", "sha256") if expected.get(k))}')
+    return target
 
 
-def get_backups(storage_name: str, token: str or None = None) -> List[Backup]:
+def get_backups(storage_name: str, token: str or None = None, workers: int = LIST_WORKERS,
+                use_cache: bool = True, metrics: RunMetrics or None = None) -> List[Backup]:
     """
-    Gets all backups that are on the storage in human-readable format
+    Gets all backups that are on the storage in human-readable format. The local catalog is updated on the way
     :param storage_name:
+    :param workers: How many resources to list at once
+    :param use_cache: Whether listings cached in the local database can be used
+    :param metrics: Where to record the durations and requests of listing and of the catalog update
     :return:
     """
+    return _get_backups(storage_name, token, workers, use_cache, metrics)[0]
+
+
+def _get_backups(storage_name: str, token: str or None, workers: int, use_cache: bool,
+                 metrics: RunMetrics or None = None) -> Tuple[List[Backup], Tuple[int, int]]:
+    """
+    :return: backups, and how many of them were added to and removed from the catalog
+    """
+    metrics = metrics or RunMetrics('list', get_storage_true_name(storage_name))
     if not token:
         token = _restore_token(storage_name)
 
     print(f'[{__name__}] Getting storage...')
-    storage_class = get_storage_by_name(storage_name)
-    storage: Storage = storage_class(token=token)
+    storage: Storage = _get_storage(storage_name, token, use_cache)
 
-    backups = []
     print(f'[{__name__}] Getting list of remote backups...')
 
+    def _get_backup(remote_resource: Resource) -> Backup or None:
+        try:
+            backup = _unlisted_backup(storage_name, remote_resource)
+            backup.versions = storage.list_resources_on_path(remote_resource.path)
+            return backup
+        except Exception as e:
+            _warn_unlisted(remote_resource, e)
+            return None
+
     try:
-        remote_resources = storage.list_resources_on_path(BASE_DIRECTORY)
-        for remote_resource in remote_resources:
-            try:
-                local_resource_path, local_resource_name = _decode_resource_id(remote_resource.name)
-
-                remote_resource_versions = storage.list_resources_on_path(remote_resource.path)
-                backup = Backup(
-                    versions=remote_resource_versions,
-                    url=remote_resource.url,
-                    storage=storage_name,
-                    path=local_resource_path,
-                    name=local_resource_name,
-                )
-                backups.append(backup)
+        with metrics.phase('list', storage.http) as phase:
+            remote_resources = storage.list_resources_on_path(BASE_DIRECTORY)
+            # Versions of every resource are listed concurrently, map keeps the order of the resources
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                backups = list(executor.map(_get_backup, remote_resources))
+            phase.add_items(sum(len(b.versions) for b in backups if b is not None))
+    except FileNotFoundError:
+        # Nothing was backed up to the storage yet, other errors are not mistaken for it
+        print(f'[{__name__}] There are no backups on the storage yet')
+        return [], (0, 0)
+    finally:
+        storage.flush()
 
-            except Exception as e:
-                print(f'[{__name__}] Warning: couldn\'t get backups for {remote_resource.name}. Reason: {e}')
-                continue
-    except ValueError as e:
-        if '404' in e.args:
-            print(f'[{__name__}] Can\'t get backups')
-            return []
+    return _catalog_listed(storage_name, backups, metrics)
 
-    return backups
+
+def _unlisted_backup(storage_name: str, remote_resource: Resource) -> Backup:
+    """
+    Makes the backup of the remote directory from its name, the versions are listed by the caller
+    :raises: ValueError if the directory is not a backup made by savezone
+    """
+    local_resource_path, local_resource_name = _decode_resource_id(remote_resource.name)
+    return Backup(versions=[], url=remote_resource.url, storage=storage_name, path=local_resource_path,
+                  name=local_resource_name)
+
+
+def _warn_unlisted(remote_resource: Resource, error: Exception) -> None:
+    print(f'[{__name__}] Warning: couldn\'t get backups for {remote_resource.name}. Reason: {error}')
+
+
+def _catalog_listed(storage_name: str, backups: List[Backup or None],
+                    metrics: RunMetrics) -> Tuple[List[Backup], Tuple[int, int]]:
+    """
+    Updates the catalog with the listed backups, None stands for a backup that couldn't be listed
+    :return: the listed backups, and how many of them were added to and removed from the catalog
+    """
+    # Backups that couldn't be listed are not dropped from the catalog
+    complete = all(b is not None for b in backups)
+    backups = [b for b in backups if b is not None]
+    with metrics.phase('catalog') as phase:
+        added, removed = _update_catalog(storage_name, backups, complete)
+        phase.add_items(added + removed)
+    return backups, (added, removed)
+
+
+def _update_catalog(storage_name: str, backups: List[Backup], complete: bool) -> Tuple[int, int]:
+    entries = [
+        entry for b in backups for entry in (_catalog_entry(storage_name, b.path, b.name, v) for v in b.versions)
+        if entry is not None
+    ]
+    return _catalog().reconcile(get_storage_true_name(storage_name), entries, remove_missing=complete)
+
+
+def sync_catalog(storage_name: str, token: str or None = None, workers: int = LIST_WORKERS) -> Tuple[int, int]:
+    """
+    Brings the local catalog of the storage up to date: fetches the backups from the storage
+    and applies the difference to the catalog
+    :return: how many backups were added to the catalog and removed from it
+    """
+    return _get_backups(storage_name, token, workers, use_cache=False)[1]
+
+
+def find_backups(storage_name: str or None = None, path: str or None = None, newer_than_days: float or None = None,
+                 largest: int or None = None) -> List[CatalogEntry]:
+    """
+    Finds backups in the local catalog, without requests to the storage
+    :param storage_name: Storage name, all storages if not given
+    :param path: A local path, finds the backups of it and of everything under it
+    :param newer_than_days: Finds backups made in this many last days
+    :param largest: Finds this many largest backups
+    :return: found backups, newest or largest first
+    """
+    newer_than = datetime.now() - timedelta(days=newer_than_days) if newer_than_days is not None else None
+    return _catalog().find(
+        storage=get_storage_true_name(storage_name) if storage_name else None,
+        path=os.path.abspath(path) if path else None,
+        newer_than=newer_than,
+        largest=largest,
+    )
+
+
+def _needed_versions(storage: Storage, keep: List[retention.Version], delete: List[retention.Version],
+                     workers: int) -> set:
+    """
+    Finds the incremental versions that the kept ones take files from. Their manifests are read from the storage
+    :return: remote paths of the versions that can't be deleted
+    """
+    resources = {v.resource for v in delete if v.name.endswith(INCREMENTAL_SUFFIX)}
+    kept = [v for v in keep if v.resource in resources and v.name.endswith(INCREMENTAL_SUFFIX)]
+
+    def _needed_by(version: retention.Version) -> set:
+        try:
+            manifest = _read_manifest(storage, version.remote_path)
+        except (ValueError, OSError, zipfile.BadZipFile, KeyError) as e:
+            # Nothing of the resource is deleted if it's not known what its versions depend on
+            print(f'[{__name__}] Warning: couldn\'t read the manifest of {version.remote_path}, '
+                  f'keeping all versions of the resource. Reason: {e}')
+            return {v.remote_path for v in delete if v.resource == version.resource}
+        return {f'{version.resource}/{name}{INCREMENTAL_SUFFIX}' for name in manifests.files_by_version(manifest)}
+
+    needed = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for versions in executor.map(_needed_by, kept):
+            needed |= versions
+    return needed
+
+
+def prune(storage_name: str, policy: retention.RetentionPolicy, token: str or None = None, dry_run: bool = False,
+          workers: int = DELETE_WORKERS) -> Tuple[List[retention.Version], List[retention.Version], Dict[str, str]]:
+    """
+    Deletes the backup versions that the retention policy doesn't keep. The newest version of every resource
+    and the incremental versions that kept versions take files from are never deleted.
+    Chunks of deduplicated backups stay in the chunk store
+    :param policy: What to keep
+    :param dry_run: Only make the plan, delete nothing
+    :param workers: How many versions to delete at once
+    :return: versions that are kept, versions that are deleted (or would be), and errors by the remote paths
+             that couldn't be deleted
+    """
+    if not token:
+        token = _restore_token(storage_name)
+
+    versions = []
+    for b in get_backups(storage_name, token, use_cache=False):
+        for v in b.versions:
+            entry = _catalog_entry(storage_name, b.path, b.name, v)
+            if entry is not None:
+                versions.append(retention.Version(v.path.rsplit('/', 1)[0], v.name, v.path, entry.created, entry.size))
+
+    print(f'[{__name__}] Planning retention of {len(versions)} versions...')
+    storage: Storage = _get_storage(storage_name, token)
+    keep, delete = retention.plan(versions, policy)
+    keep, delete = retention.protect(keep, delete, _needed_versions(storage, keep, delete, workers))
+    if dry_run or not delete:
+        return keep, delete, {}
+
+    print(f'[{__name__}] Deleting {len(delete)} versions...')
+    try:
+        errors = storage.delete_resources([v.remote_path for v in delete], workers)
+    finally:
+        storage.flush()
+
+    _forget_deleted(storage_name, [v.remote_path for v in delete], errors)
+    return keep, delete, errors
+
+
+def _forget_deleted(storage_name: str, remote_paths: List[str], errors: Dict[str, str]) -> None:
+    """
+    Drops the deleted versions from the local catalog, with their digests
+    :param errors: errors by the remote paths that couldn't be deleted, they are kept
+    """
+    catalog = _catalog()
+    with catalog.database.transaction():
+        for remote_path in remote_paths:
+            if remote_path not in errors:
+                catalog.remove(get_storage_true_name(storage_name), remote_path)
+                catalog.database.delete(_digests_db_key(storage_name, remote_path))
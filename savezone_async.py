@@ -0,0 +1,137 @@
+# Async savezone driver
+# Runs the commands that are made of many small requests on the async storages: every listing, upload, download
+# or deletion is a coroutine, so one thread keeps hundreds of them in flight instead of burning a thread on each.
+# Needs aiohttp: pip install aiohttp
+import asyncio
+
+from typing import Dict, List, Tuple
+
+from cloud_storages.async_storage import AsyncStorage
+from cloud_storages.metadata_cache import MetadataCache
+from metrics.recorder import RunMetrics
+from models.models import Resource, StorageMetaInfo, Backup
+from savezone import BASE_DIRECTORY, _catalog_listed, _database, _forget_deleted, _restore_token, \
+    _unlisted_backup, _warn_unlisted
+from storage_registry import get_async_storage_by_name, get_storage_true_name
+
+# How many requests are in flight at once
+CONCURRENCY = 100
+
+
+def _get_storage(storage_name: str, token: str or None, use_cache: bool = True) -> AsyncStorage:
+    """
+    Creates the async storage, listings are cached in the local database the same way as by savezone
+    :param use_cache: if False, the cached listings are dropped and fetched from the storage again
+    """
+    storage_class = get_async_storage_by_name(storage_name)
+    storage: AsyncStorage = storage_class(token=token or _restore_token(storage_name))
+    storage.metadata_cache = MetadataCache(_database(), get_storage_true_name(storage_name))
+    if not use_cache:
+        storage.metadata_cache.clear()
+    return storage
+
+
+async def meta(storage_name: str, token: str or None = None) -> StorageMetaInfo:
+    async with _get_storage(storage_name, token) as storage:
+        return await storage.get_meta_info()
+
+
+async def get_backups(storage_name: str, token: str or None = None, concurrency: int = CONCURRENCY,
+                      use_cache: bool = True, metrics: RunMetrics or None = None) -> List[Backup]:
+    """
+    Gets all backups that are on the storage, the same as savezone.get_backups,
+    but the versions of all the backups are listed at once
+    :param concurrency: How many resources to list at once
+    """
+    metrics = metrics or RunMetrics('list', get_storage_true_name(storage_name))
+    limit = asyncio.Semaphore(concurrency)
+
+    async with _get_storage(storage_name, token, use_cache) as storage:
+        async def _get_backup(remote_resource: Resource) -> Backup or None:
+            try:
+                backup = _unlisted_backup(storage_name, remote_resource)
+                async with limit:
+                    backup.versions = await storage.list_resources_on_path(remote_resource.path)
+                return backup
+            except Exception as e:
+                _warn_unlisted(remote_resource, e)
+                return None
+
+        print(f'[{__name__}] Getting list of remote backups...')
+        try:
+            with metrics.phase('list', storage.http) as phase:
+                remote_resources = await storage.list_resources_on_path(BASE_DIRECTORY)
+                backups = await asyncio.gather(*(_get_backup(r) for r in remote_resources))
+                phase.add_items(sum(len(b.versions) for b in backups if b is not None))
+        except FileNotFoundError:
+            print(f'[{__name__}] There are no backups on the storage yet')
+            return []
+        finally:
+            storage.flush()
+
+    return _catalog_listed(storage_name, backups, metrics)[0]
+
+
+async def save_resources(storage_name: str, uploads: List[Tuple[str, str]], token: str or None = None,
+                         overwrite: bool = False, concurrency: int = CONCURRENCY) -> Dict[str, Resource or str]:
+    """
+    Uploads the local files at once
+    :param uploads: (local path, remote path) pairs
+    :return: the saved resource, or the error, by the remote path
+    """
+    limit = asyncio.Semaphore(concurrency)
+
+    async with _get_storage(storage_name, token) as storage:
+        async def _save(local_path: str, remote_path: str) -> Resource or str:
+            async with limit:
+                try:
+                    return await storage.save_resource_to_path(Resource(True, local_path), remote_path, overwrite)
+                except (ValueError, OSError) as e:
+                    return str(e)
+
+        try:
+            results = await asyncio.gather(*(_save(local_path, remote_path) for local_path, remote_path in uploads))
+        finally:
+            storage.flush()
+    return {remote_path: result for (_, remote_path), result in zip(uploads, results)}
+
+
+async def download_resources(storage_name: str, downloads: List[Tuple[str, str]], token: str or None = None,
+                             concurrency: int = CONCURRENCY) -> Dict[str, str]:
+    """
+    Downloads the remote files at once
+    :param downloads: (remote path, local path) pairs
+    :return: errors by the remote paths that couldn't be downloaded
+    """
+    limit = asyncio.Semaphore(concurrency)
+    errors = {}
+
+    async with _get_storage(storage_name, token) as storage:
+        async def _download(remote_path: str, local_path: str) -> None:
+            async with limit:
+                try:
+                    await storage.download_resource(remote_path, local_path)
+                except (ValueError, OSError) as e:
+                    errors[remote_path] = str(e)
+
+        try:
+            await asyncio.gather(*(_download(remote_path, local_path) for remote_path, local_path in downloads))
+        finally:
+            storage.flush()
+    return errors
+
+
+async def delete_versions(storage_name: str, remote_paths: List[str], token: str or None = None,
+                          concurrency: int = CONCURRENCY) -> Dict[str, str]:
+    """
+    Deletes the versions of backups at once and drops them from the local catalog
+    :return: errors by the remote paths that couldn't be deleted
+    """
+    async with _get_storage(storage_name, token) as storage:
+        try:
+            errors = await storage.delete_resources(remote_paths, concurrency)
+        finally:
+            storage.flush()
+
+    _forget_deleted(storage_name, remote_paths, errors)
+    return errors
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from database.database import Database
+from database.stat_cache import StatCache
+from scanner import walk as walker
+
+
+class WalkTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for directory in ['a/b/c', 'a/d', 'e']:
+            os.makedirs(os.path.join(self.root, *directory.split('/')))
+        for name, content in [('x.txt', b'x'), ('a/y.txt', b'yy'), ('a/b/c/z.txt', b'zzz'), ('e/w.txt', b'')]:
+            with open(os.path.join(self.root, *name.split('/')), 'wb') as f:
+                f.write(content)
+        os.symlink(os.path.join(self.root, 'a'), os.path.join(self.root, 'e', 'link'))
+        # Directories changed just now are not cached, see RACY_WINDOW_NS
+        for dirpath, _, _ in os.walk(self.root):
+            os.utime(dirpath, ns=(10 ** 18, 10 ** 18))
+        self.cache = StatCache(Database(os.path.join(tempfile.mkdtemp(), 'storage.db')))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        self.cache.database.close()
+        shutil.rmtree(os.path.dirname(self.cache.database.db_path))
+
+    def _expected(self):
+        expected = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            # Sorted in place, so os.walk goes into the directories in the same order
+            dirnames.sort()
+            expected.append((dirpath, list(dirnames), sorted(filenames)))
+        return expected
+
+    def test_walks_like_os_walk(self):
+        self.assertEqual(self._expected(), [tuple(d) for d in walker.walk(self.root, workers=4)])
+
+    def test_stat_results_of_files(self):
+        sizes = {os.path.relpath(os.path.join(d.path, name), self.root): stat.st_size
+                 for d in walker.walk(self.root, stat=True) for name, stat in d.stats.items()}
+        self.assertEqual({'x.txt': 1, os.path.join('a', 'y.txt'): 2, os.path.join('a', 'b', 'c', 'z.txt'): 3,
+                          os.path.join('e', 'w.txt'): 0}, sizes)
+
+    def test_unchanged_directories_are_not_read_again(self):
+        walker.walk(self.root, cache=self.cache)
+        with mock.patch.object(walker.os, 'scandir', wraps=os.scandir) as scandir:
+            directories = walker.walk(self.root, cache=self.cache, stat=True)
+        self.assertEqual(0, scandir.call_count)
+        self.assertEqual(self._expected(), [tuple(d) for d in directories])
+        stats = {d.path: d.stats for d in directories}
+        self.assertEqual(3, stats[os.path.join(self.root, 'a', 'b', 'c')]['z.txt'].st_size)
+
+        # A new file changes the mtime of its directory, only that directory is read
+        with open(os.path.join(self.root, 'a', 'd', 'new.txt'), 'wb') as f:
+            f.write(b'new')
+        with mock.patch.object(walker.os, 'scandir', wraps=os.scandir) as scandir:
+            directories = walker.walk(self.root, cache=self.cache)
+        self.assertEqual([os.path.join(self.root, 'a', 'd')], [c.args[0] for c in scandir.call_args_list])
+        self.assertEqual(self._expected(), [tuple(d) for d in directories])
+
+
+if __name__ == '__main__':
+    unittest.main()
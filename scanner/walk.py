@@ -0,0 +1,148 @@
+# Parallel directory walker
+# os.walk reads one directory at a time, and on a network file system every read waits for a round trip.
+# Here directories are read with os.scandir by a pool of threads, so many round trips are in flight at once,
+# and the stat results of DirEntry are reused. With a StatCache, a directory whose inode and mtime didn't change
+# since the last walk is not read at all, its entries are taken from the cache
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Tuple
+
+from database.stat_cache import StatCache, Listing
+
+SCAN_WORKERS = 16
+# A directory changed this recently can change again within the same mtime, so it is not cached
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+
+class ScannedDirectory:
+    """
+    A directory found by walk. Unpacks to (path, dirnames, filenames) like a step of os.walk
+    """
+
+    def __init__(self, path: str, dirnames: List[str], filenames: List[str],
+                 stats: Dict[str, os.stat_result] or None = None):
+        """
+        :param stats: stat results of the files by their names, if they were asked for
+        """
+        self.path = path
+        self.dirnames = dirnames
+        self.filenames = filenames
+        self.stats = stats or {}
+
+    def __iter__(self):
+        return iter((self.path, self.dirnames, self.filenames))
+
+
+def _stat_files(path: str, names: List[str]) -> Dict[str, os.stat_result]:
+    stats = {}
+    for name in names:
+        try:
+            stats[name] = os.stat(os.path.join(path, name))
+        except OSError:
+            # A broken symlink, or the file is gone already
+            pass
+    return stats
+
+
+def _read_directory(path: str, stat: bool) -> Tuple[List[List[str]], Dict]:
+    """
+    Reads the directory with os.scandir
+    :return: [directories, symlinks, files] and the stat results of the files if stat is True
+    """
+    directories, links, files = [], [], []
+    stats = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_symlink():
+                    links.append(entry.name)
+                elif entry.is_dir():
+                    directories.append(entry.name)
+                else:
+                    files.append(entry.name)
+                    if stat:
+                        stats[entry.name] = entry.stat()
+            except OSError:
+                pass
+    return [directories, links, files], stats
+
+
+def _scan_directory(path: str, known: Listing or None, started: int,
+                    stat: bool) -> Tuple[ScannedDirectory, List[str], Listing or None] or None:
+    """
+    Lists one directory, from the cache if it didn't change
+    :return: the directory, the paths of its subdirectories to walk and its listing to cache,
+             None if it can't be read
+    """
+    try:
+        directory_stat = os.stat(path)
+        signature = (directory_stat.st_dev, directory_stat.st_ino, directory_stat.st_mtime_ns)
+        cached = known is not None and tuple(known[:3]) == signature
+        if cached:
+            entries, stats = known[3], {}
+        else:
+            entries, stats = _read_directory(path, stat)
+    except OSError:
+        return None
+    directories, links, files = entries
+
+    # Symlinks are listed like os.walk does: a symlink to a directory is a directory, but it is not walked.
+    # Their targets can change without the mtime of the directory, so they are checked every time
+    linked_directories = [name for name in links if os.path.isdir(os.path.join(path, name))]
+    linked_files = [name for name in links if name not in linked_directories]
+    if stat:
+        stats.update(_stat_files(path, files + linked_files if cached else linked_files))
+
+    directory = ScannedDirectory(path, sorted(directories + linked_directories), sorted(files + linked_files), stats)
+    listing = (*signature, entries) if started - directory_stat.st_mtime_ns > RACY_WINDOW_NS else None
+    return directory, [os.path.join(path, name) for name in sorted(directories)], listing
+
+
+def walk(root: str, workers: int = SCAN_WORKERS, cache: StatCache or None = None,
+         stat: bool = False) -> List[ScannedDirectory]:
+    """
+    Walks the directory and everything under it, the same as os.walk(root) does top-down, but directories
+    are read in parallel. Directories that can't be read are skipped, as by os.walk
+    :param root: A path to the directory, the paths of the result start with it
+    :param workers: How many directories to read at once
+    :param cache: Where to take the listings of unchanged directories from, and to keep the new ones in
+    :param stat: Whether to get the stat results of the files, see ScannedDirectory.stats
+    :return: the directories, every one is followed by the directories under it
+    """
+    known = cache.load(root) if cache is not None else {}
+    started = time.time_ns()
+    directories: Dict[str, ScannedDirectory] = {}
+    children: Dict[str, List[str]] = {}
+    listings: Dict[str, Listing] = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def _submit(path: str):
+            return executor.submit(_scan_directory, path, known.get(os.path.abspath(path)), started, stat)
+
+        pending = {_submit(root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result is None:
+                    continue
+                directory, subdirectories, listing = result
+                directories[directory.path] = directory
+                children[directory.path] = subdirectories
+                if listing is not None:
+                    listings[os.path.abspath(directory.path)] = listing
+                pending.update(_submit(path) for path in subdirectories)
+
+    if cache is not None:
+        cache.update(root, listings)
+
+    ordered = []
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        if path in directories:
+            ordered.append(directories[path])
+            stack.extend(reversed(children[path]))
+    return ordered
@@ -1 +1,7 @@
-BASE_DIRECTORY='savezone'
\ No newline at end of file
+import os
+
+BASE_DIRECTORY='savezone'
+CHUNKS_DIRECTORY='savezone-chunks'
+# The APIs can be pointed at another server, e.g. at the fake cloud of the benchmarks
+YADISK_API_URL = os.environ.get('SAVEZONE_YADISK_API_URL', 'https://cloud-api.yandex.net')
+GDRIVE_API_URL = os.environ.get('SAVEZONE_GDRIVE_API_URL', 'https://www.googleapis.com')
@@ -1,19 +1,30 @@
 # Resolves cloud_storages
 
+from cloud_storages.async_storage import AsyncStorage
 from cloud_storages.storage import Storage
+from cloud_storages.yadisk.async_yadisk import AsyncYadiskStorage
 from cloud_storages.yadisk.yadisk import YadiskStorage
+from cloud_storages.gdrive.async_gdrive import AsyncGDriveStorage
 from cloud_storages.gdrive.gdrive import GDriveStorage
+from cloud_storages.local.local import LocalStorage
 
 STORAGES = [
     {
         'name': 'Yandex Disk',
         'synonyms': ['yandex', 'yd', 'yadisk', 'Yandex Disk'],
-        'storage': YadiskStorage
+        'storage': YadiskStorage,
+        'async_storage': AsyncYadiskStorage
     },
     {
         'name': 'Google Drive',
         'synonyms': ['gdrive', 'google_drive', 'google'],
-        'storage': GDriveStorage
+        'storage': GDriveStorage,
+        'async_storage': AsyncGDriveStorage
+    },
+    {
+        'name': 'Local Directory',
+        'synonyms': ['local', 'nas', 'fs'],
+        'storage': LocalStorage
     }
 ]
 
@@ -51,6 +62,16 @@ def get_storage_by_name(name: str) -> Storage:
     return find_storage_by_synonym(name)['storage']
 
 
+def get_async_storage_by_name(name: str) -> AsyncStorage:
+    """
+    Returns the async storage class or raises the exception if the storage has no async counterpart
+    """
+    storage = find_storage_by_synonym(name)
+    if 'async_storage' not in storage:
+        raise ValueError(f'{storage["name"]} has no async storage')
+    return storage['async_storage']
+
+
 def get_storage_true_name(name: str) -> str:
     """
     Returns the first name in the synonyms array
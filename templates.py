@@ -1,9 +1,10 @@
-from typing import List
+from typing import Dict, List
 
 import typer
 from tabulate import tabulate
 
-from models.models import StorageMetaInfo, Resource, Size, Backup
+from models.models import StorageMetaInfo, Resource, Size, Backup, BatchResult, CatalogEntry
+from retention.planner import Version
 from storage_registry import get_storage_true_name
 
 
@@ -119,3 +120,89 @@ def display_backup_list(backup_list: List[Backup], storage_name: str):
     for b in backup_list:
         display_backup(b)
         typer.echo('')
+
+
+def display_batch_results(results: List[BatchResult]) -> None:
+    headers = [
+        'Resource',
+        'Storage',
+        'Result',
+        'Archiving',
+        'Upload',
+    ]
+
+    table = []
+
+    for result in results:
+        if result.ok:
+            status = typer.style('OK', fg=typer.colors.BRIGHT_GREEN)
+        else:
+            status = typer.style(result.error or 'Failed', fg=typer.colors.RED)
+        table.append([
+            result.resource_path,
+            get_storage_true_name(result.storage),
+            status,
+            f'{_to_fixed(result.archive_seconds)} s',
+            f'{_to_fixed(result.upload_seconds)} s',
+        ])
+
+    typer.echo('')
+    typer.echo(tabulate(table, headers))
+
+
+def display_catalog(entries: List[CatalogEntry], storage_name: str) -> None:
+    headers = [
+        'Name',
+        'Original path',
+        'Date',
+        'Size',
+        'Remote path',
+    ]
+
+    table = []
+
+    for entry in entries:
+        table.append([
+            entry.name,
+            entry.path,
+            entry.created.strftime('%Y-%m-%d %H:%M:%S'),
+            f'{_to_fixed(Size.bytes_to_megabytes(entry.size))} Mb' if entry.size is not None else '-',
+            entry.remote_path,
+        ])
+
+    _display_storage(storage_name)
+    typer.echo(tabulate(table, headers))
+
+
+def display_prune_plan(keep: List[Version], delete: List[Version], errors: Dict[str, str], storage_name: str,
+                       dry_run: bool = False) -> None:
+    headers = [
+        'Remote path',
+        'Date',
+        'Size',
+        'Action',
+    ]
+
+    table = []
+    kept = {v.remote_path for v in keep}
+
+    for version in sorted(keep + delete, key=lambda v: (v.resource, v.created)):
+        if version.remote_path in kept:
+            action = typer.style('keep', fg=typer.colors.BRIGHT_GREEN)
+        elif version.remote_path in errors:
+            action = typer.style(errors[version.remote_path], fg=typer.colors.RED)
+        else:
+            action = typer.style('would delete' if dry_run else 'deleted', fg=typer.colors.YELLOW)
+        table.append([
+            version.remote_path,
+            version.created.strftime('%Y-%m-%d %H:%M:%S'),
+            f'{_to_fixed(Size.bytes_to_megabytes(version.size))} Mb' if version.size is not None else '-',
+            action,
+        ])
+
+    _display_storage(storage_name)
+    typer.echo(tabulate(table, headers))
+    freed = sum(v.size or 0 for v in delete if v.remote_path not in errors)
+    typer.echo('')
+    typer.echo(f'{len(delete) - len(errors)} of {len(keep) + len(delete)} versions '
+               f'{"would be deleted" if dry_run else "deleted"}, {_to_fixed(Size.bytes_to_megabytes(freed))} Mb')
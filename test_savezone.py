@@ -0,0 +1,453 @@
+import contextlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+import zipfile
+
+from unittest import mock
+
+import requests
+
+import savezone
+
+from archive import codecs
+from benchmarks.fake_cloud import FakeCloud
+from cloud_storages.gdrive import gdrive, path_resolver
+from cloud_storages.yadisk import yadisk
+from cloud_storages.yadisk.yadisk import YadiskStorage
+from database.database import Database
+from integrity import digests as integrity
+from metrics.recorder import RunMetrics
+from models.models import Resource
+from retention.planner import RetentionPolicy
+
+FILES = {'a.txt': b'a' * 1000, 'dir/b.bin': os.urandom(5000)}
+
+
+def _digests(content: bytes) -> dict:
+    digests = integrity.Digests()
+    digests.update(content)
+    return digests.to_dict()
+
+
+class RestoreVerificationTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cloud = FakeCloud().start()
+        self.addCleanup(self.cloud.stop)
+        patcher = mock.patch.object(yadisk, 'YADISK_API_URL', self.cloud.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+        self.database.set('yandex', 'token')
+        patcher = mock.patch.dict(savezone._shared, {'pid': os.getpid(), 'database': self.database}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = YadiskStorage('token')
+        self.resource_id = savezone._encode_resource_id(os.path.join(self.tmp, 'files'))
+        self.target = os.path.join(self.tmp, 'restored')
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.tmp)
+
+    def _upload(self, name: str, content: bytes, digests: dict) -> str:
+        local_path = os.path.join(self.tmp, name)
+        with open(local_path, 'wb') as f:
+            f.write(content)
+        remote_path = f'{savezone.BASE_DIRECTORY}/{self.resource_id}/{name}'
+        self.storage.save_resource_to_path(Resource(True, local_path), remote_path, True)
+        self.database.set(savezone._digests_db_key('yandex', remote_path), digests)
+        return remote_path
+
+    def _zip(self) -> bytes:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, content in FILES.items():
+                zf.writestr(name, content)
+        return buffer.getvalue()
+
+    def _restore(self, remote_path: str, **kwargs) -> str:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            savezone.restore(remote_path, 'yandex', self.target, **kwargs)
+        return output.getvalue()
+
+    def _assert_restored(self) -> None:
+        for name, content in FILES.items():
+            with open(os.path.join(self.target, name), 'rb') as f:
+                self.assertEqual(content, f.read())
+
+    def _assert_nothing_left(self) -> None:
+        self.assertFalse(os.path.exists(self.target))
+        self.assertEqual([], [name for name in os.listdir(self.tmp) if name.startswith('.restoring-')])
+
+    def test_verified_zip_is_restored(self):
+        content = self._zip()
+        remote_path = self._upload('01012024120000.zip', content, _digests(content))
+        self.assertIn('The backup is verified', self._restore(remote_path))
+        self._assert_restored()
+
+    def test_corrupted_zip_leaves_no_files(self):
+        content = self._zip()
+        digests = _digests(content)
+        digests['md5'] = '0' * 32
+        remote_path = self._upload('01012024120000.zip', content, digests)
+        with self.assertRaises(ValueError):
+            self._restore(remote_path)
+        self._assert_nothing_left()
+
+    def test_corrupted_zip_leaves_an_existing_target_empty(self):
+        content = self._zip()
+        digests = _digests(content)
+        digests['md5'] = '0' * 32
+        remote_path = self._upload('01012024120000.zip', content, digests)
+        os.makedirs(self.target)
+        with self.assertRaises(ValueError):
+            self._restore(remote_path)
+        self.assertEqual([], os.listdir(self.target))
+
+    def test_chosen_members_warn_that_the_backup_is_not_verified(self):
+        content = self._zip()
+        remote_path = self._upload('01012024120000.zip', content, _digests(content))
+        output = self._restore(remote_path, members=['dir'])
+        self.assertIn('not verified as a whole', output)
+        self.assertEqual(['dir'], os.listdir(self.target))
+
+    @unittest.skipUnless(codecs.zstandard, 'zstandard is not installed')
+    def test_corrupted_tar_leaves_no_files(self):
+        buffer = io.BytesIO()
+        with codecs.get_codec('zstd').compressor(buffer) as compressed, \
+                tarfile.open(fileobj=compressed, mode='w|') as tf:
+            for name, data in FILES.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+        content = buffer.getvalue()
+        digests = _digests(content)
+        digests['md5'] = '0' * 32
+        remote_path = self._upload('01012024120000.tar.zst', content, digests)
+        with self.assertRaises(ValueError):
+            self._restore(remote_path)
+        self._assert_nothing_left()
+
+
+class ResumedBackupTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs(savezone.BASE_TEMP_DIRECTORY)
+        self.cloud = FakeCloud().start()
+        self.addCleanup(self.cloud.stop)
+        for module in (gdrive, path_resolver):
+            patcher = mock.patch.object(module, 'GDRIVE_API_URL', self.cloud.url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(gdrive, 'UPLOAD_CHUNK_SIZE', 256 * 1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+        patcher = mock.patch.dict(savezone._shared, {'pid': os.getpid(), 'database': self.database}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.resource_path = os.path.join(self.tmp, 'files')
+        os.makedirs(self.resource_path)
+        with open(os.path.join(self.resource_path, 'data.bin'), 'wb') as f:
+            f.write(os.urandom(1024 * 1024))
+
+    def tearDown(self):
+        self.database.close()
+        os.chdir('/')
+        shutil.rmtree(self.tmp)
+
+    def _backup(self, date: str, interrupt: bool = False):
+        get_storage = savezone._get_storage
+
+        def _get_storage(storage_name, token, use_cache=True):
+            storage = get_storage(storage_name, token, use_cache)
+            storage._database = self.database
+            if interrupt:
+                request = storage.http.request
+
+                def _request(method, addr, *args, **kwargs):
+                    # The network goes down after the first chunk
+                    if method == 'PUT' and '/_gdrive/upload/' in addr and kwargs.get('data') and \
+                            not kwargs['headers']['Content-Range'].startswith('bytes 0-'):
+                        raise requests.ConnectionError('The network is down')
+                    return request(method, addr, *args, **kwargs)
+
+                storage.http.request = _request
+            return storage
+
+        with mock.patch.object(savezone, '_get_storage', _get_storage), \
+                mock.patch.object(savezone, '_get_current_date', return_value=date), \
+                contextlib.redirect_stdout(io.StringIO()):
+            return savezone.backup(self.resource_path, '', 'google', token='token')
+
+    def test_resumed_upload_is_recorded_under_the_path_it_was_sent_to(self):
+        with self.assertRaises(requests.ConnectionError):
+            self._backup('01012024120000', interrupt=True)
+        backup = self._backup('02012024120000')
+
+        resource_id = savezone._encode_resource_id(self.resource_path)
+        first_path = f'{savezone.BASE_DIRECTORY}/{resource_id}/01012024120000'
+        second_path = f'{savezone.BASE_DIRECTORY}/{resource_id}/02012024120000'
+        self.assertEqual([first_path], [r.path for r in backup.versions])
+        self.assertEqual([first_path], [e.remote_path for e in savezone.find_backups('google')])
+        self.assertTrue(self.database.get(savezone._digests_db_key('google', first_path)))
+        self.assertFalse(self.database.get(savezone._digests_db_key('google', second_path)))
+        self.assertEqual([], os.listdir(savezone.BASE_TEMP_DIRECTORY))
+
+
+class PruneTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs(savezone.BASE_TEMP_DIRECTORY)
+        self.cloud = FakeCloud().start()
+        self.addCleanup(self.cloud.stop)
+        patcher = mock.patch.object(yadisk, 'YADISK_API_URL', self.cloud.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+        self.database.set('yandex', 'token')
+        patcher = mock.patch.dict(savezone._shared, {'pid': os.getpid(), 'database': self.database}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.resource_path = os.path.join(self.tmp, 'files')
+        os.makedirs(self.resource_path)
+        self.resource_id = savezone._encode_resource_id(self.resource_path)
+        # The first version has both files, the next ones change only a.txt: the last one takes b.txt from the first
+        self._write('b.txt', b'b' * 100)
+        for day, content in enumerate([b'a', b'aa', b'aaa'], 1):
+            self._write('a.txt', content)
+            self._run(savezone.backup, self.resource_path, '', 'yandex', token='token', incremental=True,
+                      date=f'{day:02}012024120000')
+
+    def tearDown(self):
+        self.database.close()
+        os.chdir('/')
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name: str, content: bytes) -> None:
+        with open(os.path.join(self.resource_path, name), 'wb') as f:
+            f.write(content)
+
+    @staticmethod
+    def _run(function, *args, date: str = '04012024120000', **kwargs):
+        with mock.patch.object(savezone, '_get_current_date', return_value=date), \
+                contextlib.redirect_stdout(io.StringIO()):
+            return function(*args, **kwargs)
+
+    @staticmethod
+    def _name(day: int) -> str:
+        return f'{day:02}012024120000{savezone.INCREMENTAL_SUFFIX}'
+
+    def test_versions_that_a_kept_manifest_needs_are_kept(self):
+        keep, delete, errors = self._run(savezone.prune, 'yandex', RetentionPolicy(keep_last=1))
+        self.assertEqual([self._name(1), self._name(3)], sorted(v.name for v in keep))
+        self.assertEqual([self._name(2)], [v.name for v in delete])
+        self.assertEqual({}, errors)
+        self.assertEqual([self._name(1), self._name(3)],
+                         sorted(os.listdir(os.path.join(self.cloud.yadisk.root, savezone.BASE_DIRECTORY,
+                                                        self.resource_id))))
+
+        # The kept version is restored with the file it takes from the first one
+        target = os.path.join(self.tmp, 'restored')
+        self._run(savezone.restore, f'{savezone.BASE_DIRECTORY}/{self.resource_id}/{self._name(3)}', 'yandex', target)
+        with open(os.path.join(target, 'a.txt'), 'rb') as f:
+            self.assertEqual(b'aaa', f.read())
+        with open(os.path.join(target, 'b.txt'), 'rb') as f:
+            self.assertEqual(b'b' * 100, f.read())
+
+    def test_unreadable_manifest_keeps_every_version_of_the_resource(self):
+        with mock.patch.object(savezone, '_read_manifest', side_effect=ValueError('Broken manifest')):
+            keep, delete, errors = self._run(savezone.prune, 'yandex', RetentionPolicy(keep_last=1), dry_run=True)
+        self.assertEqual([], delete)
+        self.assertEqual(3, len(keep))
+
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs(savezone.BASE_TEMP_DIRECTORY)
+        self.cloud = FakeCloud().start()
+        self.addCleanup(self.cloud.stop)
+        patcher = mock.patch.object(yadisk, 'YADISK_API_URL', self.cloud.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+        patcher = mock.patch.dict(savezone._shared, {'pid': os.getpid(), 'database': self.database}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.database.close()
+        os.chdir('/')
+        shutil.rmtree(self.tmp)
+
+    def _job_file(self, content: str) -> str:
+        path = os.path.join(self.tmp, 'jobs.txt')
+        with open(path, 'w', newline='') as f:
+            f.write(content)
+        return path
+
+    def test_job_file_is_read(self):
+        path = self._job_file('# Resources to back up\r\n'
+                              '/data/photos\r\n'
+                              '\n'
+                              '  /data/docs\tgoogle \n'
+                              '/data/music\t\n')
+        self.assertEqual([('/data/photos', None), ('/data/docs', 'google'), ('/data/music', None)],
+                         savezone.read_job_file(path))
+
+    def test_malformed_job_file_is_refused(self):
+        for line in ('\tyandex', '/data/docs\tyandex\textra', '/data/docs\tdropbox'):
+            with self.subTest(line=line):
+                with self.assertRaises(ValueError) as raised:
+                    savezone.read_job_file(self._job_file(f'/data/photos\n{line}\n'))
+                self.assertIn('jobs.txt:2:', str(raised.exception))
+
+    def test_failed_jobs_do_not_stop_the_others(self):
+        paths = [os.path.join(self.tmp, name) for name in 'abcd']
+        for path in paths:
+            os.makedirs(path)
+            with open(os.path.join(path, 'data.bin'), 'wb') as f:
+                f.write(os.urandom(10000))
+        # The upload of c fails, its version is on the storage already
+        taken = os.path.join(self.cloud.yadisk.root, savezone.BASE_DIRECTORY, savezone._encode_resource_id(paths[2]))
+        os.makedirs(taken)
+        open(os.path.join(taken, '01012024120000'), 'wb').close()
+
+        metrics = RunMetrics('batch', 'Yandex Disk')
+        jobs = [(paths[0], 'yandex'), (paths[1], 'dropbox'), (paths[2], 'yandex'), (paths[3], 'yandex')]
+        with mock.patch.object(savezone, '_get_current_date', return_value='01012024120000'), \
+                contextlib.redirect_stdout(io.StringIO()):
+            results = savezone.backup_batch(jobs, token='token', archive_workers=2, metrics=metrics)
+
+        self.assertEqual(paths, [result.resource_path for result in results])
+        self.assertEqual([True, False, False, True], [result.ok for result in results])
+        self.assertIn('dropbox', results[1].error)
+        self.assertIn('409', results[2].error)
+        self.assertEqual([paths[0], paths[3]], sorted(e.path for e in savezone.find_backups('yandex')))
+        # The phases of all the jobs are recorded
+        self.assertEqual(3, metrics.phases['archive'].items)
+        # Two of the three archives are uploaded
+        self.assertLess(20000, metrics.phases['upload'].bytes)
+        self.assertLess(metrics.phases['upload'].bytes, metrics.phases['archive'].bytes)
+        # Every request of the batch is an upload request, and uploads that ran at once counted only their own
+        self.assertEqual(self.cloud.stats()['requests'], metrics.phases['upload'].requests)
+        self.assertIn('catalog', metrics.phases)
+
+class GetBackupsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cloud = FakeCloud().start()
+        self.addCleanup(self.cloud.stop)
+        patcher = mock.patch.object(yadisk, 'YADISK_API_URL', self.cloud.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+        patcher = mock.patch.dict(savezone._shared, {'pid': os.getpid(), 'database': self.database}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.tmp)
+
+    def _put_versions(self, resources: int, versions: int) -> list:
+        """
+        :return: local paths of the resources in the order the storage lists them
+        """
+        paths = [os.path.join(self.tmp, f'resource{i:02}') for i in range(resources)]
+        for path in paths:
+            directory = os.path.join(self.cloud.yadisk.root, savezone.BASE_DIRECTORY,
+                                     savezone._encode_resource_id(path))
+            os.makedirs(directory)
+            for day in range(1, versions + 1):
+                with open(os.path.join(directory, f'{day:02}012024120000'), 'wb') as f:
+                    f.write(b'x' * day)
+        return sorted(paths, key=savezone._encode_resource_id)
+
+    def _get_backups(self, list_resources=None, **kwargs) -> tuple:
+        get_storage = savezone._get_storage
+
+        def _get_storage(storage_name, token, use_cache=True):
+            storage = get_storage(storage_name, token, use_cache)
+            if list_resources is not None:
+                storage.list_resources_on_path = list_resources(storage.list_resources_on_path)
+            return storage
+
+        output = io.StringIO()
+        with mock.patch.object(savezone, '_get_storage', _get_storage), contextlib.redirect_stdout(output):
+            backups = savezone.get_backups('yandex', token='token', use_cache=False, **kwargs)
+        return [(b.path, [v.name for v in b.versions]) for b in backups], output.getvalue()
+
+    def test_concurrent_listings_are_complete_and_in_order(self):
+        paths = self._put_versions(12, 3)
+        expected = [(path, [f'{day:02}012024120000' for day in (1, 2, 3)]) for path in paths]
+
+        def _list_slowly(list_resources):
+            # The first resources take the longest, so their listings finish last
+            def _list(remote_path):
+                if remote_path != savezone.BASE_DIRECTORY:
+                    time.sleep(0.01 * (12 - len(started)))
+                    started.append(remote_path)
+                return list_resources(remote_path)
+            return _list
+
+        started = []
+        self.assertEqual(expected, self._get_backups(_list_slowly, workers=8)[0])
+        self.assertEqual(12, len(started))
+        self.assertEqual(expected, self._get_backups(workers=1)[0])
+        self.assertEqual(36, len(savezone.find_backups('yandex')))
+
+    def test_failed_listing_of_one_resource_keeps_the_others(self):
+        paths = self._put_versions(4, 2)
+        self._get_backups()
+        failing = savezone._encode_resource_id(paths[1])
+
+        def _fail_one(list_resources):
+            def _list(remote_path):
+                if remote_path.endswith(failing):
+                    raise ValueError('Something went wrong with YD: Response: 500')
+                return list_resources(remote_path)
+            return _list
+
+        backups, output = self._get_backups(_fail_one, workers=4)
+        self.assertEqual([paths[0], paths[2], paths[3]], [path for path, _ in backups])
+        self.assertIn(f"couldn't get backups for {failing}", output)
+        # The versions of the resource that couldn't be listed stay in the catalog
+        self.assertEqual(8, len(savezone.find_backups('yandex')))
+
+    def test_storage_with_no_backups_has_an_empty_listing(self):
+        self.assertEqual([], self._get_backups()[0])
+
+    def test_storage_error_is_not_taken_for_no_backups(self):
+        self._put_versions(1, 1)
+
+        def _fail(list_resources):
+            def _list(remote_path):
+                raise ValueError('Something went wrong with YD: Response: 401 — Unauthorized')
+            return _list
+
+        with self.assertRaises(ValueError):
+            self._get_backups(_fail)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+import savezone
+import savezone_async
+
+from benchmarks.fake_cloud import FakeCloud
+from cloud_storages.yadisk import async_yadisk, yadisk
+from database.database import Database
+
+
+class AsyncDriverTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cloud = FakeCloud().start()
+        self.addCleanup(self.cloud.stop)
+        for module in (yadisk, async_yadisk):
+            patcher = mock.patch.object(module, 'YADISK_API_URL', self.cloud.url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.database = Database(os.path.join(self.tmp, 'storage.db'))
+        self.database.set('yandex', 'token')
+        patcher = mock.patch.dict(savezone._shared, {'pid': os.getpid(), 'database': self.database}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.resources = {}
+        for name in ('etc', 'home'):
+            path = os.path.join(self.tmp, name)
+            os.makedirs(path)
+            resource_id = savezone._encode_resource_id(path)
+            self.resources[resource_id] = path
+            for date in ('01012024120000', '02012024120000'):
+                with open(os.path.join(path, date + '.zip'), 'wb') as f:
+                    f.write(os.urandom(1000))
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.tmp)
+
+    def _upload_all(self):
+        uploads = [(os.path.join(path, name), f'{savezone.BASE_DIRECTORY}/{resource_id}/{name}')
+                   for resource_id, path in self.resources.items() for name in sorted(os.listdir(path))]
+        return uploads, asyncio.run(savezone_async.save_resources('yandex', uploads))
+
+    def test_saved_resources_are_listed_as_backups(self):
+        uploads, results = self._upload_all()
+        self.assertEqual({remote_path for _, remote_path in uploads}, set(results))
+        self.assertTrue(all(not isinstance(result, str) for result in results.values()), results)
+
+        backups = asyncio.run(savezone_async.get_backups('yandex', use_cache=False))
+        self.assertEqual(sorted(self.resources.values()), sorted(b.path for b in backups))
+        for b in backups:
+            self.assertEqual(['01012024120000.zip', '02012024120000.zip'], sorted(v.name for v in b.versions))
+        # The listing went to the catalog, the same as with savezone.get_backups
+        self.assertEqual(4, len(savezone.find_backups('yandex')))
+        self.assertEqual(sorted(b.path for b in backups),
+                         sorted(b.path for b in savezone.get_backups('yandex', use_cache=False)))
+
+    def test_deleted_versions_leave_the_catalog(self):
+        uploads, _ = self._upload_all()
+        asyncio.run(savezone_async.get_backups('yandex'))
+        deleted = [remote_path for _, remote_path in uploads[:2]]
+        self.assertEqual({}, asyncio.run(savezone_async.delete_versions('yandex', deleted)))
+
+        self.assertEqual(2, len(savezone.find_backups('yandex')))
+        backups = asyncio.run(savezone_async.get_backups('yandex'))
+        self.assertEqual(2, sum(len(b.versions) for b in backups))
+
+    def test_failed_uploads_are_reported(self):
+        results = asyncio.run(savezone_async.save_resources(
+            'yandex', [(os.path.join(self.tmp, 'missing.zip'), f'{savezone.BASE_DIRECTORY}/x/missing.zip')]))
+        self.assertIsInstance(results[f'{savezone.BASE_DIRECTORY}/x/missing.zip'], str)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Batches of changes
+# File system events come in bursts: saving a file can be a dozen of events, a build writes thousands of files.
+# Events are coalesced into a set of changed paths per resource, and the set is handed out when the resource
+# has been quiet for a while, so a burst becomes one small backup
+import os
+
+from typing import Dict, Iterable, List, Set
+
+# Seconds without events after which the changes of a resource are backed up
+DEBOUNCE = 5.0
+# Seconds after the first event after which the changes are backed up even if events keep coming
+MAX_DELAY = 300.0
+
+
+class ChangeBatcher:
+    """
+    Collects changed paths of the resources. A batch of a resource is ready when no event came for debounce seconds,
+    or max_delay seconds after its first event, so a file that is written all the time is still backed up
+    """
+
+    def __init__(self, resource_paths: Iterable[str], debounce: float = DEBOUNCE, max_delay: float = MAX_DELAY):
+        self.resources: List[str] = [os.path.abspath(path) for path in resource_paths]
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._paths: Dict[str, Set[str]] = {}
+        self._first: Dict[str, float] = {}
+        self._last: Dict[str, float] = {}
+
+    def resource_of(self, path: str) -> str or None:
+        """
+        :return: the resource that has the path, the innermost one if resources are nested
+        """
+        path = os.path.abspath(path)
+        matching = [r for r in self.resources if path == r or path.startswith(r.rstrip(os.sep) + os.sep)]
+        return max(matching, key=len) if matching else None
+
+    def add(self, path: str, now: float) -> bool:
+        """
+        Records the change of the path
+        :param now: time of the event, time.monotonic()
+        :return: False if the path is not under any resource
+        """
+        resource = self.resource_of(path)
+        if resource is None:
+            return False
+        self._paths.setdefault(resource, set()).add(os.path.abspath(path))
+        self._first.setdefault(resource, now)
+        self._last[resource] = now
+        return True
+
+    def next_deadline(self) -> float or None:
+        """
+        :return: when the next batch gets ready if no more events come, None if nothing is pending
+        """
+        deadlines = [min(self._last[r] + self.debounce, self._first[r] + self.max_delay) for r in self._paths]
+        return min(deadlines) if deadlines else None
+
+    def pop_ready(self, now: float) -> Dict[str, Set[str]]:
+        """
+        Hands out the batches that are ready and forgets them
+        :return: changed paths by the resource
+        """
+        ready = {}
+        for resource in list(self._paths):
+            if now >= self._last[resource] + self.debounce or now >= self._first[resource] + self.max_delay:
+                ready[resource] = self._paths.pop(resource)
+                del self._first[resource], self._last[resource]
+        return ready
+
+    def clear(self) -> None:
+        self._paths.clear()
+        self._first.clear()
+        self._last.clear()
+
+    @property
+    def pending(self) -> int:
+        return sum(len(paths) for paths in self._paths.values())
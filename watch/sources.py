@@ -0,0 +1,199 @@
+# File system events
+# Changes are taken from watchdog if it is installed (pip install watchdog), it works on Linux, macOS and Windows.
+# Without it, inotify of Linux is used directly. Both give the changed paths the same way:
+# read() returns the paths that changed since the previous call
+import ctypes
+import ctypes.util
+import errno
+import os
+import queue
+import select
+import struct
+import sys
+
+from typing import Iterable, List
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+# read() returns it when events were lost, everything has to be scanned again
+OVERFLOW = None
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | \
+    _IN_DELETE_SELF | _IN_MOVE_SELF
+# struct inotify_event without its name: wd, mask, cookie, len
+_EVENT = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+def _directories(paths: Iterable[str]) -> List[str]:
+    # A file is watched through its directory
+    return sorted({os.path.abspath(p) if os.path.isdir(p) else os.path.dirname(os.path.abspath(p)) for p in paths})
+
+
+class InotifyWatcher:
+    """
+    Watches the directories and everything under them with inotify, every directory is watched on its own
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        """
+        :raises: OSError if inotify can't be used or there are more directories than the system lets watch
+        """
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f'Can\'t use inotify: {os.strerror(error)}')
+        self._directories = {}
+        try:
+            for directory in _directories(paths):
+                self._watch_tree(directory)
+        except BaseException:
+            self.close()
+            raise
+
+    def _watch(self, directory: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # The directory is gone already, its deletion is reported anyway
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            if error == errno.ENOSPC:
+                raise OSError(error, 'Too many directories to watch, raise fs.inotify.max_user_watches')
+            raise OSError(error, os.strerror(error), directory)
+        # A directory that was moved keeps its watch, only its path is updated
+        self._directories[wd] = directory
+
+    def _watch_tree(self, root: str) -> None:
+        self._watch(root)
+        for dirpath, dirnames, _ in os.walk(root):
+            for name in dirnames:
+                self._watch(os.path.join(dirpath, name))
+
+    def read(self, timeout: float) -> List[str or None]:
+        """
+        Waits for events at most timeout seconds
+        :return: changed paths, OVERFLOW among them if events were lost
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                changed.append(OVERFLOW)
+                continue
+            if mask & _IN_IGNORED:
+                self._directories.pop(wd, None)
+                continue
+            directory = self._directories.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                # Files could be written to the new directory before it was watched, it is reported as a whole
+                self._watch_tree(path)
+            changed.append(path)
+        return changed
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class _QueueHandler:
+    """Puts the paths of watchdog events to the queue"""
+
+    def __init__(self, events: queue.Queue):
+        self.events = events
+
+    def dispatch(self, event) -> None:
+        self.events.put(event.src_path)
+        if getattr(event, 'dest_path', None):
+            self.events.put(event.dest_path)
+
+
+class WatchdogWatcher:
+    """
+    Watches the directories and everything under them with watchdog, which runs its observer in a thread
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        self._events = queue.Queue()
+        self._observer = Observer()
+        handler = _QueueHandler(self._events)
+        for directory in _directories(paths):
+            self._observer.schedule(handler, directory, recursive=True)
+        self._observer.start()
+
+    def read(self, timeout: float) -> List[str or None]:
+        """
+        Waits for events at most timeout seconds
+        :return: changed paths
+        """
+        try:
+            changed = [self._events.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                changed.append(self._events.get_nowait())
+            except queue.Empty:
+                return changed
+
+    def close(self) -> None:
+        self._observer.stop()
+        self._observer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def open_watcher(paths: Iterable[str]) -> WatchdogWatcher or InotifyWatcher:
+    """
+    Starts watching the files and directories
+    :raises: ValueError if there is no way to watch them on this system
+    """
+    paths = list(paths)
+    if Observer is not None:
+        return WatchdogWatcher(paths)
+    if sys.platform.startswith('linux'):
+        return InotifyWatcher(paths)
+    raise ValueError('Watching needs the watchdog package on this system: pip install watchdog')
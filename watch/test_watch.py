@@ -0,0 +1,77 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from watch.batcher import ChangeBatcher
+from watch.sources import InotifyWatcher
+
+
+class BatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.batcher = ChangeBatcher(['/data', '/data/inner', '/etc/app.conf'], debounce=5, max_delay=60)
+
+    def test_paths_go_to_the_innermost_resource(self):
+        self.assertEqual('/data', self.batcher.resource_of('/data/a.txt'))
+        self.assertEqual('/data/inner', self.batcher.resource_of('/data/inner/b.txt'))
+        self.assertEqual('/etc/app.conf', self.batcher.resource_of('/etc/app.conf'))
+        self.assertIsNone(self.batcher.resource_of('/database/c.txt'))
+        self.assertFalse(self.batcher.add('/etc/other.conf', 0))
+
+    def test_burst_is_one_batch_after_quiet_period(self):
+        for i in range(10):
+            self.batcher.add('/data/a.txt', i)
+        self.batcher.add('/data/b.txt', 9)
+        self.assertEqual({}, self.batcher.pop_ready(13))
+        self.assertEqual(14, self.batcher.next_deadline())
+        self.assertEqual({'/data': {'/data/a.txt', '/data/b.txt'}}, self.batcher.pop_ready(14))
+        self.assertEqual(0, self.batcher.pending)
+        self.assertIsNone(self.batcher.next_deadline())
+
+    def test_constant_writes_are_backed_up_after_max_delay(self):
+        for i in range(0, 61, 2):
+            self.batcher.add('/data/log.txt', i)
+            ready = self.batcher.pop_ready(i)
+            if i < 60:
+                self.assertEqual({}, ready)
+        self.assertEqual({'/data': {'/data/log.txt'}}, ready)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+class InotifyTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'sub'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _read_all(self, watcher: InotifyWatcher) -> set:
+        changed = set()
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            paths = watcher.read(0.1)
+            if not paths and changed:
+                break
+            changed.update(paths)
+        return changed
+
+    def test_changes_in_new_directories_are_seen(self):
+        with InotifyWatcher([self.root]) as watcher:
+            with open(os.path.join(self.root, 'sub', 'a.txt'), 'wb') as f:
+                f.write(b'a')
+            os.makedirs(os.path.join(self.root, 'new'))
+            changed = self._read_all(watcher)
+            self.assertIn(os.path.join(self.root, 'sub', 'a.txt'), changed)
+            self.assertIn(os.path.join(self.root, 'new'), changed)
+
+            # The new directory is watched too
+            with open(os.path.join(self.root, 'new', 'b.txt'), 'wb') as f:
+                f.write(b'b')
+            self.assertIn(os.path.join(self.root, 'new', 'b.txt'), self._read_all(watcher))
+
+
+if __name__ == '__main__':
+    unittest.main()